@@ -50,12 +50,15 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'shop.middleware.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    'shop.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.middleware.ReplicaRoutingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
@@ -81,21 +84,86 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'DjangoShopProject.wsgi.application'
 
+# Serve the read-only catalog endpoints from native async views.
+# Only worthwhile when running under ASGI (DjangoShopProject.asgi).
+ASYNC_CATALOG = os.getenv('ASYNC_CATALOG', 'False') == 'True'
+
 
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.postgresql',
+        'ENGINE': os.getenv('DATABASE_ENGINE', 'django.db.backends.postgresql'),
         'NAME': os.getenv('DATABASE_NAME', 'shop_db'),
         'USER': os.getenv('DATABASE_USER', 'postgres'),
         'PASSWORD': os.getenv('DATABASE_PASSWORD', ''),
         'HOST': os.getenv('DATABASE_HOST', 'localhost'),
         'PORT': os.getenv('DATABASE_PORT', '5432'),
+        # Seconds a connection is reused across requests; 0 closes it after each
+        'CONN_MAX_AGE': int(os.getenv('DATABASE_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+    }
+}
+
+# psycopg 3 connection pool instead of persistent connections; suits ASGI,
+# where threads come and go
+if os.getenv('DATABASE_POOL', 'False') == 'True':
+    DATABASES['default']['CONN_MAX_AGE'] = 0
+    DATABASES['default']['OPTIONS'] = {'pool': {
+        'min_size': int(os.getenv('DATABASE_POOL_MIN_SIZE', 2)),
+        'max_size': int(os.getenv('DATABASE_POOL_MAX_SIZE', 10)),
+    }}
+
+# Read replicas (shop/routers.py) as comma-separated hosts, or database files
+# on SQLite; each otherwise shares the primary's settings
+DATABASE_REPLICAS = []
+for index, location in enumerate(filter(None, os.getenv('DATABASE_REPLICA_HOSTS', '').split(','))):
+    alias = f'replica_{index}'
+    location_key = 'NAME' if DATABASES['default']['ENGINE'].endswith('sqlite3') else 'HOST'
+    DATABASES[alias] = {**DATABASES['default'], location_key: location.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ['shop.routers.PrimaryReplicaRouter']
+
+# Seconds a user's reads stay on the primary after a write, so they see
+# their own changes before the replicas do
+REPLICA_STICKY_SECONDS = int(os.getenv('REPLICA_STICKY_SECONDS', 5))
+
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'shop-cache'),
     }
 }
 
+# Seconds a cached product/category response is kept
+CATALOG_CACHE_TIMEOUT = int(os.getenv('CATALOG_CACHE_TIMEOUT', 300))
+
+# Seconds a JWT-authenticated user is served from the cache between saves
+AUTH_USER_CACHE_TIMEOUT = int(os.getenv('AUTH_USER_CACHE_TIMEOUT', 60))
+
+# Responses smaller than this many bytes are sent uncompressed
+GZIP_MIN_LENGTH = int(os.getenv('GZIP_MIN_LENGTH', 1024))
+
+# Serve product, order and review list/retrieve from values() rows
+# (shop/fast_serializers.py) instead of the DRF serializers
+FAST_READ_SERIALIZERS = os.getenv('FAST_READ_SERIALIZERS', 'True') == 'True'
+
+# Seconds stock stays reserved for a cart line after it was last added to
+CART_RESERVATION_TTL = int(os.getenv('CART_RESERVATION_TTL', 15 * 60))
+
+# Log requests taking at least this many milliseconds, with their SQL and
+# where it was run from, to the shop.metrics logger; 0 turns it off
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 0))
+
+# Queries of a logged request taking at least this many milliseconds are
+# logged with where they were run from; faster ones with their SQL only
+SLOW_QUERY_MS = int(os.getenv('SLOW_QUERY_MS', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -135,6 +203,11 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Product image variants (shop/images.py): longest side in pixels per size,
+# and the threads that render them; 0 renders inline when the upload commits
+PRODUCT_IMAGE_SIZES = {'thumb': 160, 'small': 320, 'medium': 640, 'large': 1280}
+PRODUCT_IMAGE_WORKERS = int(os.getenv('PRODUCT_IMAGE_WORKERS', 1))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -144,16 +217,48 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
      'DEFAULT_RENDERER_CLASSES': [
-         'rest_framework.renderers.JSONRenderer',
+         'shop.renderers.FastJSONRenderer',
      ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'shop.authentication.CachedJWTAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticatedOrReadOnly',
     ],
+    # Token buckets for AuthViewSet (shop/throttling.py): capacity/refill period
+    'DEFAULT_THROTTLE_RATES': {
+        'auth_ip': os.getenv('AUTH_IP_THROTTLE_RATE', '30/min'),
+        'auth_account': os.getenv('AUTH_ACCOUNT_THROTTLE_RATE', '5/min'),
+    },
 }
 
+# Threads that hash passwords for the async auth views; bounds the CPU a
+# login flood can take from the rest of the API
+PASSWORD_HASHING_WORKERS = int(os.getenv('PASSWORD_HASHING_WORKERS', 2))
+
+# Admin changelists (EstimatedCountPaginator) show the planner's row estimate
+# instead of an exact COUNT(*) above this many rows; PostgreSQL only
+ADMIN_EXACT_COUNT_LIMIT = int(os.getenv('ADMIN_EXACT_COUNT_LIMIT', 10000))
+
+# Idempotency-Key handling (shop/idempotency.py): seconds a stored response
+# is replayed, a duplicate waits for the first request, and an unfinished
+# first request holds its key before another may take it over
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+IDEMPOTENCY_WAIT_TIMEOUT = int(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', 10))
+IDEMPOTENCY_LOCK_TIMEOUT = int(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT', 60))
+
+# Database task queue (shop/queue.py), run by manage.py run_workers. With
+# TASK_QUEUE_EAGER, tasks also run in-process right after commit (development)
+TASK_WORKERS = int(os.getenv('TASK_WORKERS', 4))
+TASK_MAX_ATTEMPTS = int(os.getenv('TASK_MAX_ATTEMPTS', 5))
+TASK_RETRY_BACKOFF = int(os.getenv('TASK_RETRY_BACKOFF', 10))
+TASK_RETRY_BACKOFF_MAX = int(os.getenv('TASK_RETRY_BACKOFF_MAX', 60 * 60))
+TASK_LEASE_SECONDS = int(os.getenv('TASK_LEASE_SECONDS', 10 * 60))
+TASK_QUEUE_EAGER = os.getenv('TASK_QUEUE_EAGER', 'False') == 'True'
+
+EMAIL_BACKEND = os.getenv('EMAIL_BACKEND', 'django.core.mail.backends.console.EmailBackend')
+DEFAULT_FROM_EMAIL = os.getenv('DEFAULT_FROM_EMAIL', 'shop@localhost')
+
 CORS_ALLOWED_ORIGINS = [
     "http://localhost:3000",
     "http://127.0.0.1:3000",
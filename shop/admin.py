@@ -1,9 +1,88 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
+from django.contrib.admin.utils import get_fields_from_path
+from django.contrib.admin.views.main import PAGE_VAR
+from django.contrib.admin.widgets import AutocompleteSelect
 from django.contrib.auth.admin import UserAdmin
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from .analytics import add_sales, remove_sales
 from .models import (
     User, Category, Product, Order, OrderItem,
-    ShoppingCart, CartItem, Review, UserAddress, Payment
+    ShoppingCart, CartItem, Review, UserAddress, Payment, StockReservation, Task
 )
+from .order_states import transition
+from .pagination import EstimatedCountPaginator
+
+
+class AutocompleteFilter(admin.SimpleListFilter):
+    """List filter that picks one related object with the admin autocomplete.
+
+    Unlike a plain related-field filter it never loads the related table: the
+    search goes through the related model's admin ``search_fields``. Set
+    ``parameter_name`` to the relation to filter on, e.g. ``'cart__user'``.
+    """
+    template = 'admin/shop/autocomplete_filter.html'
+
+    def __init__(self, request, params, model, model_admin):
+        self.field = get_fields_from_path(model, self.parameter_name)[-1]
+        self.title = self.title or self.field.verbose_name
+        self.admin_site = model_admin.admin_site
+        self.query_string = '?'
+        super().__init__(request, params, model, model_admin)
+
+    def lookups(self, request, model_admin):
+        return ()
+
+    def has_output(self):
+        return True
+
+    def choices(self, changelist):
+        self.query_string = changelist.get_query_string(remove=[self.parameter_name, PAGE_VAR])
+        yield {
+            'selected': self.value() is None,
+            'query_string': self.query_string,
+            'display': _('All'),
+        }
+
+    def rendered_widget(self):
+        widget = AutocompleteSelect(self.field, self.admin_site, attrs={'data-filter-query': self.query_string})
+        field = forms.ModelChoiceField(self.field.remote_field.model._default_manager.all(), widget=widget)
+        return field.widget.render(self.parameter_name, self.value())
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.parameter_name: self.value()})
+        return queryset
+
+
+class ScalableChangelistMixin:
+    """Changelist settings for tables too large to count or list in full."""
+    paginator = EstimatedCountPaginator
+    # The unfiltered total is a second COUNT(*) per page
+    show_full_result_count = False
+
+    @property
+    def media(self):
+        media = super().media
+        if any(isinstance(spec, type) and issubclass(spec, AutocompleteFilter) for spec in self.list_filter):
+            media += AutocompleteSelect(None, self.admin_site).media
+            media += forms.Media(js=['shop/admin/autocomplete_filter.js'])
+        return media
+
+
+class CategoryFilter(AutocompleteFilter):
+    parameter_name = 'category'
+
+
+class CartUserFilter(AutocompleteFilter):
+    title = _('user')
+    parameter_name = 'cart__user'
+
+
+class OrderUserFilter(AutocompleteFilter):
+    parameter_name = 'user'
 
 
 @admin.register(User)
@@ -37,10 +116,11 @@ class CategoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(Product)
-class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'category', 'price', 'stock', 'is_active', 'created_at')
-    list_filter = ('category', 'is_active', 'created_at')
-    search_fields = ('name', 'description')
+class ProductAdmin(ScalableChangelistMixin, admin.ModelAdmin):
+    list_display = ('name', 'sku', 'category', 'price', 'stock', 'is_active', 'created_at')
+    list_select_related = ('category',)
+    list_filter = (CategoryFilter, 'is_active', 'created_at')
+    search_fields = ('sku', 'name', 'description')
     list_editable = ('price', 'stock', 'is_active')
     raw_id_fields = ('category',)
     readonly_fields = ('created_at', 'updated_at')
@@ -51,6 +131,10 @@ class OrderItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('orderItemId', 'get_total_price')
     fields = ('orderItemId', 'product', 'quantity', 'price', 'get_total_price')
+    autocomplete_fields = ('product',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('product')
 
     def get_total_price(self, obj):
         return obj.get_total_price()
@@ -59,31 +143,55 @@ class OrderItemInline(admin.TabularInline):
 
 
 @admin.register(Order)
-class OrderAdmin(admin.ModelAdmin):
+class OrderAdmin(ScalableChangelistMixin, admin.ModelAdmin):
     list_display = ('orderId', 'user', 'orderDate', 'totalAmount', 'status', 'created_at')
-    list_filter = ('status', 'orderDate', 'created_at')
+    list_select_related = ('user',)
+    list_filter = ('status', OrderUserFilter, 'orderDate', 'created_at')
     search_fields = ('orderId', 'user__email', 'user__username')
-    readonly_fields = ('orderId', 'orderDate', 'created_at', 'updated_at')
+    # Status changes go through transition(), via the actions below
+    readonly_fields = ('orderId', 'orderDate', 'status', 'created_at', 'updated_at')
+    autocomplete_fields = ('user',)
     inlines = [OrderItemInline]
     actions = ['mark_as_shipped', 'mark_as_delivered']
 
+    def get_queryset(self, request):
+        # Order.__str__ reads the user, e.g. in autocomplete results
+        return super().get_queryset(request).select_related('user')
+
+    def save_related(self, request, form, formsets, change):
+        # Inline edits change the order lines; re-apply them to the sales rollups
+        if change:
+            remove_sales([form.instance.pk])
+        super().save_related(request, form, formsets, change)
+        add_sales([form.instance.pk])
+
+    def change_status(self, request, queryset, status):
+        changed, invalid = transition(queryset, status, strict=False)
+        self.message_user(request, f"{len(changed)} order(s) marked as {status}.")
+        if invalid:
+            self.message_user(
+                request, f"{len(invalid)} order(s) skipped: their status does not allow it.", messages.WARNING
+            )
+
     def mark_as_shipped(self, request, queryset):
-        queryset.update(status='shipped')
+        self.change_status(request, queryset, 'shipped')
 
     mark_as_shipped.short_description = "Mark selected orders as shipped"
 
     def mark_as_delivered(self, request, queryset):
-        queryset.update(status='delivered')
+        self.change_status(request, queryset, 'delivered')
 
     mark_as_delivered.short_description = "Mark selected orders as delivered"
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(ScalableChangelistMixin, admin.ModelAdmin):
     list_display = ('orderItemId', 'order', 'product', 'quantity', 'price', 'get_total_price')
+    list_select_related = ('order__user', 'product')
     list_filter = ('order__status',)
     search_fields = ('order__orderId', 'product__name')
     readonly_fields = ('orderItemId',)
+    autocomplete_fields = ('order', 'product')
 
     def get_total_price(self, obj):
         return obj.get_total_price()
@@ -96,6 +204,10 @@ class CartItemInline(admin.TabularInline):
     extra = 0
     readonly_fields = ('get_total_price',)
     fields = ('product', 'quantity', 'get_total_price')
+    autocomplete_fields = ('product',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total_price().select_related('product')
 
     def get_total_price(self, obj):
         return obj.get_total_price()
@@ -104,34 +216,56 @@ class CartItemInline(admin.TabularInline):
 
 
 @admin.register(ShoppingCart)
-class ShoppingCartAdmin(admin.ModelAdmin):
+class ShoppingCartAdmin(ScalableChangelistMixin, admin.ModelAdmin):
     list_display = ('cartId', 'user', 'createdAt', 'get_total_items', 'get_total_price')
     search_fields = ('user__email', 'user__username')
     readonly_fields = ('cartId', 'createdAt', 'updated_at')
+    autocomplete_fields = ('user',)
     inlines = [CartItemInline]
 
+    def get_queryset(self, request):
+        # ShoppingCart.__str__ reads the user, e.g. in autocomplete results
+        return super().get_queryset(request).with_totals().select_related('user')
+
     def get_total_items(self, obj):
-        return obj.cart_items.count()
+        return obj.get_total_items()
 
     get_total_items.short_description = 'Total Items'
+    get_total_items.admin_order_field = 'total_items'
 
     def get_total_price(self, obj):
-        return sum(item.get_total_price() for item in obj.cart_items.all())
+        return obj.get_total_price()
 
     get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'total_price'
 
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(ScalableChangelistMixin, admin.ModelAdmin):
     list_display = ('cartItemId', 'cart', 'product', 'quantity', 'get_total_price')
-    list_filter = ('cart__user',)
+    list_select_related = ('cart__user', 'product')
+    list_filter = (CartUserFilter,)
     search_fields = ('cart__user__email', 'product__name')
     readonly_fields = ('cartItemId',)
+    autocomplete_fields = ('cart', 'product')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_total_price()
 
     def get_total_price(self, obj):
         return obj.get_total_price()
 
     get_total_price.short_description = 'Total Price'
+    get_total_price.admin_order_field = 'total_price'
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('reservationId', 'product', 'quantity', 'expires_at', 'created_at')
+    list_filter = ('expires_at',)
+    search_fields = ('product__name', 'cart_item__cart__user__email')
+    readonly_fields = ('reservationId', 'created_at')
+    raw_id_fields = ('cart_item', 'product')
 
 
 @admin.register(Review)
@@ -153,19 +287,30 @@ class UserAddressAdmin(admin.ModelAdmin):
 
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(ScalableChangelistMixin, admin.ModelAdmin):
     list_display = ('paymentId', 'order', 'amount', 'paymentMethod', 'payment_status', 'paymentDate')
+    list_select_related = ('order__user',)
     list_filter = ('paymentMethod', 'payment_status', 'paymentDate')
     search_fields = ('paymentId', 'order__orderId', 'transaction_id')
     readonly_fields = ('paymentId', 'paymentDate', 'created_at')
+    autocomplete_fields = ('order',)
     actions = ['mark_as_completed', 'mark_as_failed']
 
     def mark_as_completed(self, request, queryset):
-        queryset.update(payment_status='completed')
-        # Also update related orders
-        for payment in queryset:
-            payment.order.status = 'confirmed'
-            payment.order.save()
+        with transaction.atomic():
+            # Confirm the orders first; like process_payment, a payment whose
+            # order cannot be confirmed is left as it is
+            changed, invalid = transition(
+                Order.objects.filter(pk__in=queryset.values('order_id')), 'confirmed', strict=False
+            )
+            queryset.filter(order__status='confirmed').update(payment_status='completed')
+        if invalid:
+            self.message_user(
+                request,
+                f"{len(invalid)} order(s) left unconfirmed and their payments not completed: "
+                "their status does not allow it.",
+                messages.WARNING
+            )
 
     mark_as_completed.short_description = "Mark selected payments as completed"
 
@@ -175,7 +320,22 @@ class PaymentAdmin(admin.ModelAdmin):
     mark_as_failed.short_description = "Mark selected payments as failed"
 
 
+@admin.register(Task)
+class TaskAdmin(admin.ModelAdmin):
+    list_display = ('name', 'status', 'attempts', 'max_attempts', 'run_at', 'updated_at')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'updated_at', 'locked_at', 'last_error')
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        queryset.exclude(status='running').update(
+            status='queued', attempts=0, run_at=timezone.now(), updated_at=timezone.now()
+        )
+
+    retry.short_description = "Retry selected tasks now"
+
+
 # Custom admin site header
 admin.site.site_header = "Shopping App Administration"
 admin.site.site_title = "Shopping App Admin"
-admin.site.index_title = "Welcome to Shopping App Admin"
\ No newline at end of file
+admin.site.index_title = "Welcome to Shopping App Admin"
@@ -0,0 +1,144 @@
+"""Daily sales rollups, kept in step with orders.
+
+Every rollup row holds the orders, units and revenue of one day and order
+status, overall (``DailySales``), per category and per product. Adding or
+removing an order applies its lines as deltas: rows are created on demand
+with ``INSERT ... ON CONFLICT DO NOTHING`` and then incremented with one
+F() ``UPDATE`` per table, so concurrent orders never lose counts. Callers
+must run these inside the transaction that writes the order.
+"""
+from collections import defaultdict
+from datetime import datetime, time
+from decimal import Decimal
+
+from django.db.models import Case, Count, DecimalField, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .models import DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem
+
+MONEY = DecimalField(max_digits=14, decimal_places=2)
+ROLLUPS = [
+    (DailySales, ()),
+    (DailyCategorySales, ('category_id',)),
+    (DailyProductSales, ('product_id',)),
+]
+
+
+def _order_lines(order_ids):
+    # LEFT JOIN: an order without lines still counts as an order
+    return Order.objects.filter(pk__in=order_ids).order_by().values_list(
+        'pk', 'orderDate', 'status',
+        'order_items__product_id', 'order_items__product__category_id',
+        'order_items__quantity', 'order_items__price',
+    )
+
+
+def _collect(lines, status=None):
+    """Per-rollup ``{key: [order ids, units, revenue]}`` for ``lines``."""
+    totals = {model: defaultdict(lambda: [set(), 0, Decimal('0')]) for model, _ in ROLLUPS}
+    for order_id, order_date, order_status, product_id, category_id, quantity, price in lines:
+        base = (timezone.localdate(order_date), status or order_status)
+        keys = {DailySales: base}
+        if product_id is not None:
+            keys[DailyCategorySales] = base + (category_id,)
+            keys[DailyProductSales] = base + (product_id,)
+        for model, key in keys.items():
+            entry = totals[model][key]
+            entry[0].add(order_id)
+            if product_id is not None:
+                entry[1] += quantity
+                entry[2] += quantity * price
+    return totals
+
+
+def _apply(totals, sign):
+    for model, fields in ROLLUPS:
+        entries = totals[model]
+        if not entries:
+            continue
+        key_fields = ('day', 'status') + fields
+        model.objects.bulk_create(
+            [model(**dict(zip(key_fields, key))) for key in entries], ignore_conflicts=True
+        )
+        matches = [(Q(**dict(zip(key_fields, key))), value) for key, value in entries.items()]
+        condition = Q()
+        for match, _ in matches:
+            condition |= match
+        model.objects.filter(condition).update(
+            orders=F('orders') + Case(
+                *[When(match, then=Value(sign * len(ids))) for match, (ids, _, _) in matches],
+                output_field=IntegerField(),
+            ),
+            units=F('units') + Case(
+                *[When(match, then=Value(sign * units)) for match, (_, units, _) in matches],
+                output_field=IntegerField(),
+            ),
+            revenue=F('revenue') + Case(
+                *[When(match, then=Value(sign * revenue)) for match, (_, _, revenue) in matches],
+                output_field=MONEY,
+            ),
+        )
+
+
+def add_sales(order_ids):
+    """Count ``order_ids`` (with their lines written) under their current status."""
+    _apply(_collect(_order_lines(order_ids)), 1)
+
+
+def remove_sales(order_ids):
+    """Take ``order_ids`` out of the rollups of their current status."""
+    _apply(_collect(_order_lines(order_ids)), -1)
+
+
+def move_sales(order_ids, old_status, new_status):
+    """Move ``order_ids`` from the ``old_status`` rollups to ``new_status``."""
+    if old_status == new_status:
+        return
+    lines = list(_order_lines(order_ids))
+    _apply(_collect(lines, old_status), -1)
+    _apply(_collect(lines, new_status), 1)
+
+
+def rebuild_sales(since=None, batch_size=1000):
+    """Recompute the rollups from orders, for every day or from ``since`` on.
+
+    Aggregation happens in the database; only the grouped rows come back.
+    Returns the number of rollup rows written.
+    """
+    orders = Order.objects.all()
+    if since is not None:
+        start = timezone.make_aware(datetime.combine(since, time.min))
+        orders = orders.filter(orderDate__gte=start)
+    line_total = F('quantity') * F('price')
+    items = OrderItem.objects.filter(order__in=orders).annotate(
+        day=TruncDate('order__orderDate'), status=F('order__status')
+    )
+    sources = {
+        DailySales: orders.annotate(day=TruncDate('orderDate')).values('day', 'status').annotate(
+            orders=Count('pk', distinct=True),
+            units=Coalesce(Sum('order_items__quantity'), 0),
+            revenue=Coalesce(
+                Sum(F('order_items__quantity') * F('order_items__price'), output_field=MONEY),
+                Value(Decimal('0')), output_field=MONEY,
+            ),
+        ),
+        DailyCategorySales: items.values('day', 'status', category_id=F('product__category_id')).annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum(line_total, output_field=MONEY),
+        ),
+        DailyProductSales: items.values('day', 'status', 'product_id').annotate(
+            orders=Count('order', distinct=True), units=Sum('quantity'), revenue=Sum(line_total, output_field=MONEY),
+        ),
+    }
+    written = 0
+    for model, _ in ROLLUPS:
+        stale = model.objects.all() if since is None else model.objects.filter(day__gte=since)
+        stale.delete()
+        batch = []
+        for row in sources[model].order_by().iterator(chunk_size=batch_size):
+            batch.append(model(**row))
+            if len(batch) >= batch_size:
+                written += len(model.objects.bulk_create(batch))
+                batch = []
+        written += len(model.objects.bulk_create(batch))
+    return written
@@ -0,0 +1,253 @@
+"""Native async versions of the read-only catalog endpoints.
+
+Enabled with ``ASYNC_CATALOG = True``; see ``shop/urls.py``. Under ASGI these
+run on the event loop with Django's async ORM instead of occupying a worker
+thread per request. Anything they do not handle natively (writes, search,
+unusual query parameters) is passed on to the regular ViewSet. Login and
+registration are served here too, so password hashing stays off the thread
+every sync view and async ORM call shares.
+"""
+import asyncio
+import functools
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from django.http import Http404, HttpResponse
+from django.urls import re_path
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import exceptions, status
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from . import views
+from .authentication import AsyncJWTAuthentication
+from .cache import aget_catalog_version, akeep_entry, conditional_response, last_modified
+from .models import Category, Product, Review
+from .pagination import AsyncCursorPagination
+from .serializers import CategorySerializer, ProductSerializer, ReviewSerializer
+
+DETAIL_ACTIONS = {'get': 'retrieve', 'put': 'update', 'patch': 'partial_update', 'delete': 'destroy'}
+
+
+def render(data, status=status.HTTP_200_OK):
+    # The first configured renderer, as the sync views use for JSON clients
+    renderer = api_settings.DEFAULT_RENDERER_CLASSES[0]()
+    return HttpResponse(renderer.render(data), content_type=renderer.media_type, status=status)
+
+
+def catalog_view(viewset, actions):
+    """Serve GET with the decorated coroutine, everything else with ``viewset``.
+
+    The coroutine may return ``None`` to hand a GET over to the ViewSet too.
+    """
+    fallback = sync_to_async(viewset.as_view(actions))
+
+    def decorator(handler):
+        @csrf_exempt
+        @functools.wraps(handler)
+        async def view(request, *args, **kwargs):
+            response = None
+            if request.method in ('GET', 'HEAD'):
+                try:
+                    response = await handler(request, *args, **kwargs)
+                except Http404 as exc:
+                    response = render({'detail': str(exc)}, status.HTTP_404_NOT_FOUND)
+                except exceptions.APIException as exc:
+                    detail = exc.detail if isinstance(exc.detail, (list, dict)) else {'detail': exc.detail}
+                    response = render(detail, exc.status_code)
+                    if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                        response['WWW-Authenticate'] = AsyncJWTAuthentication().authenticate_header(request)
+            if response is None:
+                response = await fallback(request, *args, **kwargs)
+            return response
+        return view
+    return decorator
+
+
+async def cached(request, build):
+    """Async counterpart of ``CatalogCacheMixin.cached_response``."""
+    key = 'catalog-async:%s:%s' % (await aget_catalog_version(), request.get_full_path())
+    entry = await cache.aget(key)
+    if entry is None:
+        data = await build()
+        entry = (data, last_modified())
+        if await akeep_entry():
+            await cache.aset(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+    data, modified = entry
+    return conditional_response(request, render(data), key, modified)
+
+
+async def get_or_404(queryset, pk):
+    try:
+        return await queryset.aget(pk=pk)
+    except (queryset.model.DoesNotExist, ValueError):
+        raise Http404(f'No {queryset.model._meta.object_name} matches the given query.')
+
+
+def product_queryset():
+    return Product.objects.filter(is_active=True).select_related('category')
+
+
+@catalog_view(views.ProductViewSet, {'get': 'list', 'post': 'create'})
+async def product_list(request):
+    if request.GET.get('q', '').strip():
+        return None
+
+    async def build():
+        queryset = product_queryset()
+        category = request.GET.get('category')
+        if category:
+            queryset = queryset.filter(category_id=category)
+        paginator = AsyncCursorPagination(views.ProductCursorPagination.ordering)
+        page = await paginator.apaginate_queryset(queryset, request)
+        return paginator.get_paginated_data(
+            ProductSerializer(page, many=True, context={'request': request}).data
+        )
+
+    return await cached(request, build)
+
+
+@catalog_view(views.ProductViewSet, DETAIL_ACTIONS)
+async def product_detail(request, pk):
+    async def build():
+        product = await get_or_404(product_queryset(), pk)
+        return ProductSerializer(product, context={'request': request}).data
+
+    return await cached(request, build)
+
+
+@catalog_view(views.CategoryViewSet, {'get': 'list', 'post': 'create'})
+async def category_list(request):
+    try:
+        number = int(request.GET.get('page', 1))
+    except ValueError:
+        return None
+
+    async def build():
+        queryset = Category.objects.all()
+        page_size = api_settings.PAGE_SIZE
+        count = await queryset.acount()
+        pages = max(1, math.ceil(count / page_size))
+        if not 1 <= number <= pages:
+            raise exceptions.NotFound('Invalid page.')
+        results = [obj async for obj in queryset[(number - 1) * page_size:number * page_size]]
+
+        url = request.build_absolute_uri()
+        previous = None
+        if number == 2:
+            previous = remove_query_param(url, 'page')
+        elif number > 2:
+            previous = replace_query_param(url, 'page', number - 1)
+        return {
+            'count': count,
+            'next': replace_query_param(url, 'page', number + 1) if number < pages else None,
+            'previous': previous,
+            'results': CategorySerializer(results, many=True, context={'request': request}).data,
+        }
+
+    return await cached(request, build)
+
+
+@catalog_view(views.CategoryViewSet, DETAIL_ACTIONS)
+async def category_detail(request, pk):
+    async def build():
+        category = await get_or_404(Category.objects.all(), pk)
+        return CategorySerializer(category, context={'request': request}).data
+
+    return await cached(request, build)
+
+
+@catalog_view(views.ReviewViewSet, {'get': 'product_reviews'})
+async def product_reviews(request):
+    auth = await AsyncJWTAuthentication().aauthenticate(request)
+    if auth is None:
+        raise exceptions.NotAuthenticated()
+    # As DRF would: PrimaryReplicaRouter looks up the user's read-your-writes pin here
+    request.user = auth[0]
+
+    product_id = request.GET.get('product_id')
+    if not product_id:
+        return render({'error': 'product_id parameter is required'}, status.HTTP_400_BAD_REQUEST)
+
+    reviews = Review.objects.filter(product_id=product_id).select_related('user', 'product')
+    paginator = AsyncCursorPagination(views.ReviewCursorPagination.ordering)
+    page = await paginator.apaginate_queryset(reviews, request)
+    return render(paginator.get_paginated_data(
+        ReviewSerializer(page, many=True, context={'request': request}).data
+    ))
+
+
+_hashing_pool = None
+
+
+def _hashing_job(func, *args):
+    # Pool threads hold their own connections; recycle them as a request would
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+async def run_hashing(func, *args):
+    """Run password-hashing ``func`` on the ``PASSWORD_HASHING_WORKERS`` pool.
+
+    Bounding the pool bounds the CPU a credential-stuffing burst can take;
+    excess attempts queue instead of starving catalog requests. With 0
+    workers ``func`` runs on the shared sync thread, like a sync view.
+    """
+    global _hashing_pool
+    if not settings.PASSWORD_HASHING_WORKERS:
+        return await sync_to_async(func)(*args)
+    if _hashing_pool is None:
+        _hashing_pool = ThreadPoolExecutor(settings.PASSWORD_HASHING_WORKERS, thread_name_prefix='password-hashing')
+    return await asyncio.get_running_loop().run_in_executor(
+        _hashing_pool, functools.partial(_hashing_job, func, *args)
+    )
+
+
+def auth_view(handler):
+    """Serve POST with ``handler(data) -> (data, status)`` behind the auth throttles."""
+    @csrf_exempt
+    @functools.wraps(handler)
+    async def view(request):
+        if request.method != 'POST':
+            exc = exceptions.MethodNotAllowed(request.method)
+            return render({'detail': exc.detail}, exc.status_code)
+        drf_request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES])
+        try:
+            data = drf_request.data
+        except exceptions.ParseError as exc:
+            return render({'detail': exc.detail}, exc.status_code)
+
+        for throttle in views.AuthViewSet().get_throttles():
+            if not await throttle.aallow_request(drf_request, None):
+                exc = exceptions.Throttled(throttle.wait())
+                response = render({'detail': exc.detail}, exc.status_code)
+                response['Retry-After'] = '%d' % math.ceil(exc.wait)
+                return response
+
+        data, response_status = await run_hashing(handler, data)
+        return render(data, response_status)
+    return view
+
+
+login = auth_view(views.login_user)
+register = auth_view(views.register_user)
+
+
+# Numeric pks only, so list actions such as products/export/ reach the router
+urlpatterns = [
+    re_path(r'^products/$', product_list, name='product-list'),
+    re_path(r'^products/(?P<pk>\d+)/$', product_detail, name='product-detail'),
+    re_path(r'^categories/$', category_list, name='category-list'),
+    re_path(r'^categories/(?P<pk>\d+)/$', category_detail, name='category-detail'),
+    re_path(r'^reviews/product_reviews/$', product_reviews, name='review-product-reviews'),
+    re_path(r'^auth/login/$', login, name='auth-login'),
+    re_path(r'^auth/register/$', register, name='auth-register'),
+]
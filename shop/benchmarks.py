@@ -0,0 +1,412 @@
+"""Benchmarks for the shop API.
+
+Not collected by the default test run (the module name does not match
+``test*.py``); run them explicitly against the test database with
+
+    python manage.py test shop.benchmarks
+"""
+import asyncio
+import gzip
+import statistics
+import time
+import tracemalloc
+from datetime import timedelta
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import connection
+from django.db.models import Prefetch
+from django.conf import settings
+from django.test import AsyncClient, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .models import User, Order, OrderItem, Product, ShoppingCart, CartItem, Review, UserAddress
+from .tests import PAGE_SIZE, async_catalog, create_user, seed_catalog, seed_orders, seed_reviews
+from .authentication import CachedJWTAuthentication
+from .fast_serializers import plan_for
+from .renderers import FastJSONRenderer
+from .serializers import OrderSerializer, ProductSerializer, ReviewSerializer
+from .throttling import TokenBucketThrottle
+from .views import OrderViewSet
+
+
+def measure(func, repeat=20):
+    """Run ``func`` ``repeat`` times, return (queries per call, ms per call)."""
+    func()  # warm up
+    with CaptureQueriesContext(connection) as ctx:
+        start = time.perf_counter()
+        for _ in range(repeat):
+            func()
+        elapsed = time.perf_counter() - start
+    return len(ctx.captured_queries) // repeat, elapsed * 1000 / repeat
+
+
+def report(title, rows):
+    print(f'\n{title}')
+    for label, queries, ms in rows:
+        print(f'  {label:<32} {queries:>4} queries  {ms:>8.2f} ms')
+
+
+class EndpointQueryBenchmark(TestCase):
+    """Queries and latency of list/detail on every router endpoint."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_user('staff@example.com', is_staff=True)
+        cls.user = create_user('customer@example.com')
+        cls.products = seed_catalog(categories=10, products_per_category=20)
+        cls.orders = seed_orders(cls.user, cls.products, 100, items_per_order=5)
+        seed_reviews(cls.products, 50)
+        for product in cls.products[:20]:
+            Review.objects.create(product=product, user=cls.user, rating=5)
+        cart = ShoppingCart.objects.create(user=cls.user)
+        for product in cls.products[:50]:
+            CartItem.objects.create(cart=cart, product=product, quantity=1)
+        for i in range(10):
+            UserAddress.objects.create(user=cls.user, street=f'{i} Main St', city='Almaty', state='AL', zipCode='050000')
+
+    def test_endpoints(self):
+        client = APIClient()
+        rows = []
+        for name, user in [
+            ('user-list', self.staff),
+            ('category-list', self.user),
+            ('product-list', self.user),
+            ('order-list', self.user),
+            ('order-list', self.staff),
+            ('cart-list', self.user),
+            ('review-list', self.user),
+            ('address-list', self.user),
+            ('payment-list', self.user),
+        ]:
+            client.force_authenticate(user)
+            url = reverse(name)
+            queries, ms = measure(lambda: client.get(url))
+            rows.append((f'{name} ({"staff" if user.is_staff else "user"})', queries, ms))
+        client.force_authenticate(self.user)
+        order_url = reverse('order-detail', args=[self.orders[0].pk])
+        rows.append(('order-detail',) + measure(lambda: client.get(order_url)))
+        report('Endpoint query budgets', rows)
+
+
+class SerializerFastPathBenchmark(TestCase):
+    """DRF serializers against their ``values()`` plans at 10, 100 and 1000 rows.
+
+    Both sides include their queries. Allocations are the bytes tracemalloc
+    sees allocated over one run, so they include the rows themselves.
+    """
+
+    sizes = (10, 100, 1000)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('customer@example.com')
+        cls.products = seed_catalog(categories=10, products_per_category=100)
+        seed_orders(cls.user, cls.products, 1000)
+        Review.objects.bulk_create([
+            Review(product=product, user=cls.user, rating=i % 5 + 1, comment='Fine')
+            for i, product in enumerate(cls.products)
+        ])
+
+    def querysets(self):
+        return [
+            (ProductSerializer, Product.objects.select_related('category')),
+            (OrderSerializer, Order.objects.select_related('user').prefetch_related(
+                Prefetch('order_items', queryset=OrderItem.objects.select_related('product'))
+            )),
+            (ReviewSerializer, Review.objects.select_related('user', 'product')),
+        ]
+
+    def allocated(self, func):
+        tracemalloc.start()
+        try:
+            func()
+            return tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    def test_serializers(self):
+        print('\nSerializer fast path (per row)')
+        for serializer_class, queryset in self.querysets():
+            plan = plan_for(serializer_class)
+            for size in self.sizes:
+                page = queryset.order_by('pk')[:size]
+
+                def drf():
+                    return serializer_class(list(page.all()), many=True).data
+
+                def fast():
+                    return plan.serialize(plan.values(page), {}, page.db)
+
+                renderer = JSONRenderer()
+                assert renderer.render(drf()) == renderer.render(fast())
+                for label, func in (('serializer', drf), ('values() plan', fast)):
+                    queries, ms = measure(func, repeat=max(3, 1000 // size))
+                    kib = self.allocated(func) / 1024
+                    print(f'  {serializer_class.__name__:<18} {size:>5} rows  {label:<14} '
+                          f'{ms * 1000 / size:>8.1f} us/row  {kib / size:>7.2f} KiB/row  {queries} queries')
+
+
+class JSONRenderingBenchmark(TestCase):
+    """Render time and payload size of order lists, stock renderer against orjson."""
+
+    sizes = (10, 100, 1000)
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('customer@example.com')
+        seed_orders(cls.user, seed_catalog(categories=10, products_per_category=10), max(cls.sizes), items_per_order=5)
+
+    def test_order_lists(self):
+        print('\nOrder list rendering')
+        queryset = Order.objects.select_related('user').prefetch_related(
+            Prefetch('order_items', queryset=OrderItem.objects.select_related('product'))
+        )
+        for size in self.sizes:
+            data = OrderSerializer(list(queryset[:size]), many=True).data
+            body = None
+            for renderer in (JSONRenderer(), FastJSONRenderer()):
+                rendered = renderer.render(data)
+                assert body is None or rendered == body
+                body = rendered
+                _, ms = measure(lambda: renderer.render(data), repeat=max(5, 1000 // size))
+                print(f'  {size:>5} orders  {type(renderer).__name__:<18} {ms:>8.3f} ms')
+            for level in (1, 6):
+                start = time.perf_counter()
+                compressed = gzip.compress(body, compresslevel=level)
+                ms = (time.perf_counter() - start) * 1000
+                print(f'  {size:>5} orders  {len(body) / 1024:>8.1f} KiB -> gzip level {level}: '
+                      f'{len(compressed) / 1024:>7.1f} KiB ({len(compressed) / len(body):.0%}) in {ms:.2f} ms')
+
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse('order-list')
+        rows = []
+        for label, headers in (('identity', {}), ('gzip', {'HTTP_ACCEPT_ENCODING': 'gzip'})):
+            size = len(client.get(url, **headers).content)
+            queries, ms = measure(lambda: client.get(url, **headers))
+            rows.append((f'order-list ({label}, {size} bytes)', queries, ms))
+        report('Order list page over HTTP', rows)
+
+
+class DeepPaginationBenchmark(TestCase):
+    """Page-number (COUNT + OFFSET) against cursor pagination at growing depth."""
+
+    orders = 20000
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('customer@example.com')
+        now = timezone.now()
+        orders = Order.objects.bulk_create([Order(user=cls.user) for _ in range(cls.orders)])
+        for i, order in enumerate(orders):
+            order.orderDate = now - timedelta(minutes=i)
+        Order.objects.bulk_update(orders, ['orderDate'], batch_size=1000)
+
+    def test_deep_pages(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        depths = [1, 10, 100, 1000, self.orders // PAGE_SIZE]
+        rows = []
+
+        with mock.patch.object(OrderViewSet, 'pagination_class', PageNumberPagination):
+            for depth in depths:
+                url = f"{reverse('order-list')}?page={depth}"
+                rows.append((f'page number, page {depth}',) + measure(lambda: client.get(url), repeat=5))
+
+        url, depth = reverse('order-list'), 1
+        while url and depth <= depths[-1]:
+            if depth in depths:
+                page_url = url
+                rows.append((f'cursor, page {depth}',) + measure(lambda: client.get(page_url), repeat=5))
+            url = client.get(url).data['next']
+            depth += 1
+        report(f'Order list over {self.orders} rows', rows)
+
+
+class CartTotalsBenchmark(TestCase):
+    """Cart API and admin changelist with 200-line carts."""
+
+    lines = 200
+    cart_count = 20
+
+    @classmethod
+    def setUpTestData(cls):
+        products = seed_catalog(categories=4, products_per_category=cls.lines // 4)
+        cls.carts = []
+        for i in range(cls.cart_count):
+            cart = ShoppingCart.objects.create(user=create_user(f'shopper{i}@example.com'))
+            CartItem.objects.bulk_create([
+                CartItem(cart=cart, product=product, quantity=n % 5 + 1) for n, product in enumerate(products)
+            ])
+            cls.carts.append(cart)
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', None)
+
+    def test_cart_totals(self):
+        client = APIClient()
+        cart = self.carts[0]
+        client.force_authenticate(cart.user)
+        detail = reverse('cart-detail', args=[cart.pk])
+        rows = [('cart-detail',) + measure(lambda: client.get(detail))]
+
+        client.force_login(self.admin)
+        changelist = reverse('admin:shop_shoppingcart_changelist')
+        rows.append(('admin cart changelist',) + measure(lambda: client.get(changelist)))
+        annotated = ShoppingCart.objects.with_totals()
+        rows.append(('with_totals() over all carts',) + measure(lambda: list(annotated.all())))
+        report(f'{self.lines}-line carts', rows)
+
+
+class AsyncCatalogLoadBenchmark(TestCase):
+    """Sync ViewSets against the async catalog views under concurrent load.
+
+    Requests go through the ASGI handler with ``AsyncClient``, ``concurrency``
+    of them in flight at once on one event loop, as under uvicorn. Django's
+    async ORM still runs queries on a worker thread, so the gap is largest
+    on the cached path.
+    """
+
+    requests = 200
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.products = seed_catalog(categories=10, products_per_category=20)
+
+    def load(self, url, concurrency):
+        client = AsyncClient()
+        latencies = []
+
+        async def worker(count):
+            for _ in range(count):
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+
+        async def run():
+            await asyncio.gather(*[worker(self.requests // concurrency) for _ in range(concurrency)])
+
+        start = time.perf_counter()
+        async_to_sync(run)()
+        elapsed = time.perf_counter() - start
+        latencies.sort()
+        return len(latencies) / elapsed, statistics.median(latencies) * 1000, latencies[int(len(latencies) * .95)] * 1000
+
+    def run_modes(self, title):
+        urls = [reverse('product-list'), reverse('product-detail', args=[self.products[0].pk])]
+        print(f'\n{title}')
+        for concurrency in (1, 10, 50):
+            for mode in ('sync', 'async'):
+                for url in urls:
+                    if mode == 'async':
+                        with async_catalog():
+                            rps, p50, p95 = self.load(url, concurrency)
+                    else:
+                        rps, p50, p95 = self.load(url, concurrency)
+                    print(f'  {mode:<6} c={concurrency:<3} {url:<24} {rps:>8.0f} req/s  p50 {p50:>7.2f} ms  p95 {p95:>7.2f} ms')
+
+    def test_uncached(self):
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            self.run_modes('Catalog load, cache disabled')
+
+    def test_cached(self):
+        self.run_modes('Catalog load, cache enabled')
+
+
+class JWTAuthBenchmark(TestCase):
+    """Round trips per request with simplejwt's lookup against the cached one."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = create_user('customer@example.com')
+        cls.products = seed_catalog(categories=4, products_per_category=10)
+        seed_orders(cls.user, cls.products, 20)
+
+    def test_authentication(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(self.user).access_token}')
+        rows = []
+        for label, auth_class in [('simplejwt', JWTAuthentication), ('cached', CachedJWTAuthentication)]:
+            cache.clear()
+            with mock.patch.object(APIView, 'authentication_classes', [auth_class]):
+                for name in ('order-list', 'payment-list', 'cart-list', 'review-list'):
+                    url = reverse(name)
+                    rows.append((f'{name} ({label})',) + measure(lambda: client.get(url)))
+        report('JWT-authenticated requests', rows)
+
+
+class AuthFloodBenchmark(TransactionTestCase):
+    """Uncached catalog latency while failed logins hammer the async auth view.
+
+    Runs under ``ASYNC_CATALOG`` with the real PBKDF2 hasher. With 0 hashing
+    workers, hashing shares the sync thread with every async ORM call, as a
+    sync login view would, and catalog requests queue behind it; with a
+    bounded pool they only compete for CPU. The last row has the default
+    throttles on: the per-IP bucket lets the first burst through to the
+    hasher, then refuses the flood.
+    """
+
+    catalog_requests = 20
+    attackers = 4
+
+    def setUp(self):
+        cache.clear()
+        seed_catalog(categories=5, products_per_category=20)
+
+    def run_flood(self, flood):
+        client = AsyncClient()
+        url = reverse('product-list')
+        latencies = []
+
+        async def catalog(done):
+            for _ in range(self.catalog_requests):
+                start = time.perf_counter()
+                response = await client.get(url)
+                latencies.append(time.perf_counter() - start)
+                assert response.status_code == 200
+            done.set()
+
+        async def attacker(n, done):
+            attempt = 0
+            while not done.is_set():
+                attempt += 1
+                await client.post(
+                    reverse('auth-login'), {'email': f'victim{n}-{attempt}@example.com', 'password': 'guess'},
+                    content_type='application/json',
+                )
+
+        async def run():
+            done = asyncio.Event()
+            attackers = [attacker(n, done) for n in range(self.attackers)] if flood else []
+            await asyncio.gather(catalog(done), *attackers)
+
+        async_to_sync(run)()
+        latencies.sort()
+        return statistics.median(latencies) * 1000, latencies[int(len(latencies) * .95)] * 1000
+
+    def test_auth_flood(self):
+        no_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        unthrottled = dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES={})
+        print(f'\nCatalog latency during a {self.attackers}-client login flood')
+        for label, flood, workers, rest_framework in [
+            ('no flood', False, 2, unthrottled),
+            ('flood, hashing on sync thread', True, 0, unthrottled),
+            ('flood, 2 hashing workers', True, 2, unthrottled),
+            ('flood, throttled', True, 2, settings.REST_FRAMEWORK),
+        ]:
+            # The catalog stays uncached; throttle buckets get a cache of their own
+            with async_catalog(), override_settings(
+                CACHES=no_cache, PASSWORD_HASHING_WORKERS=workers, REST_FRAMEWORK=rest_framework,
+            ), mock.patch.object(TokenBucketThrottle, 'cache', LocMemCache('auth-flood', {})):
+                p50, p95 = self.run_flood(flood)
+            print(f'  {label:<32} p50 {p50:>8.2f} ms  p95 {p95:>8.2f} ms')
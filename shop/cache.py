@@ -0,0 +1,116 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.response import Response
+
+from .routers import read_replica
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Present for REPLICA_STICKY_SECONDS after a catalog write
+CATALOG_CHANGED_KEY = 'catalog:changed'
+
+
+def get_catalog_version():
+    version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock so an evicted version never reuses old keys
+        cache.add(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+async def aget_catalog_version():
+    version = await cache.aget(CATALOG_VERSION_KEY)
+    if version is None:
+        await cache.aadd(CATALOG_VERSION_KEY, time.time_ns(), None)
+        version = await cache.aget(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    # Set before the new version is visible, so keep_entry() sees it for any entry under it
+    if settings.REPLICA_STICKY_SECONDS:
+        cache.set(CATALOG_CHANGED_KEY, True, settings.REPLICA_STICKY_SECONDS)
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.set(CATALOG_VERSION_KEY, time.time_ns(), None)
+
+
+def invalidate_catalog():
+    """Bump the catalog version once the current transaction commits.
+
+    Bumping before commit would let a concurrent reader cache the old rows
+    under the new version.
+    """
+    transaction.on_commit(bump_catalog_version)
+
+
+def last_modified():
+    """Last-Modified for a response being built now, as a timestamp.
+
+    Every catalog write bumps the version and so rebuilds every entry, which
+    makes the build time no earlier than any change in the data. The rows'
+    own ``updated_at`` would miss deletions and changes to related rows.
+    """
+    return int(time.time())
+
+
+def keep_entry():
+    """Whether the entry the current request just built may be cached.
+
+    A replica can lack a catalog write for up to ``REPLICA_STICKY_SECONDS``,
+    so an entry built from one in that window could keep the old rows under
+    the new version for the whole timeout. Such entries are served but not
+    kept; those read from the primary, such as the writer's own pinned
+    requests, always are.
+    """
+    return read_replica() is None or not cache.get(CATALOG_CHANGED_KEY)
+
+
+async def akeep_entry():
+    return read_replica() is None or not await cache.aget(CATALOG_CHANGED_KEY)
+
+
+def conditional_response(request, response, key, last_modified):
+    """Tag ``response`` for revalidation; answer 304 if the client is current."""
+    etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return get_conditional_response(request, etag=etag, last_modified=last_modified, response=response)
+
+
+class CatalogCacheMixin:
+    """Read-through cache for ``list`` and ``retrieve`` of catalog ViewSets.
+
+    Keys embed the catalog version, so any write to a product or category
+    makes every cached page unreachable instead of deleting them one by one.
+    Responses carry an ETag and Last-Modified so clients can revalidate.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        key = 'catalog:%s:%s' % (get_catalog_version(), request.get_full_path())
+        entry = cache.get(key)
+        if entry is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != status.HTTP_200_OK:
+                return response
+            entry = (response.data, last_modified())
+            if keep_entry():
+                cache.set(key, entry, settings.CATALOG_CACHE_TIMEOUT)
+
+        data, modified = entry
+        return conditional_response(request, Response(data), key, modified)
@@ -0,0 +1,238 @@
+"""Streaming catalog import and export, keyed by product SKU.
+
+Rows are read and written one at a time, so memory stays flat however large
+the file is. Imports are applied in batches: each batch resolves its
+categories and existing products with one ``IN`` query each and is written
+with a ``bulk_create`` and a ``bulk_update``.
+"""
+import csv
+import json
+import time
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+
+from .cache import invalidate_catalog
+from .models import Category, Product
+from .streaming import csv_lines, ndjson_lines
+
+FIELDS = ['sku', 'name', 'description', 'price', 'category', 'stock', 'is_active']
+# Columns written by an import; ``category`` is stored as ``category_id``
+WRITABLE_FIELDS = ['name', 'description', 'price', 'category_id', 'stock', 'is_active']
+TRUE_VALUES = {'1', 'true', 'yes', 'y', 't'}
+FALSE_VALUES = {'0', 'false', 'no', 'n', 'f'}
+# Row errors kept on ImportResult; the rest are only counted (and passed to on_error)
+ERRORS_KEPT = 100
+
+
+class CatalogRowError(ValueError):
+    pass
+
+
+class ImportResult:
+    def __init__(self):
+        self.rows = self.created = self.updated = self.unchanged = self.skipped = 0
+        # The first ERRORS_KEPT (row, message) pairs
+        self.errors = []
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def rate(self):
+        return self.rows / self.elapsed if self.elapsed else 0.0
+
+
+# Reading
+
+def read_csv(stream):
+    return csv.DictReader(stream)
+
+
+def read_jsonl(stream):
+    for line in stream:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except ValueError as exc:
+                # Yielded rather than raised, so parse_row() reports the line and the import goes on
+                yield CatalogRowError(f'invalid JSON: {exc}')
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    if value in TRUE_VALUES:
+        return True
+    if value in FALSE_VALUES:
+        return False
+    raise CatalogRowError(f'invalid is_active {value!r}')
+
+
+def parse_row(row):
+    """Validate one input record and return it with typed values.
+
+    ``sku``, ``name``, ``price`` and ``category`` (by name) are required;
+    ``description``, ``stock`` and ``is_active`` default to empty, 0 and true.
+    """
+    if isinstance(row, CatalogRowError):
+        raise row
+    if not isinstance(row, dict):
+        raise CatalogRowError('not an object')
+    row = {key: value.strip() if isinstance(value, str) else value for key, value in row.items() if key}
+    for field in ('sku', 'name', 'price', 'category'):
+        if row.get(field) in (None, ''):
+            raise CatalogRowError(f'missing {field}')
+    for field, model_field in (
+        ('sku', Product._meta.get_field('sku')),
+        ('name', Product._meta.get_field('name')),
+        ('category', Category._meta.get_field('name')),
+    ):
+        row[field] = str(row[field])
+        if len(row[field]) > model_field.max_length:
+            raise CatalogRowError(f'{field} too long')
+    price_field = Product._meta.get_field('price')
+    try:
+        price = Decimal(str(row['price']))
+        if not price.is_finite():
+            raise InvalidOperation
+        price = price.quantize(Decimal(1).scaleb(-price_field.decimal_places))
+    except InvalidOperation:
+        raise CatalogRowError(f"invalid price {row['price']!r}")
+    if price < 0:
+        raise CatalogRowError('negative price')
+    if price >= 10 ** (price_field.max_digits - price_field.decimal_places):
+        raise CatalogRowError('price too large')
+    try:
+        stock = int(row.get('stock') or 0)
+    except (TypeError, ValueError):
+        raise CatalogRowError(f"invalid stock {row['stock']!r}")
+    if stock < 0:
+        raise CatalogRowError('negative stock')
+    is_active = row.get('is_active')
+    return {
+        'sku': row['sku'],
+        'name': row['name'],
+        'description': str(row.get('description') or ''),
+        'price': price,
+        'category': row['category'],
+        'stock': stock,
+        'is_active': True if is_active in (None, '') else _parse_bool(is_active),
+    }
+
+
+def import_catalog(records, batch_size=1000, progress=None, on_error=None):
+    """Create or update products from an iterable of dict ``records``.
+
+    Products are matched on ``sku``; unknown categories are created. Invalid
+    records are skipped and counted in ``result.skipped``; ``on_error(row,
+    message)`` is called for each as it is found, and the first
+    ``ERRORS_KEPT`` are listed in ``result.errors``, so a badly broken file
+    does not grow memory. ``progress(result)`` is called after every batch.
+    """
+    result = ImportResult()
+    category_ids = {}
+    records = iter(records)
+    row_number = 0
+    while True:
+        chunk = list(islice(records, batch_size))
+        if not chunk:
+            break
+        batch = {}
+        for record in chunk:
+            row_number += 1
+            try:
+                row = parse_row(record)
+            except CatalogRowError as exc:
+                result.skipped += 1
+                if len(result.errors) < ERRORS_KEPT:
+                    result.errors.append((row_number, str(exc)))
+                if on_error:
+                    on_error(row_number, str(exc))
+                continue
+            # A SKU repeated within the batch: the last row wins
+            batch[row['sku']] = row
+            result.rows += 1
+        if batch:
+            with transaction.atomic():
+                _import_batch(batch, category_ids, result)
+        if progress:
+            progress(result)
+    return result
+
+
+def _resolve_categories(names, category_ids):
+    missing = set(names) - category_ids.keys()
+    if missing:
+        category_ids.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+        missing -= category_ids.keys()
+    if missing:
+        Category.objects.bulk_create([Category(name=name) for name in missing], ignore_conflicts=True)
+        category_ids.update(Category.objects.filter(name__in=missing).values_list('name', 'pk'))
+
+
+def _import_batch(batch, category_ids, result):
+    _resolve_categories({row['category'] for row in batch.values()}, category_ids)
+    existing = {
+        product.sku: product
+        for product in Product.objects.filter(sku__in=batch).only('sku', *WRITABLE_FIELDS)
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    for sku, row in batch.items():
+        values = dict(row, category_id=category_ids[row['category']])
+        product = existing.get(sku)
+        if product is None:
+            to_create.append(Product(sku=sku, **{field: values[field] for field in WRITABLE_FIELDS}))
+            continue
+        changed = False
+        for field in WRITABLE_FIELDS:
+            if getattr(product, field) != values[field]:
+                setattr(product, field, values[field])
+                changed = True
+        if changed:
+            product.updated_at = now
+            to_update.append(product)
+        else:
+            result.unchanged += 1
+
+    Product.objects.bulk_create(to_create)
+    Product.objects.bulk_update(to_update, WRITABLE_FIELDS + ['updated_at'])
+    result.created += len(to_create)
+    result.updated += len(to_update)
+    if to_create or to_update:
+        # Bulk writes skip post_save, so the catalog cache is dropped here
+        invalidate_catalog()
+
+
+# Writing
+
+def export_rows(queryset=None, chunk_size=2000):
+    """Stream ``FIELDS`` tuples for ``queryset`` (every product by default)."""
+    if queryset is None:
+        queryset = Product.objects.all()
+    return queryset.order_by('pk').values_list(
+        'sku', 'name', 'description', 'price', 'category__name', 'stock', 'is_active'
+    ).iterator(chunk_size=chunk_size)
+
+
+def export_csv(rows):
+    return csv_lines(FIELDS, rows)
+
+
+def export_jsonl(rows):
+    return ndjson_lines(dict(zip(FIELDS, row)) for row in rows)
+
+
+EXPORTERS = {
+    'csv': (export_csv, 'text/csv'),
+    'jsonl': (export_jsonl, 'application/x-ndjson'),
+}
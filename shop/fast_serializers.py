@@ -0,0 +1,223 @@
+"""Read-only serialization straight from ``values()`` rows.
+
+On large pages most of a list response goes into DRF resolving every field
+of every model instance. ``plan_for(SerializerClass)`` works out once which
+columns the serializer reads and how each becomes output; ``FastReadMixin``
+then fetches those columns with ``values()`` and applies the plan row by row.
+Values are still formatted by each field's own ``to_representation``, so the
+JSON is the same as the serializer's. Nested ``many=True`` serializers over
+a reverse foreign key are filled from one extra ``values()`` query, like a
+prefetch. ``SerializerMethodField``s get a model instance built from the row,
+so they can only use its own columns.
+
+Set ``FAST_READ_SERIALIZERS = False`` to go back to the serializers.
+"""
+import functools
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from rest_framework import serializers
+from rest_framework.generics import get_object_or_404
+from rest_framework.relations import PKOnlyObject, RelatedField
+from rest_framework.response import Response
+
+from .metrics import serializer_timer
+
+# Fields whose to_representation() returns database values unchanged
+PASSTHROUGH = (
+    serializers.BooleanField, serializers.CharField, serializers.EmailField, serializers.IntegerField
+)
+
+# How a step turns a row into one output value
+COLUMN, RELATED, FILE, METHOD, NESTED = range(5)
+
+
+class Plan:
+    """The columns a serializer reads, and the steps that turn them into output."""
+
+    def __init__(self, serializer_class):
+        self.serializer_class = serializer_class
+        self.model = serializer_class.Meta.model
+        concrete = [field.attname for field in self.model._meta.concrete_fields]
+        self.columns = list(concrete)
+        self.steps = []
+        self.nested = {}
+        self.needs_instance = False
+
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.SerializerMethodField):
+                self.needs_instance = True
+                self.steps.append((name, METHOD, None))
+            elif isinstance(field, serializers.ListSerializer):
+                self.steps.append((name, NESTED, self.model._meta.pk.attname))
+                self.nested[name] = self.reverse_relation(name, field)
+            elif isinstance(field, serializers.BaseSerializer) or field.source == '*':
+                raise ImproperlyConfigured(f'{serializer_class.__name__}.{name} has no fast read plan')
+            else:
+                key = self.column(field)
+                if key is None:
+                    # DRF skips a read-only field whose attribute does not exist
+                    continue
+                if isinstance(field, RelatedField):
+                    kind = RELATED
+                elif isinstance(field, serializers.FileField):
+                    kind = FILE
+                elif type(field) in PASSTHROUGH:
+                    kind = None
+                else:
+                    kind = COLUMN
+                self.steps.append((name, kind, key))
+                if key not in self.columns:
+                    self.columns.append(key)
+        self.concrete_count = len(concrete)
+
+    def column(self, field):
+        """``values()`` key for ``field.source``, or None if the model lacks it."""
+        model, path = self.model, []
+        for position, attr in enumerate(field.source_attrs):
+            try:
+                model_field = model._meta.get_field(attr)
+            except FieldDoesNotExist:
+                if hasattr(model, attr) or field.required or field.default is not serializers.empty:
+                    raise ImproperlyConfigured(
+                        f'{self.serializer_class.__name__}.{field.field_name}: {attr} is not a column'
+                    )
+                return None
+            last = position == len(field.source_attrs) - 1
+            if last and model_field.concrete and not model_field.many_to_many:
+                if not path:
+                    return model_field.attname
+                return '__'.join(path + [model_field.name])
+            if last or not (model_field.many_to_one or model_field.one_to_one) or not model_field.concrete:
+                raise ImproperlyConfigured(
+                    f'{self.serializer_class.__name__}.{field.field_name}: cannot follow {attr}'
+                )
+            path.append(attr)
+            model = model_field.related_model
+
+    def reverse_relation(self, name, field):
+        try:
+            relation = self.model._meta.get_field(field.source)
+        except FieldDoesNotExist:
+            relation = None
+        if relation is None or not relation.one_to_many:
+            raise ImproperlyConfigured(f'{self.serializer_class.__name__}.{name} is not a reverse foreign key')
+        return plan_for(type(field.child)), relation.field
+
+    def values(self, queryset):
+        """``queryset`` as rows of this plan's columns."""
+        return queryset.prefetch_related(None).values(*self.columns)
+
+    def instance(self, row, db):
+        values = [row[column] for column in self.columns[:self.concrete_count]]
+        return self.model.from_db(db, self.columns[:self.concrete_count], values)
+
+    def bind(self, serializer):
+        """Steps as ``(name, kind, key, convert)`` using ``serializer``'s fields and context."""
+        fields = serializer.fields
+        bound = []
+        for name, kind, key in self.steps:
+            field = fields[name]
+            if kind is None:
+                convert = None
+            elif kind == COLUMN:
+                convert = field.to_representation
+            elif kind == RELATED:
+                convert = functools.partial(represent_related, field)
+            elif kind == FILE:
+                model_field = self.model._meta.get_field(field.source_attrs[-1])
+                convert = functools.partial(represent_file, field, model_field)
+            elif kind == METHOD:
+                convert = getattr(serializer, field.method_name)
+            else:
+                convert = field.child
+            bound.append((name, kind, key, convert))
+        return bound
+
+    def serialize(self, rows, context, db, serializer=None):
+        """Output of the serializer for ``rows``, as a list of dicts."""
+        rows = list(rows)
+        serializer = serializer or self.serializer_class(context=context)
+        steps = []
+        for name, kind, key, convert in self.bind(serializer):
+            if kind == NESTED:
+                plan, foreign_key = self.nested[name]
+                children = plan.children(rows, key, foreign_key, convert, context, db)
+                kind, convert = COLUMN, functools.partial(children_of, children)
+            steps.append((name, kind, key, convert))
+
+        data = []
+        for row in rows:
+            instance = self.instance(row, db) if self.needs_instance else None
+            item = {}
+            for name, kind, key, convert in steps:
+                if kind == METHOD:
+                    item[name] = convert(instance)
+                else:
+                    value = row[key]
+                    item[name] = value if value is None or convert is None else convert(value)
+            data.append(item)
+        return data
+
+    def children(self, rows, key, foreign_key, serializer, context, db):
+        """``{parent key: [child output, ...]}`` for the parents in ``rows``.
+
+        Called on the child's plan; ``serializer`` is the bound child serializer.
+        """
+        parents = [row[key] for row in rows]
+        if not parents:
+            return {}
+        queryset = self.model._default_manager.using(db).filter(**{f'{foreign_key.name}__in': parents})
+        child_rows = list(self.values(queryset))
+        grouped = {}
+        for row, item in zip(child_rows, self.serialize(child_rows, context, db, serializer)):
+            grouped.setdefault(row[foreign_key.attname], []).append(item)
+        return grouped
+
+
+def represent_related(field, value):
+    return field.to_representation(PKOnlyObject(value))
+
+
+def represent_file(field, model_field, name):
+    return field.to_representation(model_field.attr_class(None, model_field, name))
+
+
+def children_of(children, key):
+    return children.get(key, [])
+
+
+@functools.cache
+def plan_for(serializer_class):
+    return Plan(serializer_class)
+
+
+class FastReadMixin:
+    """Serve ``list`` and ``retrieve`` from ``values()`` rows through ``plan_for()``."""
+
+    def list(self, request, *args, **kwargs):
+        if not settings.FAST_READ_SERIALIZERS:
+            return super().list(request, *args, **kwargs)
+        plan = plan_for(self.get_serializer_class())
+        queryset = plan.values(self.filter_queryset(self.get_queryset()))
+        context = self.get_serializer_context()
+        page = self.paginate_queryset(queryset)
+        with serializer_timer():
+            data = plan.serialize(queryset if page is None else page, context, queryset.db)
+        if page is not None:
+            return self.get_paginated_response(data)
+        return Response(data)
+
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.FAST_READ_SERIALIZERS:
+            return super().retrieve(request, *args, **kwargs)
+        plan = plan_for(self.get_serializer_class())
+        queryset = plan.values(self.filter_queryset(self.get_queryset()))
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        row = get_object_or_404(queryset, **{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        self.check_object_permissions(request, plan.instance(row, queryset.db))
+        with serializer_timer():
+            data = plan.serialize([row], self.get_serializer_context(), queryset.db)[0]
+        return Response(data)
@@ -0,0 +1,135 @@
+"""``Idempotency-Key`` support for endpoints that must not run twice.
+
+The first request with a key claims it by inserting an ``IdempotencyKey``
+row (unique per user and key) before doing any work, and stores its response
+there when done. A duplicate that arrives while the first is still running
+polls the row until the response is stored, up to
+``IDEMPOTENCY_WAIT_TIMEOUT`` seconds; a later one gets the stored response
+back without the view running. A key reused for a different request is
+refused. The view runs in the same transaction that stores its response;
+server errors roll both back and release the key, so the client can retry
+them.
+"""
+import functools
+import hashlib
+import json
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils import encoders
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+POLL_INTERVAL = 0.05
+
+
+def request_fingerprint(request):
+    payload = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{payload}'.encode()).hexdigest()
+
+
+def claim_key(user, key, fingerprint):
+    """Return ``(record, created)``, taking over expired or abandoned keys."""
+    while True:
+        now = timezone.now()
+        # Replays are the common case for a key that exists: read before inserting
+        record = IdempotencyKey.objects.filter(user=user, key=key).first()
+        if record is None:
+            try:
+                with transaction.atomic():
+                    record = IdempotencyKey.objects.create(
+                        user=user, key=key, fingerprint=fingerprint,
+                        expires_at=now + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL),
+                    )
+                return record, True
+            except IntegrityError:
+                # A concurrent duplicate inserted it first
+                continue
+        # A request that never stored its response died mid-way
+        abandoned = record.status_code is None and (
+            record.created_at < now - timedelta(seconds=settings.IDEMPOTENCY_LOCK_TIMEOUT)
+        )
+        if record.expires_at > now and not abandoned:
+            return record, False
+        IdempotencyKey.objects.filter(pk=record.pk, created_at=record.created_at).delete()
+
+
+def wait_for_response(record):
+    """``record`` once its response is stored; ``None`` on timeout or if it was dropped."""
+    deadline = time.monotonic() + settings.IDEMPOTENCY_WAIT_TIMEOUT
+    while record is not None and record.status_code is None:
+        if time.monotonic() >= deadline:
+            return None
+        time.sleep(POLL_INTERVAL)
+        record = IdempotencyKey.objects.filter(pk=record.pk).first()
+    return record
+
+
+def idempotent(view_method):
+    """Make a ViewSet action safe to retry with an ``Idempotency-Key`` header."""
+
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if key is None:
+            return view_method(self, request, *args, **kwargs)
+        if not key or len(key) > 255:
+            return Response(
+                {'error': f'{HEADER} must be 1 to 255 characters'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        fingerprint = request_fingerprint(request)
+        while True:
+            record, created = claim_key(request.user, key, fingerprint)
+            if created:
+                break
+            if record.fingerprint != fingerprint:
+                return Response(
+                    {'error': f'{HEADER} was already used for a different request'},
+                    status=status.HTTP_422_UNPROCESSABLE_ENTITY
+                )
+            if record.status_code is None:
+                waited = wait_for_response(record)
+                if waited is None and IdempotencyKey.objects.filter(pk=record.pk).exists():
+                    return Response(
+                        {'error': f'A request with this {HEADER} is still in progress'},
+                        status=status.HTTP_409_CONFLICT
+                    )
+                if waited is None:
+                    # The first request failed and released the key; run this one instead
+                    continue
+                record = waited
+            response = Response(record.response, status=record.status_code)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+
+        # The view's writes and the stored response commit together: a key is
+        # only released when its work was rolled back, so a retry never repeats
+        # work that committed
+        try:
+            with transaction.atomic():
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code >= 500:
+                    transaction.set_rollback(True)
+                else:
+                    # Stored as the renderer would encode it, so a replay renders the same JSON
+                    data = json.loads(json.dumps(response.data, cls=encoders.JSONEncoder))
+                    IdempotencyKey.objects.filter(pk=record.pk).update(
+                        status_code=response.status_code, response=data
+                    )
+        except BaseException:
+            record.delete()
+            raise
+        if response.status_code >= 500:
+            record.delete()
+        return response
+
+    return wrapper
@@ -0,0 +1,137 @@
+"""Resized WebP/JPEG variants of product images.
+
+Variants are stored under names derived from their own content hash, so a
+URL always serves the same bytes and can be cached forever. Processing runs
+after the upload commits, on a small background pool (or inline with
+``PRODUCT_IMAGE_WORKERS = 0``); ``manage.py backfill_image_variants`` covers
+images uploaded before the pipeline existed.
+"""
+import hashlib
+import io
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from .cache import invalidate_catalog
+from .models import Product
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {
+    'webp': ('WEBP', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+VARIANT_DIR = 'products/variants'
+
+_pool = None
+
+
+def render_variants(source):
+    """``{size: {format: bytes}}`` for the image in file object ``source``."""
+    with Image.open(source) as image:
+        image = ImageOps.exif_transpose(image)
+        has_alpha = image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+        variants = {}
+        for size, width in settings.PRODUCT_IMAGE_SIZES.items():
+            resized = image.copy()
+            # Fits the box without upscaling
+            resized.thumbnail((width, width), Image.LANCZOS)
+            variants[size] = {}
+            for extension, (pillow_format, options) in FORMATS.items():
+                frame = resized
+                if pillow_format == 'JPEG' and has_alpha:
+                    frame = Image.new('RGB', resized.size, 'white')
+                    frame.paste(resized, mask=resized.getchannel('A'))
+                buffer = io.BytesIO()
+                frame.save(buffer, pillow_format, **options)
+                variants[size][extension] = buffer.getvalue()
+        return variants
+
+
+def store_variant(data, size, extension):
+    name = f'{VARIANT_DIR}/{hashlib.sha256(data).hexdigest()[:20]}-{size}.{extension}'
+    # Same name, same bytes: an existing file is already correct
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(data))
+    return name
+
+
+def process_product_image(product_id, force=False):
+    """Create the variants of a product's current image; return True if done.
+
+    The product row is only updated if its image is still the one that was
+    processed, so a newer upload is never overwritten by an older one.
+    """
+    product = Product.objects.filter(pk=product_id).only('image', 'image_variants').first()
+    if product is None:
+        return False
+    source = product.image.name
+    if not source:
+        if product.image_variants:
+            Product.objects.filter(pk=product_id, image='').update(image_variants={}, updated_at=Now())
+            invalidate_catalog()
+        return False
+    if not force and product.image_variants.get('source') == source:
+        return False
+
+    with product.image.open('rb') as file:
+        rendered = render_variants(file)
+    variants = {
+        'source': source,
+        'sizes': {
+            size: {extension: store_variant(data, size, extension) for extension, data in formats.items()}
+            for size, formats in rendered.items()
+        },
+    }
+    updated = Product.objects.filter(pk=product_id, image=source).update(image_variants=variants, updated_at=Now())
+    if updated:
+        # update() skips post_save, so the cached product pages are dropped here
+        invalidate_catalog()
+    return bool(updated)
+
+
+def _process(product_id):
+    # The upload has already committed; a failure here is logged, not raised into the response
+    try:
+        process_product_image(product_id)
+    except Exception:
+        logger.exception('Could not create image variants for product %s', product_id)
+
+
+def _process_in_background(product_id):
+    # Pool threads keep their own database connections between jobs
+    close_old_connections()
+    try:
+        _process(product_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_product_image(product_id):
+    """Process the product's image off the request, once its save commits."""
+    global _pool
+    if not settings.PRODUCT_IMAGE_WORKERS:
+        _process(product_id)
+        return
+    if _pool is None:
+        _pool = ThreadPoolExecutor(settings.PRODUCT_IMAGE_WORKERS, thread_name_prefix='product-images')
+    _pool.submit(_process_in_background, product_id)
+
+
+def variant_urls(product, build_url=None):
+    """``{size: {format: url}}`` for ``product``'s current image variants."""
+    variants = product.image_variants or {}
+    if not product.image or variants.get('source') != product.image.name:
+        return {}
+    build_url = build_url or (lambda url: url)
+    return {
+        size: {extension: build_url(default_storage.url(name)) for extension, name in formats.items()}
+        for size, formats in variants.get('sizes', {}).items()
+    }
@@ -0,0 +1,135 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import (
+    Case, ExpressionWrapper, F, IntegerField, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, Now
+from django.utils import timezone
+
+from .cache import invalidate_catalog
+from .models import Product, StockReservation
+
+
+class InsufficientStock(Exception):
+    pass
+
+
+def reserved_quantity(exclude_items=(), exclude_cart=None):
+    """Quantity of the outer product held by unexpired reservations.
+
+    Reservations of the cart items in ``exclude_items``, or of every line of
+    ``exclude_cart``, are left out, so a cart never competes with its own holds.
+    """
+    reservations = StockReservation.objects.filter(product=OuterRef('pk'), expires_at__gt=Now())
+    if exclude_items:
+        reservations = reservations.exclude(cart_item__in=exclude_items)
+    if exclude_cart is not None:
+        reservations = reservations.exclude(cart_item__cart=exclude_cart)
+    total = reservations.values('product').annotate(total=Sum('quantity')).values('total')
+    return Coalesce(Subquery(total, output_field=IntegerField()), Value(0))
+
+
+def with_available(queryset):
+    """Annotate ``reserved`` and ``available`` (stock minus active reservations)."""
+    return queryset.annotate(reserved=reserved_quantity()).annotate(
+        available=ExpressionWrapper(F('stock') - F('reserved'), output_field=IntegerField())
+    )
+
+
+def reserve_stock(cart_item):
+    """Hold ``cart_item.quantity`` of its product for the cart line.
+
+    Must run inside a transaction. The product row is locked so concurrent
+    reservations for the same product are checked one at a time. Raises
+    ``InsufficientStock`` if the line asks for more than other carts leave.
+    """
+    product = Product.objects.select_for_update().filter(pk=cart_item.product_id).annotate(
+        held_elsewhere=reserved_quantity(exclude_items=[cart_item.pk])
+    ).get()
+    if cart_item.quantity > product.stock - product.held_elsewhere:
+        raise InsufficientStock()
+    StockReservation.objects.update_or_create(
+        cart_item=cart_item,
+        defaults={
+            'product_id': cart_item.product_id,
+            'quantity': cart_item.quantity,
+            'expires_at': timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL),
+        },
+    )
+
+
+def lock_for_cart(cart, product_ids):
+    """Lock the active products in ``product_ids`` for reserving in bulk.
+
+    Must run inside a transaction. One query; each product is annotated with
+    ``held_elsewhere``, the quantity reserved by carts other than ``cart``.
+    Rows are locked in primary key order so two bulk reservations cannot
+    deadlock each other.
+    """
+    return list(
+        Product.objects.select_for_update().filter(pk__in=product_ids, is_active=True).order_by('pk').annotate(
+            held_elsewhere=reserved_quantity(exclude_cart=cart)
+        )
+    )
+
+
+def reserve_lines(cart_items):
+    """Create or refresh the reservations of ``cart_items`` in one INSERT.
+
+    The caller must already have checked availability under
+    ``lock_for_cart()``.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.CART_RESERVATION_TTL)
+    StockReservation.objects.bulk_create(
+        [
+            StockReservation(cart_item=item, product_id=item.product_id, quantity=item.quantity, expires_at=expires_at)
+            for item in cart_items
+        ],
+        update_conflicts=True,
+        unique_fields=['cart_item'],
+        update_fields=['product', 'quantity', 'expires_at'],
+    )
+
+
+def decrement_stock(quantities, held_by=()):
+    """Take ``{product_id: quantity}`` out of stock in a single UPDATE.
+
+    Each row is only touched if it still holds enough stock beyond what
+    other carts have reserved, so concurrent checkouts cannot drive stock
+    negative. ``held_by`` are the cart items being checked out, whose own
+    reservations count as available. If any product is short,
+    ``InsufficientStock`` is raised and the caller's ``atomic`` block must be
+    rolled back to undo the rows that were decremented.
+    """
+    if not quantities:
+        return
+    reserved = reserved_quantity(exclude_items=held_by)
+    condition = Q()
+    for product_id, quantity in quantities.items():
+        condition |= Q(pk=product_id, stock__gte=reserved + quantity)
+    updated = Product.objects.filter(condition).update(
+        stock=F('stock') - Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=IntegerField(),
+        ),
+        updated_at=Now(),
+    )
+    if updated != len(quantities):
+        raise InsufficientStock()
+    # update() bypasses post_save, so cached product stock must be dropped here
+    invalidate_catalog()
+
+
+def restore_stock(quantities):
+    """Put ``{product_id: quantity}`` back into stock in a single UPDATE."""
+    if not quantities:
+        return
+    Product.objects.filter(pk__in=quantities).update(
+        stock=F('stock') + Case(
+            *[When(pk=product_id, then=Value(quantity)) for product_id, quantity in quantities.items()],
+            output_field=IntegerField(),
+        ),
+        updated_at=Now(),
+    )
+    invalidate_catalog()
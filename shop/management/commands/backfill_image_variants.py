@@ -0,0 +1,33 @@
+import time
+
+from django.core.management.base import BaseCommand
+from PIL import UnidentifiedImageError
+
+from shop.images import process_product_image
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Create the resized image variants of products that do not have them yet.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Render every product image again')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        processed = failed = 0
+        products = Product.objects.exclude(image='').exclude(image__isnull=True).only('image', 'image_variants')
+        for product in products.order_by('pk').iterator(chunk_size=options['batch_size']):
+            if not options['force'] and product.image_variants.get('source') == product.image.name:
+                continue
+            try:
+                processed += process_product_image(product.pk, force=options['force'])
+            except (OSError, UnidentifiedImageError) as e:
+                failed += 1
+                self.stderr.write(f'Product {product.pk} ({product.image.name}): {e}')
+            if options['verbosity'] > 1 and processed and not processed % 100:
+                self.stdout.write(f'  {processed} images')
+        self.stdout.write(self.style.SUCCESS(
+            f'Processed {processed} images in {time.perf_counter() - start:.1f}s, {failed} failed'
+        ))
@@ -0,0 +1,122 @@
+import re
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import override_settings
+from rest_framework.test import APIRequestFactory, force_authenticate
+
+from shop.models import User
+from shop.urls import router
+
+# Plan lines that mean a table is read in full or rows are sorted in memory
+PROBLEMS = {
+    'postgresql': [
+        (re.compile(r'Seq Scan on (\w+)'), 'sequential scan on {0}'),
+        (re.compile(r'(?<!Incremental )\bSort\b(?! Key| Method)'), 'sort without an index'),
+    ],
+    'sqlite': [
+        (re.compile(r'\bSCAN (?!CONSTANT)(\w+)(?!.*\bINDEX\b)'), 'sequential scan on {0}'),
+        (re.compile(r'USE TEMP B-TREE FOR (?:RIGHT PART OF )?ORDER BY'), 'sort without an index'),
+    ],
+}
+
+
+def plan_problems(vendor, plan, tables):
+    """Problems in ``plan``; scans of derived tables and CTEs are not flagged."""
+    problems = []
+    for line in plan:
+        for pattern, message in PROBLEMS.get(vendor, []):
+            match = pattern.search(line)
+            if match and all(name in tables for name in match.groups()):
+                problems.append(message.format(*match.groups()))
+    return problems
+
+
+class Command(BaseCommand):
+    help = (
+        'EXPLAIN every query made by the list action of each router ViewSet and flag '
+        'sequential scans and sorts that do not use an index. Run it against a database '
+        'with production-sized tables: on a near-empty one the planner rightly prefers scans.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', action='append', dest='users', metavar='EMAIL',
+            help='Request as this user (repeatable). Defaults to one staff user and one customer.',
+        )
+        parser.add_argument(
+            '--no-seqscan', action='store_true',
+            help='PostgreSQL only: disable sequential scans to show whether an index could be used.',
+        )
+
+    def handle(self, *args, **options):
+        users = self.get_users(options['users'])
+        vendor = connection.vendor
+        if vendor not in PROBLEMS:
+            self.stderr.write(f'No plan checks for {vendor}; plans are not checked.')
+        tables = set(connection.introspection.table_names())
+        flagged = 0
+
+        # Catalog responses would come from the cache without touching the
+        # database, and views may write; never keep any of it
+        no_cache = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}
+        with override_settings(CACHES=no_cache), transaction.atomic():
+            if options['no_seqscan'] and vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET LOCAL enable_seqscan = off')
+            for prefix, viewset, basename in router.registry:
+                if not hasattr(viewset, 'list'):
+                    continue
+                for user in users:
+                    flagged += self.explain_endpoint(
+                        f'{basename}-list', viewset, user, vendor, tables, options['verbosity']
+                    )
+            transaction.set_rollback(True)
+
+        summary = f'{flagged} problem(s) found'
+        self.stdout.write(self.style.WARNING(summary) if flagged else self.style.SUCCESS(summary))
+
+    def get_users(self, emails):
+        if emails:
+            users = list(User.objects.filter(email__in=emails))
+            if len(users) != len(set(emails)):
+                raise CommandError('Unknown user in --user')
+            return users
+        users = [User.objects.filter(is_staff=True).first(), User.objects.filter(is_staff=False).first()]
+        users = [user for user in users if user is not None]
+        if not users:
+            raise CommandError('No users to request as; create one or pass --user')
+        return users
+
+    def explain_endpoint(self, name, viewset, user, vendor, tables, verbosity):
+        queries = []
+
+        def capture(execute, sql, params, many, context):
+            if sql.lstrip().upper().startswith('SELECT'):
+                queries.append((sql, params))
+            return execute(sql, params, many, context)
+
+        request = APIRequestFactory().get('/')
+        force_authenticate(request, user)
+        with connection.execute_wrapper(capture):
+            response = viewset.as_view({'get': 'list'})(request)
+        role = 'staff' if user.is_staff else 'customer'
+        if response.status_code != 200:
+            self.stdout.write(f'{name} ({role}): skipped, HTTP {response.status_code}')
+            return 0
+
+        flagged = 0
+        self.stdout.write(f'{name} ({role}): {len(queries)} queries')
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                cursor.execute(f'{connection.ops.explain_query_prefix()} {sql}', params)
+                plan = [' '.join(str(column) for column in row) for row in cursor.fetchall()]
+                problems = plan_problems(vendor, plan, tables)
+                flagged += len(problems)
+                if problems or verbosity > 1:
+                    self.stdout.write(f'  {sql}')
+                    for line in plan:
+                        self.stdout.write(f'    {line}')
+                for problem in problems:
+                    self.stdout.write(self.style.WARNING(f'  ! {problem}'))
+        return flagged
@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import EXPORTERS, export_rows
+
+
+class Command(BaseCommand):
+    help = 'Write every product to a CSV or JSONL file that import_catalog can read back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', nargs='?', default='-', help='Output file, or - for stdout')
+        parser.add_argument('--format', choices=sorted(EXPORTERS), help='Defaults to the file extension, csv for stdout')
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or ('csv' if path == '-' else path.rsplit('.', 1)[-1].lower())
+        if file_format not in EXPORTERS:
+            raise CommandError('Cannot tell the file format, pass --format csv or --format jsonl')
+        exporter, _ = EXPORTERS[file_format]
+
+        start = time.perf_counter()
+        count = 0
+
+        def counted(rows):
+            nonlocal count
+            for row in rows:
+                count += 1
+                yield row
+
+        chunks = exporter(counted(export_rows(chunk_size=options['batch_size'])))
+        if path == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            with open(path, 'w', newline='', encoding='utf-8') as stream:
+                stream.writelines(chunks)
+
+        elapsed = time.perf_counter() - start
+        rate = count / elapsed if elapsed else 0
+        message = f'Exported {count} products in {elapsed:.1f}s ({rate:.0f} rows/s)'
+        # Keep stdout clean when the export itself goes there
+        out = self.stderr if path == '-' else self.stdout
+        out.write(message, style_func=self.style.SUCCESS)
@@ -0,0 +1,40 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.catalog_io import READERS, import_catalog
+
+
+class Command(BaseCommand):
+    help = 'Create or update products from a CSV or JSONL file, matched on SKU.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or JSONL file, or - for stdin')
+        parser.add_argument('--format', choices=sorted(READERS), help='Defaults to the file extension')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or path.rsplit('.', 1)[-1].lower()
+        if file_format not in READERS:
+            raise CommandError('Cannot tell the file format, pass --format csv or --format jsonl')
+
+        def progress(result):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {result.rows} rows ({result.rate:.0f} rows/s)')
+
+        def report(row_number, message):
+            self.stderr.write(f'Row {row_number}: {message}')
+
+        stream = sys.stdin if path == '-' else open(path, newline='', encoding='utf-8')
+        try:
+            result = import_catalog(READERS[file_format](stream), options['batch_size'], progress, report)
+        finally:
+            if stream is not sys.stdin:
+                stream.close()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {result.rows} rows in {result.elapsed:.1f}s ({result.rate:.0f} rows/s): '
+            f'{result.created} created, {result.updated} updated, {result.unchanged} unchanged, '
+            f'{result.skipped} skipped'
+        ))
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.models import StockReservation
+
+
+class Command(BaseCommand):
+    help = 'Delete expired cart stock reservations in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        now = timezone.now()
+        expired = StockReservation.objects.filter(expires_at__lte=now).order_by('expires_at')
+        released = 0
+        while True:
+            # Short transactions: each batch is one indexed range read and one delete
+            batch = list(expired.values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            released += StockReservation.objects.filter(pk__in=batch).delete()[0]
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations'))
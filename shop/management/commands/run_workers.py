@@ -0,0 +1,88 @@
+import signal
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connections
+
+from shop.queue import claim, requeue_stale, run_in_worker
+
+
+class Command(BaseCommand):
+    help = (
+        'Run queued tasks on a pool of threads or processes until stopped. On PostgreSQL '
+        'any number of these can share the queue; on SQLite run one.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=settings.TASK_WORKERS)
+        parser.add_argument('--processes', action='store_true', help='Use a process pool instead of threads')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='Seconds between checks for new tasks')
+        parser.add_argument('--once', action='store_true', help='Exit when no task is due')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        previous = None
+        # Signal handlers can only be installed from the main thread
+        if threading.current_thread() is threading.main_thread():
+            previous = signal.signal(signal.SIGTERM, self.stop)
+        if options['processes']:
+            # Children must not share the parent's database connections
+            connections.close_all()
+            pool = ProcessPoolExecutor(options['workers'], initializer=django.setup)
+        else:
+            pool = ThreadPoolExecutor(options['workers'], thread_name_prefix='task-worker')
+
+        succeeded = failed = 0
+        running = set()
+        try:
+            while not self.stopping:
+                try:
+                    requeue_stale()
+                    task_ids = claim(options['workers'] - len(running))
+                except OperationalError as e:
+                    # Lock contention or a lost connection; try again next poll
+                    self.stderr.write(f'Could not claim tasks: {e}')
+                    close_old_connections()
+                    task_ids = None
+                running.update(pool.submit(run_in_worker, task_id) for task_id in task_ids or [])
+                if not running:
+                    if options['once'] and task_ids is not None:
+                        break
+                    time.sleep(options['poll_interval'])
+                    continue
+                done, running = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    if self.succeeded(future):
+                        succeeded += 1
+                    else:
+                        failed += 1
+        except KeyboardInterrupt:
+            pass
+        finally:
+            # Let running tasks finish; their rows would otherwise wait out the lease
+            for future in wait(running).done:
+                if self.succeeded(future):
+                    succeeded += 1
+                else:
+                    failed += 1
+            pool.shutdown()
+            if previous is not None:
+                signal.signal(signal.SIGTERM, previous)
+
+        self.stdout.write(self.style.SUCCESS(f'Ran {succeeded + failed} tasks: {succeeded} succeeded, {failed} failed'))
+
+    def succeeded(self, future):
+        try:
+            return future.result()
+        except Exception as e:
+            # The task's own errors are recorded on its row; this is the queue
+            # failing to record them. Its lease expiring will requeue it.
+            self.stderr.write(f'Task bookkeeping failed: {e}')
+            return False
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,208 @@
+"""Per-request timings: a ``Server-Timing`` header, Prometheus histograms and a slow request log.
+
+``TimingMiddleware`` (shop/middleware.py) starts a ``Timings`` for each
+request. Every query run while it is current is counted and timed by
+``record_query``, an execute wrapper installed on each new database
+connection, and time spent in the ``to_representation`` of serializers using
+``TimedSerializerMixin`` (or a ``FastReadMixin`` plan's output) is added up
+by ``serializer_timer``. That time includes the queries serialization runs,
+which are also counted under the database.
+
+Histograms are kept per process by route name and method and exposed by
+``exposition()`` on ``/api/metrics/``; each worker reports its own.
+"""
+import bisect
+import logging
+import threading
+import time
+import traceback
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+current_timings = ContextVar('current_timings', default=None)
+
+SECONDS_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+
+# Stack frames kept per query in the slow request log
+STACK_DEPTH = 8
+
+
+@dataclass
+class Timings:
+    started: float
+    capture: bool = False
+    queries: int = 0
+    db: float = 0.0
+    serializer: float = 0.0
+    serializing: bool = False
+    # (seconds, sql, stack) per query, only when capture is set; the stack is
+    # None for queries faster than SLOW_QUERY_MS
+    captured: list = field(default_factory=list)
+
+
+def record_query(execute, sql, params, many, context):
+    timings = current_timings.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - start
+        timings.queries += 1
+        timings.db += elapsed
+        if timings.capture:
+            slow = elapsed * 1000 >= settings.SLOW_QUERY_MS
+            timings.captured.append((elapsed, sql, traceback.extract_stack()[:-1] if slow else None))
+
+
+def install_query_timer(sender, connection, **kwargs):
+    """``connection_created`` receiver; wrappers outlive the connection, so add it once."""
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializer_timer():
+    timings = current_timings.get()
+    if timings is None or timings.serializing:
+        # Nested serializers are already inside the outer one's time
+        yield
+        return
+    timings.serializing = True
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.serializer += time.perf_counter() - start
+        timings.serializing = False
+
+
+class TimedSerializerMixin:
+    """Count the serializer's output, alone or as the child of a list, as serializer time."""
+
+    def to_representation(self, instance):
+        with serializer_timer():
+            return super().to_representation(instance)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self.lock:
+            counts, total = self.series.get(labels, (None, 0.0))
+            if counts is None:
+                # One slot per bucket plus +Inf
+                counts = [0] * (len(self.buckets) + 1)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.series[labels] = (counts, total + value)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            series = {labels: (list(counts), total) for labels, (counts, total) in self.series.items()}
+        for labels, (counts, total) in sorted(series.items()):
+            label_text = ','.join(f'{name}="{escape_label(value)}"' for name, value in labels)
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label_text},le="{bound}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+            lines.append(f'{self.name}_count{{{label_text}}} {cumulative}')
+        return lines
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_SECONDS = Histogram('shop_request_duration_seconds', 'Time to produce the response.', SECONDS_BUCKETS)
+DB_SECONDS = Histogram('shop_request_db_seconds', 'Time spent running database queries.', SECONDS_BUCKETS)
+DB_QUERIES = Histogram('shop_request_db_queries', 'Database queries run.', QUERY_BUCKETS)
+SERIALIZER_SECONDS = Histogram(
+    'shop_request_serializer_seconds', 'Time spent serializing response data.', SECONDS_BUCKETS
+)
+HISTOGRAMS = (REQUEST_SECONDS, DB_SECONDS, DB_QUERIES, SERIALIZER_SECONDS)
+
+
+def route_name(request):
+    match = getattr(request, 'resolver_match', None)
+    # Named routes keep the label set small; unmatched paths share one label
+    return match.view_name if match is not None else 'unmatched'
+
+
+def record_request(request, timings, total):
+    labels = (('route', route_name(request)), ('method', request.method))
+    REQUEST_SECONDS.observe(labels, total)
+    DB_SECONDS.observe(labels, timings.db)
+    DB_QUERIES.observe(labels, timings.queries)
+    SERIALIZER_SECONDS.observe(labels, timings.serializer)
+
+
+def server_timing(timings, total):
+    return (
+        f'db;dur={timings.db * 1000:.1f};desc="{timings.queries} queries", '
+        f'serializer;dur={timings.serializer * 1000:.1f}, '
+        f'total;dur={total * 1000:.1f}'
+    )
+
+
+def exposition():
+    """All histograms in the Prometheus text format."""
+    lines = []
+    for histogram in HISTOGRAMS:
+        lines.extend(histogram.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def project_frames(stack):
+    """The frames of ``stack`` in this project's code, innermost last."""
+    root = str(settings.BASE_DIR)
+    frames = [
+        frame for frame in stack
+        if frame.filename.startswith(root) and 'site-packages' not in frame.filename
+    ]
+    return frames[-STACK_DEPTH:]
+
+
+def log_slow_request(request, timings, total):
+    lines = [
+        f'Slow request: {request.method} {request.get_full_path()} took {total * 1000:.1f} ms, '
+        f'{timings.queries} queries in {timings.db * 1000:.1f} ms, '
+        f'serializer {timings.serializer * 1000:.1f} ms'
+    ]
+    for elapsed, sql, stack in timings.captured:
+        lines.append(f'  {elapsed * 1000:.1f} ms  {sql}')
+        if stack is not None:
+            lines.extend(
+                f'      {frame.filename}:{frame.lineno} in {frame.name}' for frame in project_frames(stack)
+            )
+    logger.warning('\n'.join(lines))
+
+
+def start_request():
+    """Start timing a request; returns its ``Timings`` and the token to reset ``current_timings`` with."""
+    timings = Timings(time.perf_counter(), capture=settings.SLOW_REQUEST_MS > 0)
+    return timings, current_timings.set(timings)
+
+
+def finish_request(request, response, timings):
+    """Report ``timings`` once ``response`` is ready; called after ``current_timings`` is reset."""
+    total = time.perf_counter() - timings.started
+    response['Server-Timing'] = server_timing(timings, total)
+    record_request(request, timings, total)
+    if settings.SLOW_REQUEST_MS and total * 1000 >= settings.SLOW_REQUEST_MS:
+        log_slow_request(request, timings, total)
+    return response
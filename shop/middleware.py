@@ -0,0 +1,118 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+from django.utils.cache import patch_vary_headers
+from rest_framework.permissions import SAFE_METHODS
+
+from .metrics import current_timings, finish_request, start_request
+from .routers import RequestRouting, current_request, pin_to_primary
+
+
+def accepts_gzip(header):
+    """Whether an ``Accept-Encoding`` value lists gzip, honouring ``q=0``."""
+    for entry in header.split(','):
+        coding, _, params = entry.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        for param in params.split(';'):
+            name, _, value = param.partition('=')
+            if name.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if coding in ('gzip', 'x-gzip'):
+            return quality > 0
+    return False
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """Gzip responses of at least ``GZIP_MIN_LENGTH`` bytes for clients that accept it.
+
+    Smaller bodies fit in a packet or two either way and are left alone.
+    Streaming responses (the CSV and JSONL exports) are compressed whatever their size.
+    """
+
+    def process_response(self, request, response):
+        if not response.streaming and len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        if not accepts_gzip(request.META.get('HTTP_ACCEPT_ENCODING', '')):
+            if not response.has_header('Content-Encoding'):
+                patch_vary_headers(response, ('Accept-Encoding',))
+            return response
+        return super().process_response(request, response)
+
+
+class ReplicaRoutingMiddleware:
+    """Make the request visible to ``PrimaryReplicaRouter``.
+
+    Reads of unsafe requests stay on the primary, and a user whose unsafe
+    request succeeded is pinned to it for ``REPLICA_STICKY_SECONDS`` afterwards.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = self.start(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return self.finish(request, response)
+
+    async def __acall__(self, request):
+        token = self.start(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_request.reset(token)
+        return await sync_to_async(self.finish)(request, response)
+
+    def start(self, request):
+        unsafe = request.method not in SAFE_METHODS
+        return current_request.set(RequestRouting(request, pinned=True if unsafe else None))
+
+    def finish(self, request, response):
+        if request.method not in SAFE_METHODS and response.status_code < 400:
+            # DRF has replaced the session user with the authenticated one
+            pin_to_primary(getattr(request, 'user', None))
+        return response
+
+
+class TimingMiddleware:
+    """Time each request for ``Server-Timing``, the ``/api/metrics/`` histograms and the slow request log.
+
+    First in ``MIDDLEWARE`` so the total covers the other middleware too.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        timings, token = start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return finish_request(request, response, timings)
+
+    async def __acall__(self, request):
+        timings, token = start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            current_timings.reset(token)
+        return finish_request(request, response, timings)
@@ -0,0 +1,59 @@
+from django.db import migrations
+
+from shop.search import install_sqlite_triggers
+
+POSTGRES_FORWARD = [
+    """
+    ALTER TABLE shop_product ADD COLUMN search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('english', coalesce(name, '')), 'A') ||
+        setweight(to_tsvector('english', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX product_search_vector_idx ON shop_product USING GIN (search_vector)",
+]
+
+POSTGRES_REVERSE = [
+    "DROP INDEX IF EXISTS product_search_vector_idx",
+    "ALTER TABLE shop_product DROP COLUMN IF EXISTS search_vector",
+]
+
+# External-content FTS5 table kept current by triggers, so bulk writes are
+# indexed too.
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE shop_product_fts USING fts5(
+        name, description, content='shop_product', content_rowid='id'
+    )
+    """,
+]
+
+SQLITE_REVERSE = [
+    "DROP TRIGGER IF EXISTS shop_product_fts_insert",
+    "DROP TRIGGER IF EXISTS shop_product_fts_delete",
+    "DROP TRIGGER IF EXISTS shop_product_fts_update",
+    "DROP TABLE IF EXISTS shop_product_fts",
+]
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in {'postgresql': POSTGRES_FORWARD, 'sqlite': SQLITE_FORWARD}.get(vendor, []):
+        schema_editor.execute(statement)
+    install_sqlite_triggers(schema_editor)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    for statement in {'postgresql': POSTGRES_REVERSE, 'sqlite': SQLITE_REVERSE}.get(vendor, []):
+        schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_cursor_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:31
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+from shop.search import install_sqlite_triggers
+
+
+def backfill_rating_aggregates(apps, schema_editor):
+    Product = apps.get_model('shop', 'Product')
+    Review = apps.get_model('shop', 'Review')
+    aggregates = Review.objects.values('product_id').annotate(
+        rating_count=Count('pk'),
+        rating_sum=Sum('rating'),
+        **{f'rating_{star}': Count('pk', filter=Q(rating=star)) for star in range(1, 6)},
+    )
+    for row in aggregates.iterator():
+        Product.objects.filter(pk=row.pop('product_id')).update(**row)
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    install_sqlite_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_product_search'),
+    ]
+
+    # Adding or removing NOT NULL columns rebuilds shop_product on SQLite,
+    # which drops the search triggers in both directions.
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_triggers),
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+        migrations.RunPython(backfill_rating_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:58
+
+from django.db import migrations, models
+
+from shop.search import install_sqlite_triggers
+
+
+def reinstall_search_triggers(apps, schema_editor):
+    install_sqlite_triggers(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(migrations.RunPython.noop, reinstall_search_triggers),
+        migrations.AddField(
+            model_name='product',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+        migrations.RunPython(reinstall_search_triggers, migrations.RunPython.noop),
+    ]
@@ -1,7 +1,10 @@
 import uuid
+from decimal import Decimal
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
+from django.db import models, transaction
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
 
 class User(AbstractUser):
@@ -32,6 +35,8 @@ class Category(models.Model):
 
 
 class Product(models.Model):
+    # Supplier's stock keeping unit; the key for bulk catalog imports
+    sku = models.CharField(max_length=64, unique=True, blank=True, null=True)
     name = models.CharField(max_length=200)
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
@@ -42,12 +47,34 @@ class Product(models.Model):
     )
     stock = models.IntegerField(default=0)
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Resized copies of image, written by shop.images once an upload commits
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     is_active = models.BooleanField(default=True)
+    # Review aggregates, maintained incrementally by Review saves and deletes
+    rating_count = models.PositiveIntegerField(default=0, editable=False)
+    rating_sum = models.PositiveIntegerField(default=0, editable=False)
+    rating_1 = models.PositiveIntegerField(default=0, editable=False)
+    rating_2 = models.PositiveIntegerField(default=0, editable=False)
+    rating_3 = models.PositiveIntegerField(default=0, editable=False)
+    rating_4 = models.PositiveIntegerField(default=0, editable=False)
+    rating_5 = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_id_idx'),
+            # The storefront only lists active products, newest first, optionally by category
+            models.Index(
+                fields=['-created_at', '-id'], name='product_active_created_idx',
+                condition=models.Q(is_active=True),
+            ),
+            models.Index(
+                fields=['category', '-created_at', '-id'], name='product_active_category_idx',
+                condition=models.Q(is_active=True),
+            ),
+        ]
 
     def __str__(self):
         return self.name
@@ -81,10 +108,27 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-orderDate']
+        indexes = [
+            models.Index(fields=['-orderDate', '-orderId'], name='order_date_id_idx'),
+            models.Index(fields=['user', '-orderDate', '-orderId'], name='order_user_date_idx'),
+        ]
 
     def __str__(self):
         return f"Order {self.orderId} - {self.user.email}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Status as loaded, so a save can move the order between sales rollups
+        instance._status_snapshot = instance.__dict__.get('status')
+        return instance
+
+    def save(self, *args, **kwargs):
+        # The post_save receiver updates the sales rollups; keep it in the
+        # same transaction as the order row.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class OrderItem(models.Model):
     orderItemId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -111,6 +155,43 @@ class OrderItem(models.Model):
         return self.quantity * self.price
 
 
+def _money_field():
+    return models.DecimalField(max_digits=12, decimal_places=2)
+
+
+def _line_total(prefix=''):
+    return models.ExpressionWrapper(
+        models.F(f'{prefix}quantity') * models.F(f'{prefix}product__price'),
+        output_field=_money_field(),
+    )
+
+
+class ShoppingCartQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Annotate ``total_items`` and ``total_price`` computed in SQL.
+
+        Correlated subqueries rather than a JOIN and GROUP BY, so a page of
+        carts only sums its own lines instead of every cart in the table.
+        """
+        lines = CartItem.objects.filter(cart=models.OuterRef('pk')).order_by().values('cart')
+        return self.annotate(
+            total_items=Coalesce(
+                models.Subquery(lines.annotate(count=models.Count('pk')).values('count')),
+                models.Value(0),
+            ),
+            total_price=Coalesce(
+                models.Subquery(lines.annotate(total=models.Sum(_line_total())).values('total')),
+                models.Value(Decimal('0.00')),
+                output_field=_money_field(),
+            ),
+        )
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_total_price(self):
+        return self.annotate(total_price=_line_total())
+
+
 class ShoppingCart(models.Model):
     cartId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user = models.ForeignKey(
@@ -121,12 +202,24 @@ class ShoppingCart(models.Model):
     createdAt = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = ShoppingCartQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Shopping Carts"
 
     def __str__(self):
         return f"Cart {self.cartId} - {self.user.email}"
 
+    def get_total_items(self):
+        if hasattr(self, 'total_items'):
+            return self.total_items
+        return len(self.cart_items.all())
+
+    def get_total_price(self):
+        if hasattr(self, 'total_price'):
+            return self.total_price
+        return sum(item.get_total_price() for item in self.cart_items.all())
+
 
 class CartItem(models.Model):
     cartItemId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -142,6 +235,8 @@ class CartItem(models.Model):
     )
     quantity = models.PositiveIntegerField(default=1)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         verbose_name_plural = "Cart Items"
         unique_together = ['cart', 'product']  # Prevent duplicate products in cart
@@ -150,9 +245,40 @@ class CartItem(models.Model):
         return f"{self.quantity} x {self.product.name}"
 
     def get_total_price(self):
+        if hasattr(self, 'total_price'):
+            return self.total_price
         return self.quantity * self.product.price
 
 
+class StockReservation(models.Model):
+    """Stock held for a cart line until ``expires_at``."""
+    reservationId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    cart_item = models.OneToOneField(
+        CartItem,
+        on_delete=models.CASCADE,
+        related_name='reservation'
+    )
+    product = models.ForeignKey(
+        Product,
+        on_delete=models.CASCADE,
+        related_name='reservations'
+    )
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = "Stock Reservations"
+        indexes = [
+            # Active reservations per product: sum(quantity) WHERE expires_at > now
+            models.Index(fields=['product', 'expires_at', 'quantity'], name='reservation_product_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expiry_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} until {self.expires_at}"
+
+
 class Review(models.Model):
     RATING_CHOICES = [
         (1, '1 Star'),
@@ -182,10 +308,30 @@ class Review(models.Model):
         verbose_name_plural = "Reviews"
         unique_together = ['product', 'user']  # One review per product per user
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['-created_at', '-reviewId'], name='review_created_id_idx'),
+            models.Index(fields=['product', '-created_at', '-reviewId'], name='review_product_created_idx'),
+            models.Index(fields=['user', '-created_at', '-reviewId'], name='review_user_created_idx'),
+        ]
 
     def __str__(self):
         return f"Review by {self.user.email} for {self.product.name}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._rating_snapshot = instance.get_rating_snapshot()
+        return instance
+
+    def get_rating_snapshot(self):
+        return self.__dict__.get('product_id'), self.__dict__.get('rating')
+
+    def save(self, *args, **kwargs):
+        # The post_save receiver updates the product's rating aggregates;
+        # keep it in the same transaction as the review row.
+        with transaction.atomic(using=kwargs.get('using')):
+            super().save(*args, **kwargs)
+
 
 class UserAddress(models.Model):
     addressId = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -205,6 +351,9 @@ class UserAddress(models.Model):
     class Meta:
         verbose_name_plural = "User Addresses"
         ordering = ['-is_default', '-created_at']
+        indexes = [
+            models.Index(fields=['user', '-is_default', '-created_at'], name='address_user_default_idx'),
+        ]
 
     def __str__(self):
         return f"{self.street}, {self.city}, {self.state} {self.zipCode}"
@@ -247,6 +396,117 @@ class Payment(models.Model):
     class Meta:
         verbose_name_plural = "Payments"
         ordering = ['-paymentDate']
+        indexes = [
+            models.Index(fields=['-paymentDate', '-paymentId'], name='payment_date_id_idx'),
+        ]
 
     def __str__(self):
         return f"Payment {self.paymentId} - {self.amount}"
+
+
+class SalesRollup(models.Model):
+    """Sales of orders in one status on one day (in ``TIME_ZONE``).
+
+    Maintained incrementally by ``shop.analytics`` and rebuilt from orders by
+    ``manage.py rebuild_sales_rollups``. ``orders`` counts distinct orders,
+    ``units`` and ``revenue`` sum the order lines.
+    """
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Order.ORDER_STATUS_CHOICES)
+    orders = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        abstract = True
+
+
+class DailySales(SalesRollup):
+    class Meta:
+        verbose_name_plural = "Daily Sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status'], name='daily_sales_unique'),
+        ]
+
+
+class DailyCategorySales(SalesRollup):
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = "Daily Category Sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'category'], name='daily_category_sales_unique'),
+        ]
+
+
+class DailyProductSales(SalesRollup):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+
+    class Meta:
+        verbose_name_plural = "Daily Product Sales"
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'status', 'product'], name='daily_product_sales_unique'),
+        ]
+
+
+class Task(models.Model):
+    """A call queued for ``manage.py run_workers`` (see ``shop.queue``).
+
+    Finished tasks are deleted; ``failed`` ones stay for inspection.
+    """
+    STATUS_CHOICES = [
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('failed', 'Failed'),
+    ]
+
+    name = models.CharField(max_length=255)
+    args = models.JSONField(default=list, blank=True)
+    kwargs = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['run_at']
+        indexes = [
+            models.Index(fields=['status', 'run_at'], name='task_status_run_at_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
+
+
+class IdempotencyKey(models.Model):
+    """The first response to a request sent with an ``Idempotency-Key`` header.
+
+    ``status_code`` is empty while that request is still running. Rows are
+    kept until ``expires_at``; see ``shop.idempotency``.
+    """
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='idempotency_keys'
+    )
+    key = models.CharField(max_length=255)
+    fingerprint = models.CharField(max_length=64)
+    status_code = models.PositiveSmallIntegerField(blank=True, null=True)
+    response = models.JSONField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='idempotency_key_unique'),
+        ]
+        indexes = [
+            models.Index(fields=['expires_at'], name='idempotency_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.key} ({self.user_id})"
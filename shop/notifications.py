@@ -0,0 +1,33 @@
+"""Customer emails, sent from the task queue (``shop.queue``) after commit."""
+from django.conf import settings
+from django.core.mail import send_mail
+
+from .models import Order, Payment
+
+
+def send_order_confirmation(order_id):
+    order = Order.objects.select_related('user').prefetch_related('order_items__product').filter(pk=order_id).first()
+    if order is None:
+        return
+    lines = [
+        f'{item.quantity} x {item.product.name} @ {item.price}'
+        for item in order.order_items.all()
+    ]
+    send_mail(
+        f'Order {order.orderId} received',
+        '\n'.join(['Thank you for your order.', '', *lines, '', f'Total: {order.totalAmount}']),
+        settings.DEFAULT_FROM_EMAIL,
+        [order.user.email],
+    )
+
+
+def send_payment_receipt(payment_id):
+    payment = Payment.objects.select_related('order__user').filter(pk=payment_id).first()
+    if payment is None:
+        return
+    send_mail(
+        f'Payment received for order {payment.order_id}',
+        f'We received your payment of {payment.amount} ({payment.get_paymentMethod_display()}).',
+        settings.DEFAULT_FROM_EMAIL,
+        [payment.order.user.email],
+    )
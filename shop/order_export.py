@@ -0,0 +1,65 @@
+"""Streaming order-history export.
+
+Orders are read with ``iterator(chunk_size=...)``: on PostgreSQL that is a
+server-side cursor, and the items of each chunk are fetched with one
+prefetch query, so memory is bounded by the chunk size rather than by the
+number of orders exported.
+"""
+from django.db.models import Prefetch
+
+from .models import OrderItem
+from .streaming import csv_lines, ndjson_lines
+
+CSV_HEADER = [
+    'order_id', 'order_date', 'user_email', 'status', 'total_amount',
+    'product_id', 'product_sku', 'product_name', 'quantity', 'price',
+]
+
+
+def export_orders(queryset, chunk_size=1000):
+    """Stream ``queryset`` oldest first, each order with its items prefetched."""
+    items = OrderItem.objects.select_related('product').only(
+        'order_id', 'quantity', 'price', 'product', 'product__sku', 'product__name'
+    )
+    return queryset.select_related('user').only(
+        'orderDate', 'status', 'totalAmount', 'user', 'user__email'
+    ).prefetch_related(
+        Prefetch('order_items', queryset=items)
+    ).order_by('orderDate', 'orderId').iterator(chunk_size=chunk_size)
+
+
+def orders_csv(orders):
+    """One row per order item; an order without items gets one row of its own."""
+    def rows():
+        for order in orders:
+            head = [order.pk, order.orderDate.isoformat(), order.user.email, order.status, order.totalAmount]
+            items = order.order_items.all()
+            if not items:
+                yield head + [''] * 5
+            for item in items:
+                yield head + [item.product_id, item.product.sku or '', item.product.name, item.quantity, item.price]
+    return csv_lines(CSV_HEADER, rows())
+
+
+def orders_ndjson(orders):
+    """One JSON object per order, with its items nested."""
+    return ndjson_lines({
+        'order_id': order.pk,
+        'order_date': order.orderDate,
+        'user_email': order.user.email,
+        'status': order.status,
+        'total_amount': order.totalAmount,
+        'items': [{
+            'product_id': item.product_id,
+            'product_sku': item.product.sku,
+            'product_name': item.product.name,
+            'quantity': item.quantity,
+            'price': item.price,
+        } for item in order.order_items.all()],
+    } for order in orders)
+
+
+EXPORTERS = {
+    'csv': (orders_csv, 'text/csv'),
+    'jsonl': (orders_ndjson, 'application/x-ndjson'),
+}
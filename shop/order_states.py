@@ -0,0 +1,74 @@
+"""Order status changes, checked against the allowed transitions.
+
+``transition()`` moves any number of orders to a new status in one
+transaction: the orders are locked, checked, moved between sales rollups and
+updated with set-based queries, and the stock of cancelled orders is put
+back with one F() update. Every status change made by the API and the admin
+goes through it; ``Order.save()`` with a new status still updates the
+rollups but skips the checks.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Sum
+from django.db.models.functions import Now
+
+from .analytics import move_sales
+from .inventory import restore_stock
+from .models import Order, OrderItem
+
+TRANSITIONS = {
+    'pending': {'confirmed', 'cancelled'},
+    'confirmed': {'shipped', 'cancelled'},
+    'shipped': {'delivered'},
+    'delivered': set(),
+    'cancelled': set(),
+}
+# Entering these statuses returns the orders' items to stock
+RESTOCKING = {'cancelled'}
+
+
+class InvalidTransition(Exception):
+    def __init__(self, invalid):
+        self.invalid = invalid
+        super().__init__(f'{len(invalid)} order(s) cannot change status: {invalid}')
+
+
+def transition(orders, status, from_statuses=None, strict=True):
+    """Move ``orders`` (a queryset) to ``status``; return ``(changed ids, invalid)``.
+
+    ``invalid`` maps the orders that may not make the move (or are not in
+    one of ``from_statuses``) to their current status. With ``strict``,
+    any invalid order raises ``InvalidTransition`` and nothing changes;
+    otherwise the others are still moved. Orders already in ``status`` are
+    left alone and count as neither.
+    """
+    if status not in TRANSITIONS:
+        raise ValueError(f'Unknown order status {status!r}')
+    with transaction.atomic():
+        current = dict(orders.select_for_update(of=('self',)).order_by().values_list('pk', 'status'))
+        by_status = defaultdict(list)
+        invalid = {}
+        for pk, old_status in current.items():
+            if old_status == status:
+                continue
+            if status not in TRANSITIONS[old_status] or (from_statuses and old_status not in from_statuses):
+                invalid[pk] = old_status
+            else:
+                by_status[old_status].append(pk)
+        if invalid and strict:
+            raise InvalidTransition(invalid)
+
+        changed = [pk for order_ids in by_status.values() for pk in order_ids]
+        if not changed:
+            return changed, invalid
+        for old_status, order_ids in by_status.items():
+            move_sales(order_ids, old_status, status)
+        Order.objects.filter(pk__in=changed).update(status=status, updated_at=Now())
+        if status in RESTOCKING:
+            restore_stock(dict(
+                OrderItem.objects.filter(order__in=changed).order_by()
+                .values('product_id').annotate(quantity=Sum('quantity'))
+                .values_list('product_id', 'quantity')
+            ))
+        return changed, invalid
@@ -0,0 +1,104 @@
+import json
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import QuerySet
+from django.utils.functional import cached_property
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, _reverse_ordering
+from rest_framework.request import Request
+
+
+class ProductCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+
+
+class OrderCursorPagination(CursorPagination):
+    ordering = ('-orderDate', '-orderId')
+
+
+class ReviewCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-reviewId')
+
+
+class PaymentCursorPagination(CursorPagination):
+    ordering = ('-paymentDate', '-paymentId')
+
+
+class AsyncCursorPagination(CursorPagination):
+    """``CursorPagination`` for the async catalog views.
+
+    Built from the ordering of the sync view's pagination class, it writes
+    and reads the same cursors and envelope, so a ``next`` or ``previous``
+    link works whichever view serves it. Only the page query differs: it
+    runs through the async ORM.
+    """
+
+    def __init__(self, ordering):
+        self.ordering = ordering
+
+    async def apaginate_queryset(self, queryset, request):
+        # CursorPagination.paginate_queryset() around an awaited page query
+        self.request = request = Request(request)
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+        self.ordering = self.get_ordering(request, queryset, None)
+
+        self.cursor = self.decode_cursor(request)
+        offset, reverse, current_position = self.cursor or (0, False, None)
+        queryset = queryset.order_by(*(_reverse_ordering(self.ordering) if reverse else self.ordering))
+        if current_position is not None:
+            order = self.ordering[0]
+            lookup = 'lt' if reverse != order.startswith('-') else 'gt'
+            queryset = queryset.filter(**{f'{order.lstrip("-")}__{lookup}': current_position})
+
+        try:
+            results = [obj async for obj in queryset[offset:offset + self.page_size + 1]]
+        except (ValueError, ValidationError):
+            # A cursor position that is not a valid value of the ordering field
+            raise NotFound(self.invalid_cursor_message)
+        self.page = results[:self.page_size]
+        has_following = len(results) > len(self.page)
+        following = self._get_position_from_instance(results[-1], self.ordering) if has_following else None
+
+        has_current = current_position is not None or offset > 0
+        if reverse:
+            self.page.reverse()
+            self.has_next, self.has_previous = has_current, has_following
+            self.next_position, self.previous_position = current_position, following
+        else:
+            self.has_next, self.has_previous = has_following, has_current
+            self.next_position, self.previous_position = following, current_position
+        return self.page
+
+    def get_paginated_data(self, data):
+        return {'next': self.get_next_link(), 'previous': self.get_previous_link(), 'results': data}
+
+
+class EstimatedCountPaginator(Paginator):
+    """Admin paginator that does not ``COUNT(*)`` large result sets.
+
+    On PostgreSQL the planner's row estimate for the changelist query is used
+    when it is above ``ADMIN_EXACT_COUNT_LIMIT``; smaller (or non-PostgreSQL)
+    result sets are counted exactly. Page links past the real end simply
+    show an empty page.
+    """
+
+    @cached_property
+    def count(self):
+        estimate = self.estimated_count()
+        if estimate is not None and estimate > settings.ADMIN_EXACT_COUNT_LIMIT:
+            return estimate
+        return super().count
+
+    def estimated_count(self):
+        queryset = self.object_list
+        if not isinstance(queryset, QuerySet) or connections[queryset.db].vendor != 'postgresql':
+            return None
+        plan = json.loads(queryset.order_by().explain(format='json'))
+        # Django unwraps the one-element list PostgreSQL returns, depending on the driver
+        if isinstance(plan, list):
+            plan = plan[0]
+        return int(plan['Plan']['Plan Rows'])
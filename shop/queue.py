@@ -0,0 +1,109 @@
+"""A durable task queue in the database, run by ``manage.py run_workers``.
+
+``enqueue()`` writes a ``Task`` row in the caller's transaction, so a task
+exists only if the work that queued it commits, and workers (which only see
+committed rows) never pick it up early. Tasks are plain functions named by
+their import path, called with JSON arguments. A task that raises is retried
+with exponential backoff until ``max_attempts`` and then left ``failed``.
+Tasks can run more than once (a worker may die after the work but before the
+delete), so they should be safe to repeat.
+"""
+import logging
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Task
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(func, *args, delay=0, max_attempts=None, **kwargs):
+    """Queue ``func(*args, **kwargs)`` to run ``delay`` seconds after commit."""
+    task = Task.objects.create(
+        name=f'{func.__module__}.{func.__qualname__}',
+        args=list(args),
+        kwargs=kwargs,
+        max_attempts=max_attempts or settings.TASK_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+    if settings.TASK_QUEUE_EAGER and not delay:
+        transaction.on_commit(lambda: run_task(task.pk))
+    return task
+
+
+def backoff(attempts):
+    """Seconds to wait before retrying a task that has failed ``attempts`` times."""
+    return min(settings.TASK_RETRY_BACKOFF * 2 ** (attempts - 1), settings.TASK_RETRY_BACKOFF_MAX)
+
+
+def claim(limit):
+    """Mark up to ``limit`` due tasks as running and return their ids.
+
+    On PostgreSQL, rows locked by another worker's claim are skipped, so any
+    number of ``run_workers`` processes can share the queue.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        due = Task.objects.filter(status='queued', run_at__lte=now).order_by('run_at')
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        task_ids = list(due.values_list('pk', flat=True)[:limit])
+        if task_ids:
+            Task.objects.filter(pk__in=task_ids).update(
+                status='running', locked_at=now, attempts=F('attempts') + 1, updated_at=now
+            )
+    return task_ids
+
+
+def requeue_stale():
+    """Give tasks whose worker died mid-run (past ``TASK_LEASE_SECONDS``) another go."""
+    now = timezone.now()
+    stale = Task.objects.filter(
+        status='running', locked_at__lt=now - timedelta(seconds=settings.TASK_LEASE_SECONDS)
+    )
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status='failed', locked_at=None, last_error='Worker lease expired', updated_at=now
+    )
+    return failed + stale.update(status='queued', locked_at=None, run_at=now, updated_at=now)
+
+
+def run_task(task_id):
+    """Run a claimed (or, eagerly, a queued) task; return True if it succeeded."""
+    task = Task.objects.filter(pk=task_id).first()
+    if task is None:
+        return False
+    try:
+        func = import_string(task.name)
+        func(*task.args, **task.kwargs)
+    except Exception:
+        attempts = max(task.attempts, 1)
+        retry = attempts < task.max_attempts
+        now = timezone.now()
+        Task.objects.filter(pk=task.pk).update(
+            status='queued' if retry else 'failed',
+            attempts=attempts,
+            run_at=now + timedelta(seconds=backoff(attempts)) if retry else task.run_at,
+            locked_at=None,
+            last_error=traceback.format_exc(),
+            updated_at=now,
+        )
+        logger.warning('Task %s (%s) failed, attempt %s of %s', task.pk, task.name, attempts, task.max_attempts,
+                       exc_info=True)
+        return False
+    task.delete()
+    return True
+
+
+def run_in_worker(task_id):
+    # Pool threads and processes keep their own connections between tasks
+    close_old_connections()
+    try:
+        return run_task(task_id)
+    finally:
+        close_old_connections()
@@ -0,0 +1,74 @@
+"""Send catalog and review reads to read replicas.
+
+Only reads made while serving a GET/HEAD/OPTIONS request go to a replica,
+and only for the models in ``REPLICATED``; orders, carts, payments and
+everything outside a request (management commands, queued tasks) use the
+primary, as do all writes. A request sticks to one replica for all its
+reads. Once a user has made a write request, their reads stay on the primary
+for ``REPLICA_STICKY_SECONDS`` so they see their own changes while the
+replicas catch up; for the same window after a catalog write, responses a
+replica builds are not kept in the catalog cache (``shop.cache.keep_entry``).
+``ReplicaRoutingMiddleware`` (shop/middleware.py) tracks the request being
+served.
+"""
+import random
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICATED = {'shop.Category', 'shop.Product', 'shop.Review'}
+
+current_request = ContextVar('current_request', default=None)
+
+
+@dataclass
+class RequestRouting:
+    request: object
+    # None until the first routed read looks up whether the user is pinned
+    pinned: bool = None
+    replica: str = None
+
+
+def pinned_key(user_id):
+    return f'db:pinned:{user_id}'
+
+
+def pin_to_primary(user):
+    """Keep ``user``'s reads on the primary for ``REPLICA_STICKY_SECONDS``."""
+    if user is not None and user.is_authenticated and settings.REPLICA_STICKY_SECONDS:
+        cache.set(pinned_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def read_replica():
+    """The replica the current request has read from, or ``None``."""
+    routing = current_request.get()
+    return routing.replica if routing is not None else None
+
+
+class PrimaryReplicaRouter:
+    def db_for_read(self, model, **hints):
+        routing = current_request.get()
+        if routing is None or model._meta.label not in REPLICATED or not settings.DATABASE_REPLICAS:
+            return DEFAULT_DB_ALIAS
+        if routing.pinned is None:
+            # DRF has authenticated the request by the time the view reads
+            user = getattr(routing.request, 'user', None)
+            routing.pinned = bool(user is not None and user.is_authenticated and cache.get(pinned_key(user.pk)))
+        if routing.pinned:
+            return DEFAULT_DB_ALIAS
+        if routing.replica is None:
+            routing.replica = random.choice(settings.DATABASE_REPLICAS)
+        return routing.replica
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary
+        databases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
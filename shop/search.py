@@ -0,0 +1,84 @@
+from django.db import connection
+from django.db.models import BooleanField, FloatField, Q
+from django.db.models.expressions import RawSQL
+
+from .models import Product
+
+PRODUCT_TABLE = Product._meta.db_table
+# Created by migration 0003_product_search: a stored tsvector column with a
+# GIN index on PostgreSQL, an external-content FTS5 table on SQLite.
+PRODUCT_VECTOR = f'{PRODUCT_TABLE}.search_vector'
+PRODUCT_FTS = f'{PRODUCT_TABLE}_fts'
+
+SQLITE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS}_insert AFTER INSERT ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {PRODUCT_FTS}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS}_delete AFTER DELETE ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {PRODUCT_FTS}({PRODUCT_FTS}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS {PRODUCT_FTS}_update
+    AFTER UPDATE OF name, description ON {PRODUCT_TABLE} BEGIN
+        INSERT INTO {PRODUCT_FTS}({PRODUCT_FTS}, rowid, name, description)
+        VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO {PRODUCT_FTS}(rowid, name, description)
+        VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+
+def install_sqlite_triggers(schema_editor):
+    """(Re)create the FTS5 sync triggers and rebuild the index.
+
+    SQLite drops a table's triggers whenever a migration rebuilds it, so every
+    migration that alters ``shop_product`` on SQLite has to call this again.
+    """
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    for statement in SQLITE_TRIGGERS:
+        schema_editor.execute(statement)
+    schema_editor.execute(f"INSERT INTO {PRODUCT_FTS}({PRODUCT_FTS}) VALUES ('rebuild')")
+
+
+def _fts5_query(query):
+    # Quote every term so user input can never be parsed as FTS5 syntax
+    return ' '.join('"%s"' % term.replace('"', '""') for term in query.split())
+
+
+def search_products(queryset, query):
+    """Filter ``queryset`` to products matching ``query``, best match first.
+
+    Name matches weigh more than description matches. Falls back to the
+    unranked ``icontains`` scan on backends without a full-text index.
+    """
+    if connection.vendor == 'postgresql':
+        tsquery = "websearch_to_tsquery('english', %s)"
+        return queryset.filter(
+            RawSQL(f'{PRODUCT_VECTOR} @@ {tsquery}', [query], output_field=BooleanField())
+        ).annotate(
+            rank=RawSQL(f'ts_rank({PRODUCT_VECTOR}, {tsquery})', [query], output_field=FloatField())
+        ).order_by('-rank', '-id')
+
+    if connection.vendor == 'sqlite':
+        match = _fts5_query(query)
+        return queryset.filter(
+            id__in=RawSQL(f'SELECT rowid FROM {PRODUCT_FTS} WHERE {PRODUCT_FTS} MATCH %s', [match])
+        ).annotate(
+            # bm25() is lower for better matches
+            rank=RawSQL(
+                f'SELECT -bm25({PRODUCT_FTS}, 10.0, 1.0) FROM {PRODUCT_FTS} '
+                f'WHERE {PRODUCT_FTS} MATCH %s AND rowid = {PRODUCT_TABLE}.id',
+                [match],
+                output_field=FloatField(),
+            )
+        ).order_by('-rank', '-id')
+
+    return queryset.filter(Q(name__icontains=query) | Q(description__icontains=query))
@@ -6,10 +6,16 @@ from .models import (
     ShoppingCart, CartItem, Review, UserAddress, Payment
 )
 from django.db import transaction
+from .analytics import add_sales
+from .images import variant_urls
+from .inventory import decrement_stock
+from .metrics import TimedSerializerMixin
+from .notifications import send_order_confirmation
+from .queue import enqueue
 import uuid
 
 
-class UserSerializer(serializers.ModelSerializer):
+class UserSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'email', 'phone', 'address', 'first_name', 'last_name')
@@ -54,19 +60,30 @@ class LoginSerializer(serializers.Serializer):
         raise serializers.ValidationError('Must include "email" and "password"')
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = '__all__'
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
+    rating_average = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = Product
         fields = '__all__'
 
+    def get_image_variants(self, obj):
+        request = self.context.get('request')
+        return variant_urls(obj, request.build_absolute_uri if request is not None else None)
+
+    def get_rating_average(self, obj):
+        if not obj.rating_count:
+            return None
+        return round(obj.rating_sum / obj.rating_count, 2)
+
 
 class OrderItemSerializer(serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
@@ -80,7 +97,7 @@ class OrderItemSerializer(serializers.ModelSerializer):
         return obj.get_total_price()
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     order_items = OrderItemSerializer(many=True, read_only=True)
     user_email = serializers.CharField(source='user.email', read_only=True)
     total_amount = serializers.DecimalField(max_digits=10, decimal_places=2, read_only=True)
@@ -88,6 +105,13 @@ class OrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = '__all__'
+        # Status changes go through order_states.transition(): the cancel and process_payment actions
+        read_only_fields = ('status',)
+
+    def validate(self, attrs):
+        if 'status' in self.initial_data:
+            raise serializers.ValidationError({'status': 'Use the cancel or process_payment actions'})
+        return super().validate(attrs)
 
 
 class CreateOrderSerializer(serializers.ModelSerializer):
@@ -96,27 +120,32 @@ class CreateOrderSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
         fields = ('user', 'order_items', 'totalAmount', 'status')
+        # New orders start pending
+        read_only_fields = ('status',)
 
     def create(self, validated_data):
+        """Raises ``InsufficientStock`` if a line asks for more than carts' reservations leave."""
         order_items_data = validated_data.pop('order_items')
+        quantities = {}
+        for item_data in order_items_data:
+            product_id = item_data['product'].pk
+            quantities[product_id] = quantities.get(product_id, 0) + item_data['quantity']
 
         with transaction.atomic():
+            # Same set-based, reservation-aware update as checkout
+            decrement_stock(quantities)
             order = Order.objects.create(**validated_data)
 
             for item_data in order_items_data:
                 OrderItem.objects.create(order=order, **item_data)
 
-            # Update product stock
-            for item_data in order_items_data:
-                product = item_data['product']
-                quantity = item_data['quantity']
-                product.stock -= quantity
-                product.save()
+            add_sales([order.pk])
+            enqueue(send_order_confirmation, str(order.pk))
 
         return order
 
 
-class CartItemSerializer(serializers.ModelSerializer):
+class CartItemSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     product_name = serializers.CharField(source='product.name', read_only=True)
     product_price = serializers.DecimalField(source='product.price', max_digits=10, decimal_places=2, read_only=True)
     total_price = serializers.SerializerMethodField()
@@ -129,7 +158,7 @@ class CartItemSerializer(serializers.ModelSerializer):
         return obj.get_total_price()
 
 
-class ShoppingCartSerializer(serializers.ModelSerializer):
+class ShoppingCartSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     cart_items = CartItemSerializer(many=True, read_only=True)
     total_price = serializers.SerializerMethodField()
     user_email = serializers.CharField(source='user.email', read_only=True)
@@ -139,11 +168,11 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
     def get_total_price(self, obj):
-        return sum(item.get_total_price() for item in obj.cart_items.all())
+        return obj.get_total_price()
 
 
 class AddToCartSerializer(serializers.Serializer):
-    product_id = serializers.UUIDField()
+    product_id = serializers.IntegerField()
     quantity = serializers.IntegerField(min_value=1)
 
     def validate(self, attrs):
@@ -162,7 +191,23 @@ class AddToCartSerializer(serializers.Serializer):
         return attrs
 
 
-class ReviewSerializer(serializers.ModelSerializer):
+class CartLineSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+
+class SetCartItemsSerializer(serializers.Serializer):
+    items = CartLineSerializer(many=True, allow_empty=False, max_length=100)
+    replace = serializers.BooleanField(default=False)
+
+    def validate_items(self, items):
+        product_ids = [item['product_id'] for item in items]
+        if len(set(product_ids)) != len(product_ids):
+            raise serializers.ValidationError("Each product can only appear once")
+        return items
+
+
+class ReviewSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     user_email = serializers.CharField(source='user.email', read_only=True)
     product_name = serializers.CharField(source='product.name', read_only=True)
 
@@ -172,17 +217,37 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ('user',)
 
 
-class UserAddressSerializer(serializers.ModelSerializer):
+class UserAddressSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = UserAddress
         fields = '__all__'
         read_only_fields = ('user',)
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(TimedSerializerMixin, serializers.ModelSerializer):
     order_amount = serializers.DecimalField(source='order.totalAmount', max_digits=10, decimal_places=2, read_only=True)
     user_email = serializers.CharField(source='order.user.email', read_only=True)
 
     class Meta:
         model = Payment
-        fields = '__all__'
\ No newline at end of file
+        fields = '__all__'
+
+
+class SalesSummarySerializer(TimedSerializerMixin, serializers.Serializer):
+    orders = serializers.IntegerField()
+    units = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+class DailySalesSerializer(SalesSummarySerializer):
+    day = serializers.DateField()
+
+
+class CategorySalesSerializer(SalesSummarySerializer):
+    category = serializers.IntegerField(source='category_id')
+    category_name = serializers.CharField(source='category__name')
+
+
+class ProductSalesSerializer(SalesSummarySerializer):
+    product = serializers.IntegerField(source='product_id')
+    product_name = serializers.CharField(source='product__name')
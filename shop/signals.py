@@ -0,0 +1,88 @@
+from collections import Counter, defaultdict
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Now
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from .analytics import move_sales, remove_sales
+from .authentication import user_cache_key
+from .cache import invalidate_catalog
+from .images import schedule_product_image
+from .models import Category, Order, Product, Review, User
+
+
+@receiver([post_save, post_delete], sender=Product)
+@receiver([post_save, post_delete], sender=Category)
+def catalog_changed(sender, **kwargs):
+    invalidate_catalog()
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, **kwargs):
+    # Also true when a full save wrote back variants loaded before the
+    # current ones; processing checks the row again and skips if done
+    if (instance.image.name or None) != (instance.image_variants or {}).get('source'):
+        product_id = instance.pk
+        transaction.on_commit(lambda: schedule_product_image(product_id))
+
+
+def apply_rating_changes(removed, added):
+    """Move rating aggregates from the ``removed`` to the ``added`` snapshot.
+
+    Snapshots are ``(product_id, rating)`` pairs or ``None``. Each affected
+    product gets one UPDATE with F() deltas, so concurrent reviews of the
+    same product do not lose counts.
+    """
+    deltas = defaultdict(Counter)
+    for snapshot, sign in ((removed, -1), (added, 1)):
+        if snapshot and snapshot[0] is not None:
+            product_id, rating = snapshot
+            deltas[product_id].update({
+                'rating_count': sign,
+                'rating_sum': sign * rating,
+                f'rating_{rating}': sign,
+            })
+    for product_id, delta in deltas.items():
+        changes = {field: F(field) + value for field, value in delta.items() if value}
+        if changes:
+            Product.objects.filter(pk=product_id).update(updated_at=Now(), **changes)
+            invalidate_catalog()
+
+
+@receiver(post_save, sender=Review)
+def review_saved(sender, instance, created, **kwargs):
+    previous = None if created else getattr(instance, '_rating_snapshot', None)
+    instance._rating_snapshot = instance.get_rating_snapshot()
+    apply_rating_changes(previous, instance._rating_snapshot)
+
+
+@receiver(post_delete, sender=Review)
+def review_deleted(sender, instance, **kwargs):
+    apply_rating_changes(getattr(instance, '_rating_snapshot', None) or instance.get_rating_snapshot(), None)
+
+
+@receiver(post_save, sender=Order)
+def order_saved(sender, instance, created, **kwargs):
+    # New orders are added to the sales rollups once their lines are written
+    previous = None if created else getattr(instance, '_status_snapshot', None)
+    instance._status_snapshot = instance.status
+    if previous is not None:
+        move_sales([instance.pk], previous, instance.status)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, **kwargs):
+    # Lines are still there before the cascade
+    remove_sales([instance.pk])
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, update_fields=None, **kwargs):
+    # Logins only stamp last_login, which authentication does not read
+    if update_fields is not None and set(update_fields) == {'last_login'}:
+        return
+    key = user_cache_key(instance.pk)
+    transaction.on_commit(lambda: cache.delete(key))
@@ -0,0 +1,15 @@
+'use strict';
+{
+    const $ = django.jQuery;
+
+    // Reload the changelist filtered by the object picked in an autocomplete filter
+    $(function() {
+        $('select[data-filter-query]').on('change', function() {
+            const params = new URLSearchParams(this.dataset.filterQuery);
+            if (this.value) {
+                params.set(this.name, this.value);
+            }
+            window.location.search = params.toString();
+        });
+    });
+}
@@ -0,0 +1,29 @@
+"""Line-at-a-time CSV and NDJSON writers.
+
+The generators yield one encoded line per row, so they can feed a
+``StreamingHttpResponse`` or ``file.writelines`` without building the
+document in memory.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+
+class Echo:
+    """File-like object whose ``write`` hands the line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(header, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(header)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield json.dumps(record, cls=DjangoJSONEncoder) + '\n'
@@ -1,3 +1,2056 @@
-from django.test import TestCase
+import gzip
+import importlib
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import admin
+from django.core import mail
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import clear_url_caches, reverse
+from django.utils import timezone
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .analytics import add_sales
+from .cache import bump_catalog_version
+from .catalog_io import ERRORS_KEPT, import_catalog
+from .fast_serializers import plan_for
+from .serializers import ProductSerializer
+from .inventory import decrement_stock
+from .metrics import current_timings
+from .middleware import accepts_gzip
+from .order_states import InvalidTransition, transition
+from .pagination import EstimatedCountPaginator
+from .queue import claim, enqueue, requeue_stale, run_task
+from .renderers import FastJSONRenderer
+from .routers import pin_to_primary, pinned_key
+from .throttling import TokenBucketThrottle
+from .models import (
+    User, Category, Product, Order, OrderItem,
+    ShoppingCart, CartItem, Review, UserAddress, Payment, StockReservation,
+    DailySales, DailyCategorySales, DailyProductSales, IdempotencyKey, Task
+)
+
+
+PAGE_SIZE = 10
+
+
+def create_user(email, is_staff=False, password=None):
+    return User.objects.create_user(
+        username=email.split('@')[0],
+        email=email,
+        password=password,
+        is_staff=is_staff,
+    )
+
+
+def seed_catalog(categories=3, products_per_category=5, stock=100):
+    products = []
+    for _ in range(categories):
+        c = Category.objects.count()
+        category = Category.objects.create(name=f'Category {c}')
+        for p in range(products_per_category):
+            products.append(Product.objects.create(
+                name=f'Product {c}-{p}',
+                description=f'Description of product {c}-{p}',
+                price=Decimal('10.00') + p,
+                category=category,
+                stock=stock,
+            ))
+    return products
+
+
+def seed_orders(user, products, count, items_per_order=3):
+    orders = []
+    for i in range(count):
+        order = Order.objects.create(user=user)
+        total = Decimal('0')
+        for product in products[i % len(products):][:items_per_order]:
+            OrderItem.objects.create(order=order, product=product, quantity=2, price=product.price)
+            total += product.price * 2
+        order.totalAmount = total
+        order.save()
+        Payment.objects.create(order=order, amount=total, paymentMethod='credit_card')
+        orders.append(order)
+    return orders
+
+
+@contextmanager
+def async_catalog():
+    """Route the catalog through ``shop.async_views`` for the duration."""
+    from DjangoShopProject import urls as project_urls
+    from . import urls as shop_urls
+
+    def reload():
+        importlib.reload(shop_urls)
+        importlib.reload(project_urls)
+        clear_url_caches()
+
+    try:
+        with override_settings(ASYNC_CATALOG=True):
+            reload()
+            yield
+    finally:
+        reload()
+
+
+def seed_reviews(products, count):
+    for i in range(count):
+        user = create_user(f'reviewer{Review.objects.count()}@example.com')
+        Review.objects.create(product=products[i % len(products)], user=user, rating=i % 5 + 1)
+
+
+class QueryBudgetTests(TestCase):
+    """Every router endpoint must run in a fixed number of queries.
+
+    Each endpoint is measured with a nearly empty page and again with a full
+    page of rows that carry relations, so an N+1 shows up as a budget miss.
+    Requests are force-authenticated to keep the token lookup out of the count,
+    and the response cache is cleared so cached endpoints hit the database.
+    """
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = create_user('staff@example.com', is_staff=True)
+        self.user = create_user('customer@example.com')
+        self.products = seed_catalog()
+
+    def assertBudget(self, url, budget, user=None):
+        self.client.force_authenticate(user or self.user)
+        cache.clear()
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return response
+
+    def assertListBudget(self, name, budget, grow, user=None):
+        grow(1)
+        self.assertBudget(reverse(name), budget, user)
+        grow(PAGE_SIZE + 2)
+        response = self.assertBudget(reverse(name), budget, user)
+        self.assertEqual(len(response.data['results']), PAGE_SIZE)
+
+    def test_users(self):
+        self.assertListBudget(
+            'user-list', 2, lambda n: [create_user(f'u{i}-{n}@example.com') for i in range(n)], self.staff
+        )
+        self.assertBudget(reverse('user-detail', args=[self.user.pk]), 1, self.staff)
+
+    def test_categories(self):
+        self.assertListBudget('category-list', 2, lambda n: seed_catalog(n, 0))
+        category = Category.objects.first()
+        self.assertBudget(reverse('category-detail', args=[category.pk]), 1)
+
+    def test_products(self):
+        self.assertListBudget('product-list', 1, lambda n: seed_catalog(1, n))
+        self.assertBudget(reverse('product-detail', args=[self.products[0].pk]), 1)
+
+    def test_orders(self):
+        self.assertListBudget('order-list', 2, lambda n: seed_orders(self.user, self.products, n))
+        order = Order.objects.filter(user=self.user).first()
+        self.assertBudget(reverse('order-detail', args=[order.pk]), 2)
+
+    def test_orders_as_staff(self):
+        other = create_user('other@example.com')
+        self.assertListBudget('order-list', 2, lambda n: seed_orders(other, self.products, n), self.staff)
+
+    def test_cart(self):
+        cart = ShoppingCart.objects.create(user=self.user)
+
+        def grow(n):
+            for product in self.products[cart.cart_items.count():][:n]:
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        grow(1)
+        self.assertBudget(reverse('cart-list'), 3)
+        self.assertBudget(reverse('cart-detail', args=[cart.pk]), 2)
+        grow(PAGE_SIZE + 2)
+        self.assertBudget(reverse('cart-list'), 3)
+        response = self.assertBudget(reverse('cart-detail', args=[cart.pk]), 2)
+        self.assertEqual(len(response.data['cart_items']), PAGE_SIZE + 3)
+
+    def test_reviews(self):
+        for product in self.products:
+            Review.objects.create(product=product, user=self.user, rating=4)
+        self.assertBudget(reverse('review-list'), 1)
+        review = Review.objects.filter(user=self.user).first()
+        self.assertBudget(reverse('review-detail', args=[review.pk]), 1)
+
+    def test_product_reviews(self):
+        url = reverse('review-product-reviews') + f'?product_id={self.products[0].pk}'
+        seed_reviews(self.products[:1], 1)
+        self.assertBudget(url, 1)
+        seed_reviews(self.products[:1], PAGE_SIZE)
+        self.assertBudget(url, 1)
+
+    def test_addresses(self):
+        def grow(n):
+            for i in range(n):
+                UserAddress.objects.create(
+                    user=self.user, street=f'{i} Main St', city='Almaty', state='AL', zipCode='050000'
+                )
+
+        self.assertListBudget('address-list', 2, grow)
+        address = UserAddress.objects.filter(user=self.user).first()
+        self.assertBudget(reverse('address-detail', args=[address.pk]), 1)
+
+    def test_payments(self):
+        self.assertListBudget('payment-list', 1, lambda n: seed_orders(self.user, self.products, n))
+        payment = Payment.objects.filter(order__user=self.user).first()
+        self.assertBudget(reverse('payment-detail', args=[payment.pk]), 1)
+
+
+class CursorPaginationTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.products = seed_catalog(1, 3)
+
+    def walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            seen.extend(response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_pages_cover_every_row_once_despite_timestamp_ties(self):
+        orders = seed_orders(self.user, self.products, 2 * PAGE_SIZE + 5)
+        Order.objects.update(orderDate=orders[0].orderDate)
+        seen = [row['orderId'] for row in self.walk(reverse('order-list'))]
+        self.assertEqual(len(seen), len(orders))
+        self.assertEqual(set(seen), {str(order.pk) for order in orders})
+
+    def test_newest_first(self):
+        seed_orders(self.user, self.products, PAGE_SIZE + 1)
+        for name, field in [('order-list', 'orderDate'), ('payment-list', 'paymentDate')]:
+            dates = [row[field] for row in self.walk(reverse(name))]
+            self.assertEqual(len(dates), PAGE_SIZE + 1)
+            self.assertEqual(dates, sorted(dates, reverse=True))
+
+
+class ProductSearchTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        category = Category.objects.create(name='Outdoor')
+        self.tent = Product.objects.create(
+            name='Mountain tent', description='Two person shelter', price=100, category=category
+        )
+        self.stove = Product.objects.create(
+            name='Camping stove', description='Fits next to any tent', price=40, category=category
+        )
+        Product.objects.create(name='Kettle', description='Boils water', price=20, category=category)
+
+    def search(self, query):
+        response = self.client.get(reverse('product-list'), {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [row['id'] for row in response.data['results']]
+
+    def test_name_matches_rank_above_description_matches(self):
+        self.assertEqual(self.search('tent'), [self.tent.pk, self.stove.pk])
+
+    def test_all_terms_must_match(self):
+        self.assertEqual(self.search('camping tent'), [self.stove.pk])
+
+    def test_index_follows_saves_and_deletes(self):
+        self.tent.name = 'Mountain hammock'
+        self.tent.description = 'Sleeps one'
+        self.tent.save()
+        self.assertEqual(self.search('tent'), [self.stove.pk])
+        self.assertEqual(self.search('hammock'), [self.tent.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.stove.delete()
+        self.assertEqual(self.search('tent'), [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        self.assertEqual(self.search('tent" OR kettle*'), [])
+
+    def test_combines_with_category_filter(self):
+        other = Category.objects.create(name='Kitchen')
+        response = self.client.get(reverse('product-list'), {'q': 'tent', 'category': other.pk})
+        self.assertEqual(response.data['results'], [])
+
+
+class RatingAggregateTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.product, self.other = seed_catalog(1, 2)
+
+    def assertRatings(self, product, count, total, histogram):
+        product.refresh_from_db()
+        self.assertEqual(product.rating_count, count)
+        self.assertEqual(product.rating_sum, total)
+        self.assertEqual([getattr(product, f'rating_{star}') for star in range(1, 6)], histogram)
+
+    def test_create_update_delete_through_the_api(self):
+        response = self.client.post(reverse('review-list'), {'product': self.product.pk, 'rating': 4})
+        self.assertEqual(response.status_code, 201, response.content)
+        seed_reviews([self.product], 1)
+        self.assertRatings(self.product, 2, 5, [1, 0, 0, 1, 0])
+
+        url = reverse('review-detail', args=[response.data['reviewId']])
+        self.client.patch(url, {'rating': 2})
+        self.assertRatings(self.product, 2, 3, [1, 1, 0, 0, 0])
+
+        self.client.patch(url, {'product': self.other.pk})
+        self.assertRatings(self.product, 1, 1, [1, 0, 0, 0, 0])
+        self.assertRatings(self.other, 1, 2, [0, 1, 0, 0, 0])
+
+        self.client.delete(url)
+        self.assertRatings(self.other, 0, 0, [0, 0, 0, 0, 0])
+
+    def test_cascade_delete(self):
+        seed_reviews([self.product], 3)
+        self.assertRatings(self.product, 3, 6, [1, 1, 1, 0, 0])
+        Review.objects.filter(rating=2).get().user.delete()
+        self.assertRatings(self.product, 2, 4, [1, 0, 1, 0, 0])
+
+    def test_exposed_on_product(self):
+        seed_reviews([self.product], 2)
+        cache.clear()
+        data = self.client.get(reverse('product-detail', args=[self.product.pk])).data
+        self.assertEqual(data['rating_count'], 2)
+        self.assertEqual(data['rating_average'], 1.5)
+        self.assertEqual(data['rating_1'], 1)
+
+    def test_product_reviews_are_paginated(self):
+        seed_reviews([self.product], PAGE_SIZE + 2)
+        response = self.client.get(reverse('review-product-reviews'), {'product_id': self.product.pk})
+        self.assertEqual(len(response.data['results']), PAGE_SIZE)
+        self.assertEqual(len(self.client.get(response.data['next']).data['results']), 2)
+
+
+class FastReadSerializerTests(TestCase):
+    """``FastReadMixin`` responses must match the DRF serializers byte for byte."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.staff = create_user('staff@example.com', is_staff=True)
+        self.user = create_user('customer@example.com')
+        self.products = seed_catalog(2, 8)
+        Product.objects.filter(pk=self.products[0].pk).update(
+            image='products/shoe.jpg', sku='SKU-1',
+            image_variants={'source': 'products/shoe.jpg', 'sizes': {'thumb': {'webp': 'products/variants/a.webp'}}},
+        )
+        Product.objects.filter(pk=self.products[1].pk).update(image='products/stale.jpg')
+        seed_reviews(self.products, 12)
+        for product in self.products[:PAGE_SIZE + 2]:
+            Review.objects.create(product=product, user=self.user, rating=3, comment='Fine')
+        self.orders = seed_orders(self.user, self.products, PAGE_SIZE + 2)
+        seed_orders(self.staff, self.products, 2, items_per_order=1)
+
+    def assertSameResponse(self, url, user=None):
+        self.client.force_authenticate(user or self.user)
+        with override_settings(FAST_READ_SERIALIZERS=False):
+            cache.clear()
+            expected = self.client.get(url)
+        cache.clear()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, expected.status_code)
+        self.assertEqual(response.content, expected.content)
+        return response
+
+    def test_products(self):
+        response = self.assertSameResponse(reverse('product-list'))
+        self.assertSameResponse(response.data['next'])
+        self.assertSameResponse(reverse('product-list') + f'?category={self.products[0].category_id}')
+        self.assertSameResponse(reverse('product-list') + '?q=product')
+        with mock.patch('shop.fast_serializers.Plan.serialize', wraps=plan_for(ProductSerializer).serialize) as fast:
+            response = self.assertSameResponse(reverse('product-detail', args=[self.products[0].pk]))
+        fast.assert_called_once()
+        self.assertEqual(response.data['image'], 'http://testserver/media/products/shoe.jpg')
+        self.assertEqual(
+            response.data['image_variants'], {'thumb': {'webp': 'http://testserver/media/products/variants/a.webp'}}
+        )
+        self.assertSameResponse(reverse('product-detail', args=[self.products[1].pk]))
+        self.assertSameResponse(reverse('product-detail', args=[0]))
+
+    def test_orders(self):
+        response = self.assertSameResponse(reverse('order-list'))
+        self.assertEqual(len(response.data['results'][0]['order_items']), 3)
+        self.assertSameResponse(response.data['next'])
+        self.assertSameResponse(reverse('order-list'), self.staff)
+        self.assertSameResponse(reverse('order-detail', args=[self.orders[0].pk]))
+        self.assertSameResponse(reverse('order-detail', args=['not-a-uuid']))
+        other = Order.objects.filter(user=self.staff).first()
+        self.assertEqual(self.assertSameResponse(reverse('order-detail', args=[other.pk])).status_code, 404)
+
+    def test_reviews(self):
+        response = self.assertSameResponse(reverse('review-list'))
+        self.assertSameResponse(response.data['next'])
+        review = Review.objects.filter(user=self.user).first()
+        self.assertSameResponse(reverse('review-detail', args=[review.pk]))
+
+    def test_unplannable_serializer_is_refused(self):
+        class WholeObjectSerializer(serializers.ModelSerializer):
+            summary = serializers.CharField(source='*', read_only=True)
+
+            class Meta:
+                model = Product
+                fields = ('id', 'summary')
+
+        with self.assertRaises(ImproperlyConfigured):
+            plan_for(WholeObjectSerializer)
+
+
+class FastJSONRendererTests(TestCase):
+    def assertSameJSON(self, data, accepted_media_type=None):
+        expected = JSONRenderer().render(data, accepted_media_type)
+        self.assertEqual(FastJSONRenderer().render(data, accepted_media_type), expected)
+
+    def test_matches_json_renderer(self):
+        moment = timezone.now()
+        self.assertSameJSON({
+            'decimals': [Decimal('19.99'), Decimal('0'), Decimal('-3.50'), Decimal('0.00001'), Decimal('1E+20')],
+            'floats': [4.33, 1e16, 1e-05, -0.0, 2.5e-300],
+            'uuid': uuid.uuid4(),
+            'datetimes': [
+                moment, moment.replace(microsecond=0), timezone.localtime(moment, dt_timezone(timedelta(hours=6)))
+            ],
+            'date': moment.date(),
+            'time': moment.time(),
+            'duration': timedelta(minutes=90),
+            'text': 'caf\u00e9 \u2028 \u2029 "quoted" \x00',
+            'lazy': gettext_lazy('Pending'),
+            'tuple': (1, (2, 3)),
+            'set': {'only'},
+            'nested': [{'a': None, 'b': True, 'c': [], 'd': {}}],
+        })
+        self.assertSameJSON({1: 'non-string key', 'big': 2 ** 70})
+        self.assertSameJSON(['a', 1], 'application/json; indent=4')
+        self.assertEqual(FastJSONRenderer().render(None), b'')
+
+    def test_order_list(self):
+        user = create_user('customer@example.com')
+        seed_orders(user, seed_catalog(2, 5), PAGE_SIZE)
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(reverse('order-list'))
+        self.assertEqual(response.content, JSONRenderer().render(response.data))
+        # Decimal line totals and UUIDs take the orjson path, not the fallback
+        with mock.patch.object(JSONRenderer, 'render', side_effect=AssertionError):
+            self.assertEqual(FastJSONRenderer().render(response.data), response.content)
+
+
+@override_settings(GZIP_MIN_LENGTH=1024)
+class CompressionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seed_catalog(2, 5)
+        self.client = APIClient()
+
+    def test_large_responses_are_gzipped_when_accepted(self):
+        url = reverse('product-list')
+        plain = self.client.get(url)
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertIn('Accept-Encoding', plain['Vary'])
+
+        response = self.client.get(url, HTTP_ACCEPT_ENCODING='br, gzip;q=0.8')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertLess(len(response.content), len(plain.content))
+        self.assertEqual(gzip.decompress(response.content), plain.content)
+        self.assertTrue(response['ETag'].startswith('W/'))
+
+        self.assertNotIn('Content-Encoding', self.client.get(url, HTTP_ACCEPT_ENCODING='gzip;q=0, br'))
+
+    def test_small_responses_are_not_compressed(self):
+        response = self.client.get(reverse('category-list'), HTTP_ACCEPT_ENCODING='gzip')
+        self.assertLess(len(response.content), 1024)
+        self.assertNotIn('Content-Encoding', response)
+
+    def test_accepts_gzip(self):
+        for header, expected in [
+            ('gzip', True), ('deflate, GZIP', True), ('gzip;q=0.001', True), ('x-gzip', True),
+            ('', False), ('br', False), ('gzip;q=0', False), ('gzip; q=0.0', False), ('*', False),
+        ]:
+            self.assertIs(accepts_gzip(header), expected, header)
+
+
+@contextmanager
+def sqlite_replica():
+    """A second, empty SQLite database registered as the ``replica`` alias.
+
+    It is never written to by the app, so anything it returns proves the
+    read was routed to it; rows written to the primary show up as replication
+    lag.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        connections.settings['replica'] = dict(
+            connections.settings['default'], NAME=os.path.join(directory, 'replica.sqlite3')
+        )
+        try:
+            call_command('migrate', database='replica', verbosity=0)
+            with override_settings(DATABASE_REPLICAS=['replica']):
+                yield
+        finally:
+            connections['replica'].close()
+            del connections['replica']
+            del connections.settings['replica']
+
+
+# Catalog responses are not cached, so every request reads a database
+@override_settings(CATALOG_CACHE_TIMEOUT=0)
+class ReplicaRoutingTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Not declared on the class: the test runner would try to set the
+        # alias up before it exists. It must exist before TestCase opens its
+        # transactions, which then also undo each test's replica rows.
+        cls.enterClassContext(sqlite_replica())
+        cls.databases = {'default', 'replica'}
+        super().setUpClass()
+
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('customer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.primary_products = seed_catalog(1, 3)
+        category = Category.objects.using('replica').create(name='Replica category')
+        self.replica_product = Product.objects.using('replica').create(
+            name='Replica product', description='Only on the replica', price=Decimal('1.00'), category=category
+        )
+
+    def product_names(self, client=None):
+        return [row['name'] for row in (client or self.client).get(reverse('product-list')).json()['results']]
+
+    def test_catalog_reads_use_the_replica(self):
+        self.assertEqual(self.product_names(APIClient()), ['Replica product'])
+        response = self.client.get(reverse('product-detail', args=[self.replica_product.pk]))
+        self.assertEqual(response.data['name'], 'Replica product')
+
+    async def test_async_catalog_reads_use_the_replica(self):
+        with async_catalog():
+            response = await self.async_client.get(reverse('product-list'))
+        self.assertEqual([row['name'] for row in response.json()['results']], ['Replica product'])
+
+    def test_orders_and_writes_use_the_primary(self):
+        order = seed_orders(self.user, self.primary_products, 1)[0]
+        self.assertEqual(self.client.get(reverse('order-detail', args=[order.pk])).status_code, 200)
+        response = self.client.post(reverse('review-list'), {'product': self.primary_products[0].pk, 'rating': 5})
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(Review.objects.using('default').filter(pk=response.data['reviewId']).exists())
+        self.assertFalse(Review.objects.using('replica').exists())
+
+    def test_reads_stick_to_the_primary_after_a_write(self):
+        self.client.post(reverse('review-list'), {'product': self.primary_products[0].pk, 'rating': 5})
+        self.assertEqual(len(self.client.get(reverse('review-list')).data['results']), 1)
+        self.assertEqual(self.product_names(), [product.name for product in reversed(self.primary_products)])
+
+        other = APIClient()
+        other.force_authenticate(create_user('other@example.com'))
+        self.assertEqual(self.product_names(other), ['Replica product'])
+
+        cache.delete(pinned_key(self.user.pk))
+        self.assertEqual(self.client.get(reverse('review-list')).data['results'], [])
+
+    async def test_async_reads_stick_to_the_primary_after_a_write(self):
+        other = await sync_to_async(create_user)('other@example.com')
+        user_auth, other_auth = (
+            {'Authorization': f'Bearer {RefreshToken.for_user(user).access_token}'} for user in (self.user, other)
+        )
+        url = reverse('review-product-reviews') + f'?product_id={self.primary_products[0].pk}'
+        with async_catalog():
+            response = await self.async_client.post(
+                reverse('review-list'), {'product': self.primary_products[0].pk, 'rating': 5}, headers=user_auth
+            )
+            self.assertEqual(response.status_code, 201)
+            response = await self.async_client.get(url, headers=user_auth)
+            self.assertEqual(len(response.json()['results']), 1)
+            response = await self.async_client.get(url, headers=other_auth)
+            self.assertEqual(response.json()['results'], [])
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=300)
+    def test_catalog_cache_is_filled_from_the_replica(self):
+        self.assertEqual(self.product_names(APIClient()), ['Replica product'])
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(0, using='replica'):
+            self.assertEqual(self.product_names(APIClient()), ['Replica product'])
+
+    @override_settings(CATALOG_CACHE_TIMEOUT=300)
+    def test_replica_pages_are_not_cached_right_after_a_write(self):
+        # The replica lags behind the primary; a cached page would keep its rows for the whole timeout
+        bump_catalog_version()
+        for _ in range(2):
+            with CaptureQueriesContext(connections['replica']) as queries:
+                self.assertEqual(self.product_names(APIClient()), ['Replica product'])
+            self.assertTrue(queries)
+        with async_catalog():
+            for _ in range(2):
+                with CaptureQueriesContext(connections['replica']) as queries:
+                    self.assertEqual(self.product_names(APIClient()), ['Replica product'])
+                self.assertTrue(queries)
+
+        # The writer reads the primary, and that page is kept for everyone
+        pin_to_primary(self.user)
+        primary_names = [product.name for product in reversed(self.primary_products)]
+        self.assertEqual(self.product_names(), primary_names)
+        with self.assertNumQueries(0, using='default'), self.assertNumQueries(0, using='replica'):
+            self.assertEqual(self.product_names(APIClient()), primary_names)
+
+    def test_failed_writes_do_not_pin(self):
+        self.assertEqual(self.client.post(reverse('review-list'), {'rating': 9}).status_code, 400)
+        self.assertEqual(self.product_names(), ['Replica product'])
+
+    def test_reads_outside_requests_use_the_primary(self):
+        self.assertEqual(Product.objects.all().db, 'default')
+        self.assertEqual(Product.objects.count(), 3)
+
+
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.products = seed_catalog(2, 8)
+
+    def timings(self, response):
+        entries = {}
+        for entry in response['Server-Timing'].split(', '):
+            name, *params = entry.split(';')
+            entries[name] = dict(param.split('=', 1) for param in params)
+        return entries
+
+    def test_server_timing(self):
+        for fast in (True, False):
+            with self.subTest(fast=fast), override_settings(FAST_READ_SERIALIZERS=fast):
+                cache.clear()
+                with CaptureQueriesContext(connection) as queries:
+                    response = self.client.get(reverse('product-list'))
+                timings = self.timings(response)
+                self.assertEqual(timings['db']['desc'], f'"{len(queries)} queries"')
+                self.assertGreater(float(timings['serializer']['dur']), 0)
+                self.assertGreaterEqual(float(timings['total']['dur']), float(timings['serializer']['dur']))
+        # Nothing is counted outside a request
+        self.assertIsNone(current_timings.get())
+
+    def test_metrics_endpoint(self):
+        self.client.get(reverse('product-list'))
+        self.assertIn(self.client.get(reverse('metrics-list')).status_code, (401, 403))
+        self.client.force_authenticate(create_user('customer@example.com'))
+        self.assertEqual(self.client.get(reverse('metrics-list')).status_code, 403)
+
+        self.client.force_authenticate(create_user('staff@example.com', is_staff=True))
+        response = self.client.get(reverse('metrics-list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        text = response.content.decode()
+        self.assertIn('# TYPE shop_request_duration_seconds histogram', text)
+        series = 'shop_request_db_queries_count{route="product-list",method="GET"}'
+        count = next(int(line.rsplit(' ', 1)[1]) for line in text.splitlines() if line.startswith(series))
+        self.client.get(reverse('product-list'))
+        text = self.client.get(reverse('metrics-list')).content.decode()
+        self.assertIn(f'{series} {count + 1}', text)
+        self.assertIn('le="+Inf"', text)
+
+    def test_slow_request_log(self):
+        with override_settings(SLOW_REQUEST_MS=0), self.assertNoLogs('shop.metrics'):
+            self.client.get(reverse('product-list'))
+        cache.clear()
+        with override_settings(SLOW_REQUEST_MS=1), mock.patch('shop.metrics.time.perf_counter', side_effect=count_up()):
+            with self.assertLogs('shop.metrics', 'WARNING') as logs:
+                self.client.get(reverse('product-list'))
+        message = logs.records[0].getMessage()
+        self.assertIn('Slow request: GET /api/products/', message)
+        self.assertIn('FROM "shop_product"', message)
+        self.assertIn(os.path.join('shop', 'fast_serializers.py'), message)
+
+        # Queries under SLOW_QUERY_MS are listed without a stack
+        cache.clear()
+        with override_settings(SLOW_REQUEST_MS=1, SLOW_QUERY_MS=5000), \
+                mock.patch('shop.metrics.time.perf_counter', side_effect=count_up()):
+            with self.assertLogs('shop.metrics', 'WARNING') as logs:
+                self.client.get(reverse('product-list'))
+        message = logs.records[0].getMessage()
+        self.assertIn('FROM "shop_product"', message)
+        self.assertNotIn(os.path.join('shop', 'fast_serializers.py'), message)
+
+
+def count_up():
+    """``perf_counter`` stand-in that moves on a second per call."""
+    tick = 0
+    while True:
+        tick += 1
+        yield float(tick)
+
+
+class CartTotalsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.products = seed_catalog(2, 5)
+
+    def fill_cart(self, user, lines):
+        cart = ShoppingCart.objects.create(user=user)
+        for i, product in enumerate(self.products[:lines]):
+            CartItem.objects.create(cart=cart, product=product, quantity=i + 1)
+        return cart
+
+    def test_totals_are_computed_in_sql(self):
+        cart = self.fill_cart(self.user, 6)
+        expected = sum((i + 1) * product.price for i, product in enumerate(self.products[:6]))
+        annotated = ShoppingCart.objects.with_totals().get(pk=cart.pk)
+        self.assertEqual(annotated.total_items, 6)
+        self.assertEqual(annotated.total_price, expected)
+
+        response = self.client.get(reverse('cart-detail', args=[cart.pk]))
+        self.assertEqual(Decimal(str(response.data['total_price'])), expected)
+        self.assertEqual(
+            [Decimal(str(line['total_price'])) for line in response.data['cart_items']],
+            [line.quantity * line.product.price for line in cart.cart_items.all()],
+        )
+
+    def test_empty_cart(self):
+        cart = ShoppingCart.objects.create(user=self.user)
+        annotated = ShoppingCart.objects.with_totals().get(pk=cart.pk)
+        self.assertEqual((annotated.total_items, annotated.total_price), (0, 0))
+
+    def test_admin_changelist_query_count_is_flat(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', None)
+        self.client.force_login(admin_user)
+        self.fill_cart(self.user, 3)
+        url = reverse('admin:shop_shoppingcart_changelist')
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        for i in range(5):
+            self.fill_cart(create_user(f'shopper{i}@example.com'), 10)
+        with self.assertNumQueries(len(few)):
+            self.assertEqual(self.client.get(url).status_code, 200)
+
+
+class AsyncCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.products = seed_catalog(3, 5)
+        seed_reviews(self.products[:1], PAGE_SIZE + 3)
+
+    def test_detail_matches_sync_output(self):
+        for url in [
+            reverse('product-detail', args=[self.products[0].pk]),
+            reverse('category-detail', args=[self.products[0].category_id]),
+        ]:
+            sync_response = self.client.get(url)
+            with async_catalog():
+                async_response = self.client.get(url)
+            self.assertEqual(async_response.status_code, 200)
+            self.assertIn('ETag', async_response)
+            self.assertEqual(async_response.content, sync_response.content)
+
+    def test_responses_use_the_configured_renderer(self):
+        url = reverse('product-detail', args=[self.products[0].pk])
+        # A setting only the project's renderer sees shows which one encoded the response
+        with mock.patch.object(FastJSONRenderer, 'compact', False):
+            sync_response = self.client.get(url)
+            with async_catalog():
+                async_response = self.client.get(url)
+        self.assertIn(b'": ', sync_response.content)
+        self.assertEqual(async_response.content, sync_response.content)
+
+    def test_list_results_match_sync_output(self):
+        sync_data = self.client.get(reverse('product-list')).json()
+        with async_catalog():
+            async_data = self.client.get(reverse('product-list')).json()
+        self.assertEqual(async_data['results'], sync_data['results'])
+
+    def test_cursor_links_match_sync_output(self):
+        token = RefreshToken.for_user(self.user).access_token
+        seed_catalog(1, PAGE_SIZE * 2)
+        for url in [
+            reverse('product-list'),
+            reverse('review-product-reviews') + f'?product_id={self.products[0].pk}',
+        ]:
+            pages = []
+            while url:
+                sync_data = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+                with async_catalog():
+                    async_data = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+                self.assertEqual(async_data, sync_data)
+                pages.append(async_data)
+                url = async_data['next']
+            self.assertGreater(len(pages), 1)
+            # Walk back from the last page through the async views' own links
+            url = pages[-1]['previous']
+            for page in reversed(pages[:-1]):
+                with async_catalog():
+                    data = self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+                self.assertEqual(data['results'], page['results'])
+                url = data['previous']
+            self.assertIsNone(url)
+
+    def test_missing_detail(self):
+        with async_catalog():
+            response = self.client.get(reverse('product-detail', args=[999]))
+            self.assertEqual(response.status_code, 404)
+            self.assertEqual(response.json(), {'detail': 'No Product matches the given query.'})
+
+    def test_product_pages_cover_every_row_once(self):
+        with async_catalog():
+            url, seen = reverse('product-list'), []
+            while url:
+                data = self.client.get(url).json()
+                self.assertLessEqual(len(data['results']), PAGE_SIZE)
+                seen.extend(row['id'] for row in data['results'])
+                url = data['next']
+            newest_first = sorted(self.products, key=lambda p: (p.created_at, p.pk), reverse=True)
+            self.assertEqual(seen, [p.pk for p in newest_first])
+
+    def test_category_pages(self):
+        with async_catalog():
+            seed_catalog(PAGE_SIZE, 0)
+            data = self.client.get(reverse('category-list'), {'page': 2}).json()
+            self.assertEqual(data['count'], PAGE_SIZE + 3)
+            self.assertEqual(len(data['results']), 3)
+            self.assertIsNone(data['next'])
+            self.assertEqual(data['previous'], 'http://testserver/api/categories/')
+            self.assertEqual(self.client.get(reverse('category-list'), {'page': 3}).status_code, 404)
+
+    def test_writes_and_search_fall_back_to_viewsets(self):
+        with async_catalog():
+            self.client.force_authenticate(create_user('staff@example.com', is_staff=True))
+            response = self.client.post(reverse('category-list'), {'name': 'New'})
+            self.assertEqual(response.status_code, 201)
+            response = self.client.get(reverse('product-list'), {'q': 'Product'})
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('count', response.json())
+
+    def test_product_reviews_require_a_token(self):
+        with async_catalog():
+            url = reverse('review-product-reviews')
+            params = {'product_id': self.products[0].pk}
+            self.assertEqual(self.client.get(url, params).status_code, 401)
+
+            token = RefreshToken.for_user(self.user).access_token
+            data = self.client.get(url, params, HTTP_AUTHORIZATION=f'Bearer {token}').json()
+            self.assertEqual(len(data['results']), PAGE_SIZE)
+            data = self.client.get(data['next'], HTTP_AUTHORIZATION=f'Bearer {token}').json()
+            self.assertEqual(len(data['results']), 3)
+            self.assertIsNone(data['next'])
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.products = seed_catalog(1, 4, stock=5)
+        self.cart = ShoppingCart.objects.create(user=self.user)
+
+    def fill_cart(self, products, quantity=2):
+        for product in products:
+            CartItem.objects.create(cart=self.cart, product=product, quantity=quantity)
+
+    def test_checkout_creates_order_and_takes_stock(self):
+        self.fill_cart(self.products[:3])
+        response = self.client.post(reverse('cart-checkout'))
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(len(response.data['order_items']), 3)
+        order = Order.objects.get(pk=response.data['orderId'])
+        self.assertEqual(order.totalAmount, sum(p.price * 2 for p in self.products[:3]))
+        self.assertEqual(
+            list(Product.objects.filter(pk__in=[p.pk for p in self.products]).order_by('pk').values_list('stock', flat=True)),
+            [3, 3, 3, 5],
+        )
+        self.assertFalse(self.cart.cart_items.exists())
+
+    def test_short_line_fails_whole_order(self):
+        self.fill_cart(self.products[:2])
+        CartItem.objects.create(cart=self.cart, product=self.products[2], quantity=6)
+        response = self.client.post(reverse('cart-checkout'))
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(set(Product.objects.values_list('stock', flat=True)), {5})
+        self.assertEqual(self.cart.cart_items.count(), 3)
+
+    def test_empty_cart(self):
+        response = self.client.post(reverse('cart-checkout'))
+        self.assertEqual(response.status_code, 400)
+
+    def test_query_count_does_not_grow_with_lines(self):
+        # 14 for the order itself, 7 to add it to the three sales rollups,
+        # 1 to queue the confirmation email
+        self.fill_cart(self.products[:1])
+        with self.assertNumQueries(22):
+            self.client.post(reverse('cart-checkout'))
+        self.fill_cart(self.products[1:])
+        with self.assertNumQueries(22):
+            self.client.post(reverse('cart-checkout'))
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        self.product = seed_catalog(1, 1, stock=5)[0]
+        self.alice, self.bob = APIClient(), APIClient()
+        self.alice.force_authenticate(create_user('alice@example.com'))
+        self.bob.force_authenticate(create_user('bob@example.com'))
+
+    def add(self, client, quantity):
+        return client.post(reverse('cart-add-item'), {'product_id': self.product.pk, 'quantity': quantity})
+
+    def availability(self):
+        return self.alice.get(reverse('product-availability', args=[self.product.pk])).data
+
+    def test_add_item_holds_stock(self):
+        self.assertEqual(self.add(self.alice, 2).status_code, 200)
+        self.assertEqual(self.add(self.alice, 1).status_code, 200)
+        self.assertEqual(self.availability(), {'product': self.product.pk, 'stock': 5, 'reserved': 3, 'available': 2})
+        self.assertEqual(self.add(self.bob, 3).status_code, 400)
+        self.assertEqual(self.add(self.bob, 2).status_code, 200)
+        self.assertEqual(self.availability()['available'], 0)
+
+    def test_remove_and_checkout_release_holds(self):
+        self.add(self.alice, 2)
+        self.add(self.bob, 3)
+        self.alice.post(reverse('cart-remove-item'), {'product_id': self.product.pk})
+        self.assertEqual(self.availability()['reserved'], 3)
+        self.assertEqual(self.bob.post(reverse('cart-checkout')).status_code, 201)
+        self.assertEqual(self.availability(), {'product': self.product.pk, 'stock': 2, 'reserved': 0, 'available': 2})
+
+    def test_checkout_cannot_take_stock_held_by_another_cart(self):
+        self.add(self.alice, 4)
+        cart = ShoppingCart.objects.create(user=User.objects.get(email='bob@example.com'))
+        CartItem.objects.create(cart=cart, product=self.product, quantity=2)
+        self.assertEqual(self.bob.post(reverse('cart-checkout')).status_code, 400)
+        self.assertEqual(self.alice.post(reverse('cart-checkout')).status_code, 201)
+
+    def test_order_create_cannot_take_stock_held_by_a_cart(self):
+        self.add(self.alice, 4)
+        bob = User.objects.get(email='bob@example.com')
+
+        def order(*quantities):
+            return self.bob.post(reverse('order-list'), {
+                'user': bob.pk, 'totalAmount': '10.00',
+                'order_items': [
+                    {'product': self.product.pk, 'quantity': quantity, 'price': '10.00'} for quantity in quantities
+                ],
+            }, format='json')
+
+        # Two lines of the same product count together
+        response = order(1, 1)
+        self.assertEqual((response.status_code, response.data), (400, {'error': 'Insufficient stock'}))
+        self.assertFalse(Order.objects.exists())
+        self.assertEqual(order(1).status_code, 201)
+        self.assertEqual(self.availability(), {'product': self.product.pk, 'stock': 4, 'reserved': 4, 'available': 0})
+
+    def test_expired_holds_are_ignored_and_swept(self):
+        self.add(self.alice, 5)
+        StockReservation.objects.update(expires_at=timezone.now())
+        self.assertEqual(self.availability()['available'], 5)
+        self.assertEqual(self.add(self.bob, 5).status_code, 200)
+        call_command('release_expired_reservations', batch_size=1, stdout=StringIO())
+        self.assertEqual(StockReservation.objects.count(), 1)
+
+
+class SetCartItemsTests(TestCase):
+    def setUp(self):
+        self.products = seed_catalog(2, 10, stock=5)
+        self.user = create_user('customer@example.com')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def set_items(self, lines, replace=False, client=None):
+        return (client or self.client).post(reverse('cart-set-items'), {
+            'items': [{'product_id': product.pk, 'quantity': quantity} for product, quantity in lines],
+            'replace': replace,
+        }, format='json')
+
+    def test_upserts_lines_and_reservations(self):
+        CartItem.objects.create(
+            cart=ShoppingCart.objects.create(user=self.user), product=self.products[0], quantity=1
+        )
+        response = self.set_items([(self.products[0], 3), (self.products[1], 2)])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            {line['product']: line['quantity'] for line in response.data['cart_items']},
+            {self.products[0].pk: 3, self.products[1].pk: 2},
+        )
+        self.assertEqual(
+            Decimal(str(response.data['total_price'])), 3 * self.products[0].price + 2 * self.products[1].price
+        )
+        self.assertEqual(
+            dict(StockReservation.objects.values_list('product', 'quantity')),
+            {self.products[0].pk: 3, self.products[1].pk: 2},
+        )
+
+        self.set_items([(self.products[1], 1)])
+        self.assertEqual(CartItem.objects.get(product=self.products[0]).quantity, 3)
+        self.set_items([(self.products[1], 1)], replace=True)
+        self.assertEqual(list(CartItem.objects.values_list('product', flat=True)), [self.products[1].pk])
+        self.assertEqual(list(StockReservation.objects.values_list('quantity', flat=True)), [1])
+
+    def test_query_count_does_not_grow_with_lines(self):
+        self.set_items([(self.products[0], 1)])
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(self.set_items([(self.products[0], 2)]).status_code, 200)
+        with self.assertNumQueries(len(few)):
+            response = self.set_items([(product, 2) for product in self.products])
+        self.assertEqual(len(response.data['cart_items']), len(self.products))
+
+    def test_rejects_unknown_products_and_short_stock(self):
+        other = APIClient()
+        other.force_authenticate(create_user('other@example.com'))
+        self.assertEqual(self.set_items([(self.products[0], 4)], client=other).status_code, 200)
+
+        self.products[2].is_active = False
+        self.products[2].save()
+        response = self.set_items([(self.products[1], 1), (self.products[2], 1)])
+        self.assertEqual((response.status_code, response.data['products']), (400, [self.products[2].pk]))
+        response = self.set_items([(self.products[0], 2), (self.products[1], 5)])
+        self.assertEqual(response.data, {'error': 'Insufficient stock', 'products': [self.products[0].pk]})
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+        self.assertEqual(self.set_items([(self.products[0], 1)]).status_code, 200)
+
+    def test_rejects_duplicate_and_empty_lines(self):
+        self.assertEqual(self.set_items([(self.products[0], 1), (self.products[0], 2)]).status_code, 400)
+        self.assertEqual(self.set_items([]).status_code, 400)
+        self.assertEqual(self.set_items([(self.products[0], 0)]).status_code, 400)
+
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+    threads = 12
+
+    def test_concurrent_checkouts_never_oversell(self):
+        product = seed_catalog(1, 1, stock=5)[0]
+        users = [create_user(f'buyer{i}@example.com') for i in range(self.threads)]
+        for user in users:
+            cart = ShoppingCart.objects.create(user=user)
+            CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+        barrier = threading.Barrier(self.threads)
+        results = []
+
+        def checkout(user):
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        results.append(client.post(reverse('cart-checkout')).status_code)
+                        return
+                    except OperationalError:
+                        # The shared in-memory SQLite test database reports lock
+                        # contention instead of waiting; retry like a client would.
+                        time.sleep(0.005)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout, args=(user,)) for user in users]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        product.refresh_from_db()
+        self.assertEqual(len(results), self.threads)
+        self.assertLessEqual(set(results), {201, 400})
+        self.assertEqual(product.stock, 1)
+        self.assertEqual(Order.objects.count(), 2)
+        self.assertEqual(OrderItem.objects.filter(product=product).count(), 2)
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products = seed_catalog(2, 3)
+
+    def test_list_and_retrieve_are_served_from_cache(self):
+        for url in [
+            reverse('product-list'),
+            reverse('product-detail', args=[self.products[0].pk]),
+            reverse('category-list'),
+        ]:
+            first = self.client.get(url)
+            with self.assertNumQueries(0):
+                second = self.client.get(url)
+            self.assertEqual(first.content, second.content)
+
+    def test_writes_bump_the_catalog_version(self):
+        url = reverse('product-detail', args=[self.products[0].pk])
+        self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            category = self.products[0].category
+            category.name = 'Renamed'
+            category.save()
+        response = self.client.get(url)
+        self.assertEqual(response.data['category_name'], 'Renamed')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        ids = [row['id'] for row in self.client.get(reverse('product-list')).data['results']]
+        self.assertNotIn(self.products[1].pk, ids)
+
+    def test_checkout_invalidates_cached_stock(self):
+        url = reverse('product-detail', args=[self.products[0].pk])
+        self.assertEqual(self.client.get(url).data['stock'], 100)
+        with self.captureOnCommitCallbacks(execute=True):
+            decrement_stock({self.products[0].pk: 3})
+        self.assertEqual(self.client.get(url).data['stock'], 97)
+
+    def test_conditional_requests(self):
+        url = reverse('product-detail', args=[self.products[0].pk])
+        response = self.client.get(url)
+        self.assertIn('ETag', response)
+        self.assertIn('Last-Modified', response)
+        not_modified = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        not_modified = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(not_modified.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[0].save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_if_modified_since_sees_deletions(self):
+        url = reverse('product-list')
+        response = self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.products[1].delete()
+        real_time = time.time
+        # The rebuild must land in a later second than the first response
+        with mock.patch('time.time', lambda: real_time() + 2):
+            changed = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(changed.status_code, 200)
+        self.assertEqual(len(changed.data['results']), len(response.data['results']) - 1)
+
+
+class CatalogImportExportTests(TestCase):
+    rows = (
+        'sku,name,description,price,category,stock,is_active\n'
+        'A-1,Kettle,Steel kettle,19.99,Kitchen,10,true\n'
+        'A-2,Toaster,,25,Kitchen,3,false\n'
+        'B-1,Lamp,Desk lamp,12.50,Home,,\n'
+        ',Nameless,,1,Home,1,true\n'
+        'B-2,Chair,,abc,Home,1,true\n'
+    )
+
+    def write_file(self, data, suffix='.csv'):
+        handle = tempfile.NamedTemporaryFile('w', suffix=suffix, delete=False, encoding='utf-8')
+        with handle:
+            handle.write(data)
+        self.addCleanup(os.remove, handle.name)
+        return handle.name
+
+    def import_file(self, path, **options):
+        out, err = StringIO(), StringIO()
+        call_command('import_catalog', path, stdout=out, stderr=err, **options)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_creates_and_updates_by_sku(self):
+        Category.objects.create(name='Kitchen')
+        out, err = self.import_file(self.write_file(self.rows), batch_size=2)
+        self.assertIn('3 created', out)
+        self.assertIn('Row 4: missing sku', err)
+        self.assertIn('Row 5: invalid price', err)
+        self.assertEqual(sorted(Category.objects.values_list('name', flat=True)), ['Home', 'Kitchen'])
+        lamp = Product.objects.get(sku='B-1')
+        self.assertEqual((lamp.price, lamp.stock, lamp.is_active), (Decimal('12.50'), 0, True))
+        self.assertFalse(Product.objects.get(sku='A-2').is_active)
+
+        updated = self.rows.replace('Kettle,Steel kettle,19.99', 'Kettle,Steel kettle,17.00')
+        out, _ = self.import_file(self.write_file(updated))
+        self.assertIn('0 created, 1 updated, 2 unchanged', out)
+        self.assertEqual(Product.objects.get(sku='A-1').price, Decimal('17.00'))
+        self.assertEqual(Product.objects.count(), 3)
+
+    def test_invalid_rows_are_reported_not_raised(self):
+        records = [
+            {'sku': 'J-1', 'name': 'Kettle', 'price': 'NaN', 'category': 'Kitchen'},
+            {'sku': 'J-2', 'name': 'Kettle', 'price': '-Infinity', 'category': 'Kitchen'},
+            {'sku': 'J-3', 'name': 'x' * 201, 'price': '1', 'category': 'Kitchen'},
+            {'sku': 'J-4', 'name': 'Kettle', 'price': '1', 'category': 'x' * 101},
+            {'sku': 'J-5', 'name': 'Kettle', 'price': '100000000', 'category': 'Kitchen'},
+            ['J-6'],
+            {'sku': 'J-7', 'name': 'Kettle', 'price': '99999999.99', 'category': 'Kitchen'},
+        ]
+        lines = [json.dumps(record) for record in records]
+        lines.insert(5, '{"sku": "J-8",')
+        out, err = self.import_file(self.write_file('\n'.join(lines) + '\n', suffix='.jsonl'))
+        self.assertIn('1 created', out)
+        for message in [
+            "Row 1: invalid price 'NaN'", "Row 2: invalid price '-Infinity'", 'Row 3: name too long',
+            'Row 4: category too long', 'Row 5: price too large', 'Row 6: invalid JSON', 'Row 7: not an object',
+        ]:
+            self.assertIn(message, err)
+        self.assertEqual(list(Product.objects.values_list('sku', flat=True)), ['J-7'])
+
+    def test_only_the_first_errors_are_kept(self):
+        reported = []
+        records = ({'sku': f'E-{i}'} for i in range(ERRORS_KEPT + 50))
+        result = import_catalog(records, batch_size=40, on_error=lambda *error: reported.append(error))
+        self.assertEqual(result.skipped, ERRORS_KEPT + 50)
+        self.assertEqual(len(result.errors), ERRORS_KEPT)
+        self.assertEqual(len(reported), ERRORS_KEPT + 50)
+        self.assertEqual(reported[-1], (ERRORS_KEPT + 50, 'missing name'))
+
+    def test_import_queries_are_per_batch(self):
+        rows = ''.join(f'S-{i},Item {i},,1,Cat {i % 3},1,true\n' for i in range(50))
+        path = self.write_file('sku,name,description,price,category,stock,is_active\n' + rows)
+        with CaptureQueriesContext(connection) as ctx:
+            self.import_file(path, batch_size=25)
+        # Per batch: categories, products by SKU, insert, plus savepoints;
+        # new categories cost an insert and a re-read once
+        self.assertLessEqual(len(ctx.captured_queries), 2 * 6 + 2)
+        self.assertEqual(Product.objects.count(), 50)
+
+    def test_import_invalidates_catalog(self):
+        cache.clear()
+        client = APIClient()
+        self.assertEqual(client.get(reverse('product-list')).data['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.import_file(self.write_file(self.rows))
+        self.assertEqual(len(client.get(reverse('product-list')).data['results']), 2)
+
+    def test_export_round_trips(self):
+        self.import_file(self.write_file(self.rows))
+        for file_format in ('csv', 'jsonl'):
+            path = self.write_file('', suffix=f'.{file_format}')
+            call_command('export_catalog', path, stdout=StringIO())
+            Product.objects.update(name='changed')
+            out, err = self.import_file(path)
+            self.assertIn('3 updated', out)
+            self.assertEqual(err, '')
+            self.assertEqual(Product.objects.get(sku='A-1').name, 'Kettle')
+
+    def test_export_endpoint_is_staff_only_and_streams(self):
+        self.import_file(self.write_file(self.rows))
+        client = APIClient()
+        url = reverse('product-export')
+        self.assertEqual(client.get(url).status_code, 401)
+        client.force_authenticate(create_user('customer@example.com'))
+        self.assertEqual(client.get(url).status_code, 403)
+
+        client.force_authenticate(create_user('staff@example.com', is_staff=True))
+        response = client.get(url)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'sku,name,description,price,category,stock,is_active')
+        self.assertEqual(len(lines), 4)
+
+        response = client.get(url, {'output': 'jsonl'})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        records = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual(records[0], {
+            'sku': 'A-1', 'name': 'Kettle', 'description': 'Steel kettle', 'price': '19.99',
+            'category': 'Kitchen', 'stock': 10, 'is_active': True,
+        })
+        self.assertEqual(client.get(url, {'output': 'xml'}).status_code, 400)
+
+    def test_export_endpoint_under_async_catalog(self):
+        self.import_file(self.write_file(self.rows))
+        client = APIClient()
+        client.force_authenticate(create_user('staff@example.com', is_staff=True))
+        with async_catalog():
+            response = client.get(reverse('product-export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+
+
+class OrderExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.staff = create_user('staff@example.com', is_staff=True)
+        cls.user = create_user('customer@example.com')
+        products = seed_catalog(2, 3)
+        cls.orders = seed_orders(cls.user, products, 6, items_per_order=2)
+        Order.objects.create(user=cls.user)
+        now = timezone.now()
+        for days, order in enumerate(Order.objects.order_by('orderDate')):
+            Order.objects.filter(pk=order.pk).update(orderDate=now - timedelta(days=10 - days))
+        Order.objects.filter(pk=cls.orders[0].pk).update(status='cancelled')
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def export(self, **params):
+        response = self.client.get(reverse('order-export'), params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        self.assertEqual(client.get(reverse('order-export')).status_code, 403)
+
+    def test_csv_has_a_row_per_item(self):
+        lines = self.export().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['order_id', 'order_date', 'user_email'])
+        # 6 orders with 11 items between them, and one order without items
+        self.assertEqual(len(lines), 1 + 11 + 1)
+
+    def test_ndjson_nests_items(self):
+        records = [json.loads(line) for line in self.export(output='jsonl').splitlines()]
+        self.assertEqual(len(records), 7)
+        self.assertEqual(records[0]['order_id'], str(self.orders[0].pk))
+        self.assertEqual(records[0]['status'], 'cancelled')
+        self.assertEqual(len(records[0]['items']), 2)
+        self.assertEqual(records[-1]['items'], [])
+
+    def test_filters(self):
+        since = (timezone.localdate() - timedelta(days=8)).isoformat()
+        until = (timezone.localdate() - timedelta(days=6)).isoformat()
+        records = [json.loads(line) for line in self.export(output='jsonl', since=since, until=until).splitlines()]
+        self.assertEqual(len(records), 3)
+        records = self.export(output='jsonl', status='cancelled,delivered').splitlines()
+        self.assertEqual(len(records), 1)
+        for params in ({'since': 'yesterday'}, {'until': '2024-02-30'}, {'status': 'lost'}, {'output': 'xml'}):
+            self.assertEqual(self.client.get(reverse('order-export'), params).status_code, 400)
+
+    def test_queries_are_per_chunk(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.export()
+        # Session/auth lookups aside: one query for the orders, one for their items
+        self.assertLessEqual(len(ctx.captured_queries), 2)
+
+
+class ExplainEndpointsTests(TestCase):
+    def test_hot_list_queries_use_indexes(self):
+        user = create_user('customer@example.com')
+        create_user('staff@example.com', is_staff=True)
+        products = seed_catalog(2, 3)
+        seed_orders(user, products, 3)
+        for product in products[:3]:
+            Review.objects.create(product=product, user=user, rating=4)
+        UserAddress.objects.create(user=user, street='1 Main St', city='Almaty', state='AL', zipCode='050000')
+        ShoppingCart.objects.create(user=user)
+
+        out = StringIO()
+        call_command('explain_endpoints', stdout=out)
+        flagged, endpoint = set(), None
+        for line in out.getvalue().splitlines():
+            if not line.startswith(' '):
+                endpoint = line.split(':')[0]
+            elif line.startswith('  ! '):
+                flagged.add(endpoint)
+        for name in ['category-list', 'product-list', 'order-list', 'review-list', 'address-list']:
+            self.assertNotIn(f'{name} (customer)', flagged)
+            self.assertIn(f'{name} (customer)', out.getvalue())
+        self.assertIn('user-list (customer): skipped, HTTP 403', out.getvalue())
+
+
+class SalesRollupTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = create_user('customer@example.com')
+        self.client.force_authenticate(self.user)
+        self.products = seed_catalog(2, 2, stock=50)
+        self.staff = APIClient()
+        self.staff.force_authenticate(create_user('staff@example.com', is_staff=True))
+
+    def checkout(self, *lines):
+        cart, _ = ShoppingCart.objects.get_or_create(user=self.user)
+        for product, quantity in lines:
+            CartItem.objects.create(cart=cart, product=product, quantity=quantity)
+        response = self.client.post(reverse('cart-checkout'))
+        self.assertEqual(response.status_code, 201)
+        return Order.objects.get(pk=response.data['orderId'])
+
+    def rollups(self):
+        return {
+            model.__name__: sorted(
+                model.objects.filter(orders__gt=0).values_list(*fields, 'status', 'orders', 'units', 'revenue')
+            )
+            for model, fields in [
+                (DailySales, ('day',)),
+                (DailyCategorySales, ('day', 'category_id')),
+                (DailyProductSales, ('day', 'product_id')),
+            ]
+        }
+
+    def test_orders_are_rolled_up_as_they_change(self):
+        a, b, c = self.products[0], self.products[1], self.products[2]
+        first = self.checkout((a, 2), (c, 1))
+        self.checkout((a, 1), (b, 3))
+        today = timezone.localdate()
+        self.assertEqual(DailySales.objects.get(day=today, status='pending').orders, 2)
+        product_a = DailyProductSales.objects.get(day=today, status='pending', product=a)
+        self.assertEqual((product_a.orders, product_a.units, product_a.revenue), (2, 3, a.price * 3))
+        category = DailyCategorySales.objects.get(day=today, status='pending', category=a.category)
+        self.assertEqual((category.orders, category.units), (2, 6))
+
+        self.assertEqual(self.client.post(reverse('order-cancel', args=[first.pk])).status_code, 200)
+        cancelled = DailySales.objects.get(day=today, status='cancelled')
+        self.assertEqual((cancelled.orders, cancelled.units, cancelled.revenue), (1, 3, a.price * 2 + c.price))
+        self.assertEqual(DailySales.objects.get(day=today, status='pending').orders, 1)
+
+        incremental = self.rollups()
+        out = StringIO()
+        call_command('rebuild_sales_rollups', stdout=out)
+        self.assertEqual(self.rollups(), incremental)
+
+    def test_confirm_and_admin_status_changes(self):
+        order = self.checkout((self.products[0], 1))
+        payment = Payment.objects.create(order=order, amount=order.totalAmount, paymentMethod='credit_card')
+        self.client.post(reverse('payment-process-payment', args=[payment.pk]))
+        self.assertEqual(DailySales.objects.get(status='confirmed').orders, 1)
+
+        transition(Order.objects.filter(pk=order.pk), 'shipped')
+        self.assertEqual(DailySales.objects.get(status='shipped').orders, 1)
+        self.assertEqual(DailySales.objects.filter(orders__gt=0).count(), 1)
+
+        order.delete()
+        self.assertFalse(DailySales.objects.filter(orders__gt=0).exists())
+
+    def test_analytics_endpoints(self):
+        a, b = self.products[0], self.products[2]
+        self.checkout((a, 2), (b, 1))
+        cancelled = self.checkout((b, 5))
+        self.client.post(reverse('order-cancel', args=[cancelled.pk]))
+
+        self.assertEqual(self.client.get(reverse('sales-list')).status_code, 403)
+        with self.assertNumQueries(2):
+            data = self.staff.get(reverse('sales-list')).data
+        self.assertEqual(data['totals'], {'orders': 1, 'units': 3, 'revenue': str(a.price * 2 + b.price)})
+        self.assertEqual(len(data['days']), 1)
+
+        data = self.staff.get(reverse('sales-list'), {'status': 'cancelled'}).data
+        self.assertEqual(data['totals']['units'], 5)
+        categories = self.staff.get(reverse('sales-categories')).data
+        self.assertEqual([row['category'] for row in categories], [a.category_id, b.category_id])
+        products = self.staff.get(reverse('sales-products'), {'limit': 1}).data
+        self.assertEqual(products, [{
+            'orders': 1, 'units': 2, 'revenue': str(a.price * 2), 'product': a.pk, 'product_name': a.name,
+        }])
+
+        past = self.staff.get(reverse('sales-list'), {'since': '2020-01-01', 'until': '2020-01-31'}).data
+        self.assertEqual(past['totals'], {'orders': 0, 'units': 0, 'revenue': '0.00'})
+        for params in ({'since': 'soon'}, {'until': '2024-02-30'}, {'status': 'lost'}):
+            self.assertEqual(self.staff.get(reverse('sales-list'), params).status_code, 400)
+        for limit in ('many', '0', '-1'):
+            self.assertEqual(self.staff.get(reverse('sales-products'), {'limit': limit}).status_code, 400)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = create_user('customer@example.com')
+        self.client = APIClient()
+        token = RefreshToken.for_user(self.user).access_token
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token}')
+        self.url = reverse('order-list')
+
+    def test_user_is_resolved_from_cache(self):
+        with CaptureQueriesContext(connection) as first:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        with CaptureQueriesContext(connection) as second:
+            self.assertEqual(self.client.get(self.url).status_code, 200)
+        self.assertEqual(len(second), len(first) - 1)
+        self.assertFalse(any('FROM "shop_user"' in query['sql'] for query in second.captured_queries))
+
+    def test_saving_the_user_drops_the_cached_entry(self):
+        seed_orders(create_user('other@example.com'), seed_catalog(1, 1), 1)
+        self.assertEqual(self.client.get(self.url).data['results'], [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_staff = True
+            self.user.save()
+        self.assertEqual(len(self.client.get(self.url).data['results']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get(self.url).status_code, 401)
+
+    def test_last_login_updates_keep_the_entry(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+
+
+@override_settings(PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class AuthThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        create_user('customer@example.com', password='correct-horse')
+        self.client = APIClient()
+        rates = {'auth_ip': '6/min', 'auth_account': '3/min'}
+        throttled = override_settings(REST_FRAMEWORK=dict(settings.REST_FRAMEWORK, DEFAULT_THROTTLE_RATES=rates))
+        throttled.enable()
+        self.addCleanup(throttled.disable)
+
+    def login(self, email='customer@example.com', password='wrong'):
+        return self.client.post(reverse('auth-login'), {'email': email, 'password': password}, format='json')
+
+    def test_per_account_bucket(self):
+        for _ in range(3):
+            self.assertEqual(self.login().status_code, 400)
+        response = self.login(password='correct-horse')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '20')
+        self.assertEqual(self.login('CUSTOMER@example.com ').status_code, 429)
+        self.assertEqual(self.login('other@example.com').status_code, 400)
+
+    def test_per_ip_bucket(self):
+        for i in range(6):
+            self.assertEqual(self.login(f'user{i}@example.com').status_code, 400)
+        self.assertEqual(self.login('new@example.com').status_code, 429)
+        self.client.defaults['REMOTE_ADDR'] = '10.0.0.2'
+        self.assertEqual(self.login(password='correct-horse').status_code, 200)
+
+    def test_bucket_refills(self):
+        now = time.time()
+        with mock.patch.object(TokenBucketThrottle, 'timer', staticmethod(lambda: now)):
+            for _ in range(3):
+                self.login()
+            self.assertEqual(self.login().status_code, 429)
+        with mock.patch.object(TokenBucketThrottle, 'timer', staticmethod(lambda: now + 20)):
+            self.assertEqual(self.login(password='correct-horse').status_code, 200)
+            self.assertEqual(self.login().status_code, 429)
+
+    @override_settings(PASSWORD_HASHING_WORKERS=0)
+    def test_async_auth_views(self):
+        with async_catalog():
+            response = self.login(password='correct-horse')
+            self.assertEqual(response.status_code, 200)
+            self.assertIn('access', response.json())
+            response = self.client.post(reverse('auth-register'), {
+                'username': 'new', 'email': 'new@example.com', 'password': 'a-Long-passw0rd', 'password2': 'a-Long-passw0rd',
+            }, format='json')
+            self.assertEqual(response.status_code, 201, response.content)
+            for _ in range(2):
+                self.login()
+            response = self.login()
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(self.client.get(reverse('auth-login')).status_code, 405)
+
+
+def image_upload(name='photo.png', size=(800, 600), color=(255, 0, 0)):
+    buffer = BytesIO()
+    Image.new('RGBA' if len(color) == 4 else 'RGB', size, color).save(buffer, 'PNG')
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type='image/png')
+
+
+@override_settings(PRODUCT_IMAGE_WORKERS=0, PRODUCT_IMAGE_SIZES={'thumb': 100, 'large': 400})
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = override_settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.media_root = media.name
+        self.product = seed_catalog(1, 1)[0]
+
+    def upload(self, **kwargs):
+        self.product.image = image_upload(**kwargs)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.product.refresh_from_db()
+
+    def test_variants_are_rendered_on_upload(self):
+        self.upload()
+        variants = self.product.image_variants
+        self.assertEqual(variants['source'], self.product.image.name)
+        self.assertEqual(set(variants['sizes']), {'thumb', 'large'})
+        for size, longest in (('thumb', 100), ('large', 400)):
+            for extension, pillow_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                name = variants['sizes'][size][extension]
+                self.assertRegex(name, rf'^products/variants/[0-9a-f]{{20}}-{size}\.{extension}$')
+                with Image.open(os.path.join(self.media_root, name)) as image:
+                    self.assertEqual((image.format, max(image.size)), (pillow_format, longest))
+
+    def test_small_and_transparent_images(self):
+        self.upload(size=(50, 40), color=(255, 0, 0, 128))
+        sizes = self.product.image_variants['sizes']
+        # Never upscaled, so both sizes render the same bytes under one name each
+        with Image.open(os.path.join(self.media_root, sizes['large']['webp'])) as image:
+            self.assertEqual((image.size, image.mode), ((50, 40), 'RGBA'))
+        self.assertEqual(sizes['thumb']['jpeg'].split('-')[0], sizes['large']['jpeg'].split('-')[0])
+
+    def test_serializer_exposes_variant_urls(self):
+        cache.clear()
+        self.upload()
+        data = APIClient().get(reverse('product-detail', args=[self.product.pk])).json()
+        name = self.product.image_variants['sizes']['thumb']['webp']
+        self.assertEqual(data['image_variants']['thumb']['webp'], f'http://testserver/media/{name}')
+        self.assertEqual(set(data['image_variants']), {'thumb', 'large'})
+
+    def test_new_image_replaces_variants(self):
+        self.upload()
+        first = self.product.image_variants
+        self.upload(size=(300, 900))
+        self.assertNotEqual(self.product.image_variants['sizes'], first['sizes'])
+        self.product.image = None
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.save()
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_variants, {})
+
+    def test_inline_failure_is_logged_after_the_upload_commits(self):
+        self.product.image = image_upload()
+        with self.assertLogs('shop.images', 'ERROR') as logs, \
+                mock.patch('shop.images.render_variants', side_effect=OSError('broken image')):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.save()
+        self.assertIn(f'Could not create image variants for product {self.product.pk}', logs.output[0])
+        self.product.refresh_from_db()
+        self.assertTrue(self.product.image.name)
+        self.assertEqual(self.product.image_variants, {})
+
+    def test_backfill_command(self):
+        self.upload()
+        Product.objects.filter(pk=self.product.pk).update(image_variants={})
+        Product.objects.create(
+            name='Broken', description='', price=1, category=self.product.category, image='products/missing.png'
+        )
+        out, err = StringIO(), StringIO()
+        call_command('backfill_image_variants', stdout=out, stderr=err)
+        self.assertIn('Processed 1 images', out.getvalue())
+        self.assertIn('1 failed', out.getvalue())
+        self.assertIn('products/missing.png', err.getvalue())
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.image_variants['source'], self.product.image.name)
+
+        out = StringIO()
+        call_command('backfill_image_variants', stdout=out, stderr=StringIO())
+        self.assertIn('Processed 0 images', out.getvalue())
+
+
+task_calls = []
+
+
+def record_task(*args, **kwargs):
+    task_calls.append((args, kwargs))
+
+
+def failing_task():
+    raise RuntimeError('gateway down')
+
+
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def test_task_exists_only_if_transaction_commits(self):
+        try:
+            with transaction.atomic():
+                enqueue(record_task, 1)
+                raise RuntimeError
+        except RuntimeError:
+            pass
+        self.assertFalse(Task.objects.exists())
+        task = enqueue(record_task, 1, 'two', flag=True)
+        self.assertEqual((task.name, task.status), ('shop.tests.record_task', 'queued'))
+
+        self.assertEqual(claim(10), [task.pk])
+        self.assertEqual(claim(10), [])
+        self.assertTrue(run_task(task.pk))
+        self.assertEqual(task_calls, [((1, 'two'), {'flag': True})])
+        self.assertFalse(Task.objects.exists())
+
+    @override_settings(TASK_RETRY_BACKOFF=10, TASK_RETRY_BACKOFF_MAX=15)
+    def test_retries_with_backoff_then_fails(self):
+        task = enqueue(failing_task, max_attempts=3)
+        for attempt, wait in ((1, 10), (2, 15)):
+            Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+            [task_id] = claim(1)
+            before = timezone.now()
+            with self.assertLogs('shop.queue', 'WARNING'):
+                self.assertFalse(run_task(task_id))
+            task.refresh_from_db()
+            self.assertEqual((task.status, task.attempts), ('queued', attempt))
+            self.assertAlmostEqual((task.run_at - before).total_seconds(), wait, delta=1)
+            self.assertIn('gateway down', task.last_error)
+            self.assertEqual(claim(1), [])
+        Task.objects.filter(pk=task.pk).update(run_at=timezone.now())
+        with self.assertLogs('shop.queue', 'WARNING'):
+            run_task(claim(1)[0])
+        task.refresh_from_db()
+        self.assertEqual((task.status, task.attempts), ('failed', 3))
+
+    def test_stale_tasks_are_requeued(self):
+        task = enqueue(record_task)
+        claim(1)
+        Task.objects.filter(pk=task.pk).update(locked_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale(), 1)
+        self.assertEqual(claim(1), [task.pk])
+
+    @override_settings(TASK_QUEUE_EAGER=True)
+    def test_eager_mode_runs_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            enqueue(record_task, 'now')
+            enqueue(record_task, 'later', delay=60)
+            self.assertEqual(task_calls, [])
+        self.assertEqual(task_calls, [(('now',), {})])
+        self.assertEqual(Task.objects.get().args, ['later'])
+
+    def test_checkout_and_payment_send_emails(self):
+        user = create_user('buyer@example.com')
+        product = seed_catalog(1, 1)[0]
+        cart = ShoppingCart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product=product, quantity=2)
+        client = APIClient()
+        client.force_authenticate(user)
+        order_id = client.post(reverse('cart-checkout')).data['orderId']
+        payment = Payment.objects.create(order_id=order_id, amount=Decimal('20.00'), paymentMethod='paypal')
+        client.post(reverse('payment-process-payment', args=[payment.pk]))
+        self.assertEqual(mail.outbox, [])
+
+        for task_id in claim(10):
+            self.assertTrue(run_task(task_id))
+        self.assertEqual([message.to for message in mail.outbox], [['buyer@example.com']] * 2)
+        self.assertIn('2 x Product 0-0 @ 10.00', mail.outbox[0].body)
+        self.assertIn('20.00 (PayPal)', mail.outbox[1].body)
+
+
+class RunWorkersTests(TransactionTestCase):
+    def setUp(self):
+        task_calls.clear()
+
+    def test_run_workers_drains_the_queue(self):
+        for i in range(5):
+            enqueue(record_task, i)
+        enqueue(failing_task, max_attempts=1)
+        out = StringIO()
+        with self.assertLogs('shop.queue', 'WARNING'):
+            # One worker: the in-memory SQLite test database refuses concurrent writers
+            call_command('run_workers', workers=1, once=True, poll_interval=5, stdout=out)
+        self.assertIn('Ran 6 tasks: 5 succeeded, 1 failed', out.getvalue())
+        self.assertEqual(sorted(args[0] for args, _ in task_calls), list(range(5)))
+        self.assertEqual(list(Task.objects.values_list('status', flat=True)), ['failed'])
+
+
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.user = create_user('buyer@example.com')
+        self.products = seed_catalog(1, 2, stock=10)
+        self.cart = ShoppingCart.objects.create(user=self.user)
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=2)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def checkout(self, key='order-1'):
+        return self.client.post(reverse('cart-checkout'), HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_replay_returns_stored_response_without_work(self):
+        first = self.checkout()
+        self.assertEqual(first.status_code, 201)
+        # A retry must not see an empty cart or take stock again
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        with self.assertNumQueries(1):
+            replay = self.checkout()
+        self.assertEqual((replay.status_code, replay.json()), (201, first.json()))
+        self.assertEqual(replay['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 8)
+
+        other = self.checkout('order-2')
+        self.assertEqual(other.status_code, 201)
+        self.assertNotEqual(other.json()['orderId'], first.json()['orderId'])
+
+    def test_keys_are_per_user_and_per_request(self):
+        self.checkout()
+        order_data = {
+            'user': self.user.pk, 'totalAmount': '10.00',
+            'order_items': [{'product': self.products[1].pk, 'quantity': 1, 'price': '10.00'}],
+        }
+        response = self.client.post(reverse('order-list'), order_data, format='json', HTTP_IDEMPOTENCY_KEY='order-1')
+        self.assertEqual(response.status_code, 422)
+
+        other = create_user('other@example.com')
+        CartItem.objects.create(cart=ShoppingCart.objects.create(user=other), product=self.products[1], quantity=1)
+        self.client.force_authenticate(other)
+        self.assertNotIn('Idempotent-Replayed', self.checkout())
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_expired_and_abandoned_keys_are_reused(self):
+        self.checkout()
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        CartItem.objects.create(cart=self.cart, product=self.products[0], quantity=1)
+        self.assertNotIn('Idempotent-Replayed', self.checkout())
+        self.assertEqual(Order.objects.count(), 2)
+
+        record = IdempotencyKey.objects.get()
+        IdempotencyKey.objects.filter(pk=record.pk).update(status_code=None, response=None)
+        with override_settings(IDEMPOTENCY_WAIT_TIMEOUT=0.1):
+            self.assertEqual(self.checkout().status_code, 409)
+        IdempotencyKey.objects.update(created_at=timezone.now() - timedelta(minutes=5))
+        self.assertEqual(self.checkout().status_code, 400)  # Cart is empty now
+
+    def test_server_errors_are_not_stored(self):
+        with mock.patch('shop.views.decrement_stock', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.checkout().status_code, 201)
+
+    def test_order_is_rolled_back_if_its_response_is_not_stored(self):
+        with mock.patch('shop.idempotency.encoders.JSONEncoder.default', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        self.assertFalse(Order.objects.exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.checkout().status_code, 201)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_retry_after_a_failed_response_replays_the_order(self):
+        # The order and its stored response committed; the client never got the reply
+        with mock.patch.object(FastJSONRenderer, 'render', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                self.checkout()
+        replay = self.checkout()
+        self.assertEqual((replay.status_code, replay['Idempotent-Replayed']), (201, 'true'))
+        self.assertEqual(Order.objects.count(), 1)
+        self.products[0].refresh_from_db()
+        self.assertEqual(self.products[0].stock, 8)
+
+    def test_process_payment_replay(self):
+        order_id = self.checkout().json()['orderId']
+        payment = Payment.objects.create(order_id=order_id, amount=Decimal('20.00'), paymentMethod='cash')
+        url = reverse('payment-process-payment', args=[payment.pk])
+        self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.client.post(url, HTTP_IDEMPOTENCY_KEY='pay-1')
+        self.assertEqual(Task.objects.filter(name__endswith='send_payment_receipt').count(), 1)
+
+        IdempotencyKey.objects.update(expires_at=timezone.now())
+        out = StringIO()
+        call_command('purge_idempotency_keys', stdout=out)
+        self.assertIn('Purged 2 expired idempotency keys', out.getvalue())
+
+
+class ConcurrentIdempotencyTests(TransactionTestCase):
+    def test_concurrent_duplicates_wait_for_the_first(self):
+        user = create_user('buyer@example.com')
+        product = seed_catalog(1, 1, stock=10)[0]
+        CartItem.objects.create(cart=ShoppingCart.objects.create(user=user), product=product, quantity=2)
+        barrier = threading.Barrier(4)
+        responses = []
+
+        def checkout():
+            client = APIClient()
+            client.force_authenticate(user)
+            barrier.wait()
+            try:
+                while True:
+                    try:
+                        responses.append(client.post(reverse('cart-checkout'), HTTP_IDEMPOTENCY_KEY='same'))
+                        return
+                    except OperationalError:
+                        # See ConcurrentCheckoutTests
+                        time.sleep(0.005)
+            finally:
+                connection.close()
+
+        workers = [threading.Thread(target=checkout) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual([response.status_code for response in responses], [201] * 4)
+        self.assertEqual(len({response.json()['orderId'] for response in responses}), 1)
+        self.assertEqual(Order.objects.count(), 1)
+        product.refresh_from_db()
+        self.assertEqual(product.stock, 8)
+
+
+class AdminChangelistTests(TestCase):
+    """Admin changelists run in a fixed number of queries, however many rows."""
+
+    def setUp(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', None))
+        self.products = seed_catalog(2, 5)
+
+    def assertChangelistBudget(self, model, budget, grow, params=''):
+        url = reverse(f'admin:shop_{model}_changelist') + params
+        grow(1)
+        with self.assertNumQueries(budget):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        grow(30)
+        with self.assertNumQueries(budget):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def grow_orders(self, n):
+        for i in range(n):
+            seed_orders(create_user(f'buyer{User.objects.count()}@example.com'), self.products, 1)
+
+    def grow_carts(self, n):
+        for i in range(n):
+            cart = ShoppingCart.objects.create(user=create_user(f'shopper{User.objects.count()}@example.com'))
+            for product in self.products[:3]:
+                CartItem.objects.create(cart=cart, product=product, quantity=2)
+
+    def test_orders(self):
+        self.assertChangelistBudget('order', 4, self.grow_orders)
+
+    def test_order_items(self):
+        self.assertChangelistBudget('orderitem', 4, self.grow_orders)
+
+    def test_payments(self):
+        self.assertChangelistBudget('payment', 4, self.grow_orders)
+
+    def test_products(self):
+        self.assertChangelistBudget('product', 4, lambda n: seed_catalog(1, n))
+
+    def test_carts(self):
+        self.assertChangelistBudget('shoppingcart', 4, self.grow_carts)
+
+    def test_cart_items_filtered_by_user(self):
+        user = create_user('picked@example.com')
+        CartItem.objects.create(cart=ShoppingCart.objects.create(user=user), product=self.products[0], quantity=1)
+        # Selected user: one more query to render its name in the filter
+        response = self.assertChangelistBudget('cartitem', 5, self.grow_carts, f'?cart__user={user.pk}')
+        self.assertEqual(response.context['cl'].result_count, 1)
+        self.assertContains(response, 'data-filter-query')
+        self.assertContains(response, 'picked@example.com')
+        self.assertContains(response, 'shop/admin/autocomplete_filter.js')
+        search = self.client.get(reverse('admin:autocomplete'), {
+            'app_label': 'shop', 'model_name': 'shoppingcart', 'field_name': 'user', 'term': 'picked',
+        })
+        self.assertEqual([result['text'] for result in search.json()['results']], ['picked@example.com'])
+
+    def test_estimated_count(self):
+        paginator = EstimatedCountPaginator(Order.objects.all(), 100)
+        # SQLite has no estimate: counted exactly
+        self.assertEqual(paginator.count, 0)
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=5_000_000):
+            self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 100).count, 5_000_000)
+        with mock.patch.object(EstimatedCountPaginator, 'estimated_count', return_value=20):
+            with self.assertNumQueries(1):
+                self.assertEqual(EstimatedCountPaginator(Order.objects.all(), 100).count, 0)
+
+
+class OrderStateTests(TestCase):
+    def setUp(self):
+        self.user = create_user('buyer@example.com')
+        self.products = seed_catalog(1, 4, stock=50)
+
+    def orders(self, count):
+        order_ids = [order.pk for order in seed_orders(self.user, self.products, count)]
+        add_sales(order_ids)
+        return Order.objects.filter(pk__in=order_ids)
+
+    def stock(self):
+        return list(Product.objects.order_by('pk').values_list('stock', flat=True))
+
+    def test_batch_cancel_restores_stock_in_fixed_queries(self):
+        first = self.orders(1)
+        with CaptureQueriesContext(connection) as one:
+            transition(first, 'cancelled')
+        # Each order holds 2 of up to three products
+        self.assertEqual(self.stock(), [52, 52, 52, 50])
+        many = self.orders(20)
+        with self.assertNumQueries(len(one)):
+            changed, invalid = transition(many, 'cancelled')
+        self.assertEqual((len(changed), invalid), (20, {}))
+        self.assertEqual(set(many.values_list('status', flat=True)), {'cancelled'})
+        expected = [50 + 2 * OrderItem.objects.filter(product=product).count() for product in self.products]
+        self.assertEqual(self.stock(), expected)
+        self.assertEqual(DailySales.objects.get(status='cancelled').orders, 21)
+        self.assertEqual(DailySales.objects.get(status='pending').orders, 0)
+
+    def test_invalid_transitions(self):
+        orders = self.orders(3)
+        first = orders.order_by('pk').first()
+        transition(Order.objects.filter(pk=first.pk), 'confirmed')
+        with self.assertRaises(InvalidTransition) as raised:
+            transition(orders, 'shipped')
+        self.assertEqual(set(raised.exception.invalid.values()), {'pending'})
+        self.assertEqual(orders.filter(status='shipped').count(), 0)
+
+        changed, invalid = transition(orders, 'shipped', strict=False)
+        self.assertEqual((changed, len(invalid)), ([first.pk], 2))
+        # Already shipped: neither changed nor invalid
+        self.assertEqual(transition(Order.objects.filter(pk=first.pk), 'shipped'), ([], {}))
+        with self.assertRaises(ValueError):
+            transition(orders, 'lost')
+
+    def test_cancel_and_payment_endpoints(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        confirmed, pending = self.orders(2).order_by('orderDate')
+        transition(Order.objects.filter(pk=confirmed.pk), 'confirmed')
+        response = client.post(reverse('order-cancel', args=[confirmed.pk]))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(client.post(reverse('order-cancel', args=[pending.pk])).status_code, 200)
+        self.assertEqual(self.stock(), [50, 52, 52, 52])
+
+        payment = pending.payments.get()
+        response = client.post(reverse('payment-process-payment', args=[payment.pk]))
+        self.assertEqual(response.data, {'error': 'Cannot confirm order in current status'})
+        payment.refresh_from_db()
+        self.assertEqual(payment.payment_status, 'pending')
+        self.assertFalse(Task.objects.filter(name__endswith='send_payment_receipt').exists())
+
+    def test_status_cannot_be_written_directly(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        order = self.orders(1).get()
+        stock = self.stock()
+        url = reverse('order-detail', args=[order.pk])
+        for new_status in ('cancelled', 'delivered'):
+            response = client.patch(url, {'status': new_status}, format='json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('status', response.data)
+        order.refresh_from_db()
+        self.assertEqual(order.status, 'pending')
+        self.assertEqual(self.stock(), stock)
+
+        response = client.post(reverse('order-list'), {
+            'user': self.user.pk, 'totalAmount': '10.00', 'status': 'delivered',
+            'order_items': [{'product': self.products[3].pk, 'quantity': 1, 'price': '10.00'}],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['status'], 'pending')
+
+        request = RequestFactory().get('/')
+        request.user = User.objects.create_superuser('admin', 'admin@example.com', None)
+        self.assertNotIn('status', admin.site._registry[Order].get_form(request, order).base_fields)
+
+    def test_admin_actions(self):
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', None))
+        orders = self.orders(4)
+        payments = Payment.objects.filter(order__in=orders)
+        transition(Order.objects.filter(pk=orders.first().pk), 'cancelled')
+        response = self.client.post(reverse('admin:shop_payment_changelist'), {
+            'action': 'mark_as_completed', '_selected_action': [str(pk) for pk in payments.values_list('pk', flat=True)],
+        }, follow=True)
+        self.assertContains(response, '1 order(s) left unconfirmed')
+        self.assertEqual(orders.filter(status='confirmed').count(), 3)
+        self.assertEqual(
+            dict(payments.values_list('order__status', 'payment_status').distinct()),
+            {'confirmed': 'completed', 'cancelled': 'pending'},
+        )
+
+        response = self.client.post(reverse('admin:shop_order_changelist'), {
+            'action': 'mark_as_shipped', '_selected_action': [str(pk) for pk in orders.values_list('pk', flat=True)],
+        }, follow=True)
+        self.assertContains(response, '3 order(s) marked as shipped')
+        self.assertContains(response, '1 order(s) skipped')
+        self.assertEqual(DailySales.objects.get(status='shipped').orders, 3)
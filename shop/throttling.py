@@ -0,0 +1,91 @@
+"""Token-bucket throttles for the auth endpoints.
+
+Each bucket holds up to N tokens and refills at N per period, from the
+``DEFAULT_THROTTLE_RATES`` entry of its scope (``'N/period'``, as for DRF's
+own throttles). A request takes one token or is refused with a wait time
+until the next one. Buckets live in the default cache so every worker sees
+the same counts; read-modify-write is not atomic, so concurrent requests can
+occasionally overdraw a bucket by a token or two.
+"""
+import hashlib
+import time
+
+from django.core.cache import cache as default_cache
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def parse_rate(rate):
+    """``'10/min'`` -> ``(10, 60)``; ``None`` disables the throttle."""
+    if rate is None:
+        return None, None
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+class TokenBucketThrottle(BaseThrottle):
+    scope = None
+    cache = default_cache
+    timer = time.time
+
+    def __init__(self):
+        rate = api_settings.DEFAULT_THROTTLE_RATES.get(self.scope)
+        self.capacity, self.period = parse_rate(rate)
+        self.wait_seconds = None
+
+    def get_cache_key(self, request, view):
+        raise NotImplementedError('.get_cache_key() must be overridden')
+
+    def take(self, bucket):
+        """Spend a token from ``bucket``; return ``(allowed, new bucket)``."""
+        now = self.timer()
+        tokens, stamp = bucket or (self.capacity, now)
+        tokens = min(self.capacity, tokens + (now - stamp) * self.capacity / self.period)
+        if tokens < 1:
+            self.wait_seconds = (1 - tokens) * self.period / self.capacity
+            return False, (tokens, now)
+        return True, (tokens - 1, now)
+
+    def allow_request(self, request, view):
+        key = None if self.capacity is None else self.get_cache_key(request, view)
+        if key is None:
+            return True
+        allowed, bucket = self.take(self.cache.get(key))
+        self.cache.set(key, bucket, self.period)
+        return allowed
+
+    async def aallow_request(self, request, view):
+        key = None if self.capacity is None else self.get_cache_key(request, view)
+        if key is None:
+            return True
+        allowed, bucket = self.take(await self.cache.aget(key))
+        await self.cache.aset(key, bucket, self.period)
+        return allowed
+
+    def wait(self):
+        return self.wait_seconds
+
+
+class AuthIPThrottle(TokenBucketThrottle):
+    """Login and registration attempts per client address."""
+    scope = 'auth_ip'
+
+    def get_cache_key(self, request, view):
+        return f'throttle:{self.scope}:{self.get_ident(request)}'
+
+
+class AuthAccountThrottle(TokenBucketThrottle):
+    """Login and registration attempts per email address, from any client."""
+    scope = 'auth_account'
+
+    def get_cache_key(self, request, view):
+        try:
+            email = request.data.get('email')
+        except AttributeError:
+            return None
+        if not isinstance(email, str) or not email.strip():
+            return None
+        digest = hashlib.sha256(email.strip().lower().encode()).hexdigest()
+        return f'throttle:{self.scope}:{digest}'
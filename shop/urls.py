@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
@@ -12,7 +13,15 @@ router.register(r'cart', views.ShoppingCartViewSet, basename='cart')
 router.register(r'reviews', views.ReviewViewSet, basename='review')
 router.register(r'addresses', views.UserAddressViewSet, basename='address')
 router.register(r'payments', views.PaymentViewSet, basename='payment')
+router.register(r'analytics/sales', views.SalesAnalyticsViewSet, basename='sales')
+router.register(r'metrics', views.MetricsViewSet, basename='metrics')
 
 urlpatterns = [
     path('', include(router.urls)),
-]
\ No newline at end of file
+]
+
+# Opt-in: serve read-only catalog GETs from native async views (for ASGI)
+if settings.ASYNC_CATALOG:
+    from . import async_views
+
+    urlpatterns = async_views.urlpatterns + urlpatterns
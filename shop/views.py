@@ -1,13 +1,41 @@
+from datetime import datetime, time, timedelta
+
 from rest_framework import viewsets, status, generics, permissions
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import PageNumberPagination
 from rest_framework.response import Response
 from django.db import transaction
+from django.db.models import Prefetch, Sum
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 from .models import (
     User, Category, Product, Order, OrderItem,
-    ShoppingCart, CartItem, Review, UserAddress, Payment
+    ShoppingCart, CartItem, Review, UserAddress, Payment,
+    DailySales, DailyCategorySales, DailyProductSales
 )
 from .serializers import *
+from .analytics import add_sales
+from .cache import CatalogCacheMixin
+from .catalog_io import EXPORTERS, export_rows
+from .fast_serializers import FastReadMixin
+from .order_export import EXPORTERS as ORDER_EXPORTERS, export_orders
+from .order_states import InvalidTransition, transition
+from .notifications import send_order_confirmation, send_payment_receipt
+from .queue import enqueue
+from .idempotency import idempotent
+from .metrics import exposition
+from .inventory import (
+    InsufficientStock, decrement_stock, lock_for_cart, reserve_lines, reserve_stock, with_available
+)
+from .pagination import (
+    ProductCursorPagination, OrderCursorPagination,
+    ReviewCursorPagination, PaymentCursorPagination
+)
+from .search import search_products
+from .throttling import AuthAccountThrottle, AuthIPThrottle
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated, IsAdminUser, AllowAny
 
@@ -23,37 +51,54 @@ class UserViewSet(viewsets.ModelViewSet):
         return Response(serializer.data)
 
 
+def register_user(data):
+    """Create an account from ``data``; return ``(response data, status)``.
+
+    Shared by ``AuthViewSet`` and the async auth views, which run it off the
+    request thread because it hashes the password.
+    """
+    serializer = UserRegistrationSerializer(data=data)
+    if serializer.is_valid():
+        user = serializer.save()
+        refresh = RefreshToken.for_user(user)
+        return {
+            'user': UserSerializer(user).data,
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        }, status.HTTP_201_CREATED
+    return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+
+def login_user(data):
+    """Check the credentials in ``data``; return ``(response data, status)``."""
+    serializer = LoginSerializer(data=data)
+    if serializer.is_valid():
+        user = serializer.validated_data['user']
+        refresh = RefreshToken.for_user(user)
+        return {
+            'user': UserSerializer(user).data,
+            'refresh': str(refresh),
+            'access': str(refresh.access_token),
+        }, status.HTTP_200_OK
+    return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+
 class AuthViewSet(viewsets.ViewSet):
     permission_classes = [AllowAny]
+    throttle_classes = [AuthIPThrottle, AuthAccountThrottle]
 
     @action(detail=False, methods=['post'])
     def register(self, request):
-        serializer = UserRegistrationSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.save()
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'user': UserSerializer(user).data,
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            }, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data, response_status = register_user(request.data)
+        return Response(data, status=response_status)
 
     @action(detail=False, methods=['post'])
     def login(self, request):
-        serializer = LoginSerializer(data=request.data)
-        if serializer.is_valid():
-            user = serializer.validated_data['user']
-            refresh = RefreshToken.for_user(user)
-            return Response({
-                'user': UserSerializer(user).data,
-                'refresh': str(refresh),
-                'access': str(refresh.access_token),
-            })
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        data, response_status = login_user(request.data)
+        return Response(data, status=response_status)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(CatalogCacheMixin, viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
@@ -63,42 +108,107 @@ class CategoryViewSet(viewsets.ModelViewSet):
         return [AllowAny()]
 
 
-class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.filter(is_active=True)
+class ProductViewSet(CatalogCacheMixin, FastReadMixin, viewsets.ModelViewSet):
+    queryset = Product.objects.filter(is_active=True).select_related('category')
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
 
     def get_permissions(self):
-        if self.action in ['create', 'update', 'partial_update', 'destroy']:
+        if self.action in ['create', 'update', 'partial_update', 'destroy', 'export']:
             return [IsAdminUser()]
         return [AllowAny()]
 
+    @property
+    def paginator(self):
+        # Ranked search results have no stable cursor ordering
+        if self.search_query:
+            self.pagination_class = PageNumberPagination
+        return super().paginator
+
+    @property
+    def search_query(self):
+        return self.request.query_params.get('q', '').strip()
+
     def get_queryset(self):
         queryset = super().get_queryset()
         category = self.request.query_params.get('category')
         if category:
             queryset = queryset.filter(category_id=category)
+        if self.search_query and self.action == 'list':
+            queryset = search_products(queryset, self.search_query)
         return queryset
 
+    @action(detail=True, methods=['get'])
+    def availability(self, request, pk=None):
+        product = get_object_or_404(with_available(Product.objects.filter(is_active=True)), pk=pk)
+        return Response({
+            'product': product.pk,
+            'stock': product.stock,
+            'reserved': product.reserved,
+            'available': product.available,
+        })
 
-class OrderViewSet(viewsets.ModelViewSet):
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        # ?format= is taken by DRF's renderer negotiation
+        output = request.query_params.get('output', 'csv')
+        if output not in EXPORTERS:
+            return Response({'error': 'output must be csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+        exporter, content_type = EXPORTERS[output]
+        response = StreamingHttpResponse(exporter(export_rows()), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="catalog.{output}"'
+        return response
+
+
+def parse_bound(value, inclusive_day_end=False):
+    """Datetime for an ISO date or datetime query parameter, or None if invalid.
+
+    A bare date means the start of that day, or the start of the next one
+    when it closes a range, so ``until=2024-01-31`` includes the 31st.
+    """
+    try:
+        day = parse_date(value)
+        moment = parse_datetime(value) if day is None else None
+    except ValueError:
+        return None
+    if day is not None:
+        if inclusive_day_end:
+            day += timedelta(days=1)
+        moment = datetime.combine(day, time.min)
+    if moment is None:
+        return None
+    if timezone.is_naive(moment):
+        moment = timezone.make_aware(moment)
+    return moment
+
+
+class OrderViewSet(FastReadMixin, viewsets.ModelViewSet):
     serializer_class = OrderSerializer
+    pagination_class = OrderCursorPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Order.objects.select_related('user').prefetch_related(
+            Prefetch('order_items', queryset=OrderItem.objects.select_related('product'))
+        )
         if user.is_staff:
-            return Order.objects.all()
-        return Order.objects.filter(user=user)
+            return queryset
+        return queryset.filter(user=user)
 
     def get_serializer_class(self):
         if self.action == 'create':
             return CreateOrderSerializer
         return OrderSerializer
 
+    @idempotent
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         if serializer.is_valid():
-            order = serializer.save()
+            try:
+                order = serializer.save()
+            except InsufficientStock:
+                return Response({'error': 'Insufficient stock'}, status=status.HTTP_400_BAD_REQUEST)
             return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -106,61 +216,145 @@ class OrderViewSet(viewsets.ModelViewSet):
     def cancel(self, request, pk=None):
         order = self.get_object()
         if order.status == 'pending':
-            order.status = 'cancelled'
-            order.save()
-
-            # Restore product stock
-            for item in order.order_items.all():
-                product = item.product
-                product.stock += item.quantity
-                product.save()
-
-            return Response({'status': 'Order cancelled'})
+            try:
+                # Checked again under the row lock; puts the items back in stock
+                transition(Order.objects.filter(pk=order.pk), 'cancelled', from_statuses={'pending'})
+            except InvalidTransition:
+                pass
+            else:
+                return Response({'status': 'Order cancelled'})
         return Response(
             {'error': 'Cannot cancel order in current status'},
             status=status.HTTP_400_BAD_REQUEST
         )
 
+    @action(detail=False, methods=['get'], permission_classes=[IsAdminUser])
+    def export(self, request):
+        output = request.query_params.get('output', 'csv')
+        if output not in ORDER_EXPORTERS:
+            return Response({'error': 'output must be csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+
+        queryset = Order.objects.all()
+        for param, lookup in (('since', 'orderDate__gte'), ('until', 'orderDate__lt')):
+            value = request.query_params.get(param)
+            if value:
+                bound = parse_bound(value, inclusive_day_end=param == 'until')
+                if bound is None:
+                    return Response({'error': f'Invalid {param} date'}, status=status.HTTP_400_BAD_REQUEST)
+                queryset = queryset.filter(**{lookup: bound})
+        statuses = [value for value in request.query_params.get('status', '').split(',') if value]
+        if statuses:
+            if not set(statuses) <= set(dict(Order.ORDER_STATUS_CHOICES)):
+                return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = queryset.filter(status__in=statuses)
+
+        exporter, content_type = ORDER_EXPORTERS[output]
+        response = StreamingHttpResponse(exporter(export_orders(queryset)), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="orders.{output}"'
+        return response
+
 
 class ShoppingCartViewSet(viewsets.ModelViewSet):
     serializer_class = ShoppingCartSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return ShoppingCart.objects.filter(user=self.request.user)
+        return ShoppingCart.objects.filter(user=self.request.user).with_totals().select_related(
+            'user'
+        ).prefetch_related(
+            Prefetch('cart_items', queryset=CartItem.objects.with_total_price().select_related('product'))
+        )
 
     def get_object(self):
-        cart, created = ShoppingCart.objects.get_or_create(user=self.request.user)
+        cart, created = self.get_queryset().get_or_create(user=self.request.user)
         return cart
 
     @action(detail=False, methods=['post'])
     def add_item(self, request):
         serializer = AddToCartSerializer(data=request.data)
         if serializer.is_valid():
-            cart = self.get_object()
+            cart, created = ShoppingCart.objects.get_or_create(user=request.user)
             product = serializer.validated_data['product']
             quantity = serializer.validated_data['quantity']
 
-            cart_item, created = CartItem.objects.get_or_create(
-                cart=cart,
-                product=product,
-                defaults={'quantity': quantity}
-            )
-
-            if not created:
-                cart_item.quantity += quantity
-                cart_item.save()
+            try:
+                with transaction.atomic():
+                    cart_item, created = CartItem.objects.select_for_update().get_or_create(
+                        cart=cart,
+                        product=product,
+                        defaults={'quantity': quantity}
+                    )
+
+                    if not created:
+                        cart_item.quantity += quantity
+
+                    # Hold the stock for this line; fails if other carts already hold it
+                    reserve_stock(cart_item)
+                    if not created:
+                        cart_item.save()
+            except InsufficientStock:
+                return Response(
+                    {'error': 'Insufficient stock'},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
             return Response(CartItemSerializer(cart_item).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+    @action(detail=False, methods=['post'])
+    def set_items(self, request):
+        """Set the quantity of many cart lines at once, in a fixed number of queries.
+
+        With ``replace`` the cart ends up holding exactly ``items``; otherwise
+        lines for other products are kept.
+        """
+        serializer = SetCartItemsSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        quantities = {line['product_id']: line['quantity'] for line in serializer.validated_data['items']}
+        cart, created = ShoppingCart.objects.get_or_create(user=request.user)
+
+        with transaction.atomic():
+            products = {product.pk: product for product in lock_for_cart(cart, quantities)}
+            missing = sorted(set(quantities) - set(products))
+            if missing:
+                return Response(
+                    {'error': 'Product not found', 'products': missing},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            short = [
+                product_id for product_id, quantity in quantities.items()
+                if quantity > products[product_id].stock - products[product_id].held_elsewhere
+            ]
+            if short:
+                return Response(
+                    {'error': 'Insufficient stock', 'products': short},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+
+            # INSERT ... ON CONFLICT (cart_id, product_id) DO UPDATE, backed by unique_together
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id, quantity=quantity)
+                 for product_id, quantity in quantities.items()],
+                update_conflicts=True,
+                unique_fields=['cart', 'product'],
+                update_fields=['quantity'],
+            )
+            if serializer.validated_data['replace']:
+                CartItem.objects.filter(cart=cart).exclude(product_id__in=quantities).delete()
+            # Re-read the lines: rows that already existed keep their own primary keys
+            reserve_lines(CartItem.objects.filter(cart=cart, product_id__in=quantities))
+
+        return Response(self.get_serializer(self.get_queryset().get(pk=cart.pk)).data)
+
     @action(detail=False, methods=['post'])
     def remove_item(self, request):
         product_id = request.data.get('product_id')
-        cart = self.get_object()
+        cart, created = ShoppingCart.objects.get_or_create(user=request.user)
 
         try:
             cart_item = CartItem.objects.get(cart=cart, product_id=product_id)
+            # Deleting the line releases its stock reservation
             cart_item.delete()
             return Response({'status': 'Item removed from cart'})
         except CartItem.DoesNotExist:
@@ -170,51 +364,71 @@ class ShoppingCartViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=False, methods=['post'])
+    @idempotent
     def checkout(self, request):
-        cart = self.get_object()
-        cart_items = cart.cart_items.all()
+        cart, created = ShoppingCart.objects.get_or_create(user=request.user)
 
-        if not cart_items:
-            return Response(
-                {'error': 'Cart is empty'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-
-        with transaction.atomic():
-            # Create order
-            total_amount = sum(item.get_total_price() for item in cart_items)
-            order = Order.objects.create(
-                user=request.user,
-                totalAmount=total_amount
-            )
-
-            # Create order items
-            for cart_item in cart_items:
-                OrderItem.objects.create(
-                    order=order,
-                    product=cart_item.product,
-                    quantity=cart_item.quantity,
-                    price=cart_item.product.price
+        try:
+            with transaction.atomic():
+                cart_items = list(
+                    CartItem.objects.select_for_update(of=('self',))
+                    .filter(cart=cart)
+                    .select_related('product')
+                )
+                if not cart_items:
+                    return Response(
+                        {'error': 'Cart is empty'},
+                        status=status.HTTP_400_BAD_REQUEST
+                    )
+
+                # Take stock for every line at once; fails the whole order if any line is short
+                decrement_stock(
+                    {item.product_id: item.quantity for item in cart_items},
+                    held_by=[item.pk for item in cart_items]
                 )
 
-                # Update product stock
-                product = cart_item.product
-                product.stock -= cart_item.quantity
-                product.save()
+                # Create order
+                total_amount = sum(item.get_total_price() for item in cart_items)
+                order = Order.objects.create(
+                    user=request.user,
+                    totalAmount=total_amount
+                )
 
-            # Clear cart
-            cart.cart_items.all().delete()
+                # Create order items
+                OrderItem.objects.bulk_create([
+                    OrderItem(
+                        order=order,
+                        product=cart_item.product,
+                        quantity=cart_item.quantity,
+                        price=cart_item.product.price
+                    )
+                    for cart_item in cart_items
+                ])
+                add_sales([order.pk])
+                enqueue(send_order_confirmation, str(order.pk))
+
+                # Clear cart, releasing the lines' reservations
+                CartItem.objects.filter(pk__in=[item.pk for item in cart_items]).delete()
+        except InsufficientStock:
+            return Response(
+                {'error': 'Insufficient stock'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
+        order = Order.objects.select_related('user').prefetch_related(
+            Prefetch('order_items', queryset=OrderItem.objects.select_related('product'))
+        ).get(pk=order.pk)
         return Response(OrderSerializer(order).data, status=status.HTTP_201_CREATED)
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ReviewViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = Review.objects.all()
     serializer_class = ReviewSerializer
+    pagination_class = ReviewCursorPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Review.objects.filter(user=self.request.user)
+        return Review.objects.filter(user=self.request.user).select_related('user', 'product')
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
@@ -223,9 +437,10 @@ class ReviewViewSet(viewsets.ModelViewSet):
     def product_reviews(self, request):
         product_id = request.query_params.get('product_id')
         if product_id:
-            reviews = Review.objects.filter(product_id=product_id)
-            serializer = self.get_serializer(reviews, many=True)
-            return Response(serializer.data)
+            reviews = Review.objects.filter(product_id=product_id).select_related('user', 'product')
+            page = self.paginate_queryset(reviews)
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return Response(
             {'error': 'product_id parameter is required'},
             status=status.HTTP_400_BAD_REQUEST
@@ -257,24 +472,99 @@ class UserAddressViewSet(viewsets.ModelViewSet):
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
+    pagination_class = PaymentCursorPagination
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         user = self.request.user
+        queryset = Payment.objects.select_related('order__user')
         if user.is_staff:
-            return Payment.objects.all()
-        return Payment.objects.filter(order__user=user)
+            return queryset
+        return queryset.filter(order__user=user)
 
     @action(detail=True, methods=['post'])
+    @idempotent
     def process_payment(self, request, pk=None):
         payment = self.get_object()
-        # Integration with payment gateway
-        # For now, mark it as completed
-        payment.payment_status = 'completed'
-        payment.save()
+        try:
+            with transaction.atomic():
+                # Integration with payment gateway
+                # For now, mark it as completed
+                payment.payment_status = 'completed'
+                payment.save()
+
+                # Update order status
+                transition(Order.objects.filter(pk=payment.order_id), 'confirmed')
+
+                enqueue(send_payment_receipt, str(payment.pk))
+        except InvalidTransition:
+            return Response(
+                {'error': 'Cannot confirm order in current status'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Update order status
-        payment.order.status = 'confirmed'
-        payment.order.save()
+        return Response({'status': 'Payment processed successfully'})
+
+
+class SalesAnalyticsViewSet(viewsets.ViewSet):
+    """Sales over a date range, read from the daily rollups.
+
+    ``since``/``until`` are inclusive dates (default: the last 30 days) and
+    ``status`` a comma-separated list (default: every status but cancelled).
+    """
+    permission_classes = [IsAdminUser]
+
+    def filter_rollups(self, model):
+        params = self.request.query_params
+        try:
+            until = parse_date(params['until']) if params.get('until') else timezone.localdate()
+            since = parse_date(params['since']) if params.get('since') else until - timedelta(days=29)
+        except (TypeError, ValueError):
+            since = until = None
+        if since is None or until is None:
+            raise ValidationError({'error': 'since and until must be dates (YYYY-MM-DD)'})
+        statuses = [value for value in params.get('status', '').split(',') if value]
+        if not set(statuses) <= set(dict(Order.ORDER_STATUS_CHOICES)):
+            raise ValidationError({'error': 'Invalid status'})
+        queryset = model.objects.filter(day__gte=since, day__lte=until)
+        if statuses:
+            return queryset.filter(status__in=statuses)
+        return queryset.exclude(status='cancelled')
+
+    def summarize(self, queryset, *fields):
+        return queryset.values(*fields).annotate(
+            orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue')
+        )
+
+    def list(self, request):
+        rollups = self.filter_rollups(DailySales)
+        totals = rollups.aggregate(orders=Sum('orders'), units=Sum('units'), revenue=Sum('revenue'))
+        days = self.summarize(rollups, 'day').order_by('day')
+        return Response({
+            'totals': SalesSummarySerializer({key: value or 0 for key, value in totals.items()}).data,
+            'days': DailySalesSerializer(days, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def categories(self, request):
+        rollups = self.summarize(self.filter_rollups(DailyCategorySales), 'category_id', 'category__name')
+        return Response(CategorySalesSerializer(rollups.order_by('-revenue', 'category_id'), many=True).data)
+
+    @action(detail=False, methods=['get'])
+    def products(self, request):
+        try:
+            limit = min(int(request.query_params.get('limit', 50)), 1000)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        if limit < 1:
+            return Response({'error': 'limit must be at least 1'}, status=status.HTTP_400_BAD_REQUEST)
+        rollups = self.summarize(self.filter_rollups(DailyProductSales), 'product_id', 'product__name')
+        return Response(ProductSalesSerializer(rollups.order_by('-revenue', 'product_id')[:limit], many=True).data)
+
+
+class MetricsViewSet(viewsets.ViewSet):
+    """Request timing histograms of this process, in the Prometheus text format."""
+    permission_classes = [IsAdminUser]
 
-        return Response({'status': 'Payment processed successfully'})
\ No newline at end of file
+    def list(self, request):
+        return HttpResponse(exposition(), content_type='text/plain; version=0.0.4; charset=utf-8')